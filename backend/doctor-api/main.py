@@ -13,17 +13,25 @@ import os
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 from shared.database import connect_db, disconnect_db, get_prisma
+from shared.log import configure_logging, get_logger, shutdown_logging
 from shared.models import DoctorCreate, DoctorResponse, BaseResponse
 from prisma import Prisma
 from typing import List, Optional
 
 
+configure_logging("doctor-api")
+log = get_logger("doctor.api")
+
+
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     """Lifecycle manager for database connection"""
     await connect_db()
+    log.info("startup")
     yield
     await disconnect_db()
+    log.info("shutdown")
+    shutdown_logging()
 
 
 app = FastAPI(
@@ -100,6 +108,7 @@ async def create_doctor(
     except HTTPException:
         raise
     except Exception as e:
+        log.exception("create_doctor.failed")
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"Failed to create doctor: {str(e)}"
@@ -177,6 +186,7 @@ async def update_doctor(
         )
         return updated_doctor
     except Exception as e:
+        log.exception("update_doctor.failed")
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"Failed to update doctor: {str(e)}"
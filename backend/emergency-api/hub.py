@@ -0,0 +1,238 @@
+"""
+Emergency Event Hub
+Fan-out of emergency events to every connected SSE client. Each
+subscriber owns a bounded queue; publishing serialises the event once and
+offers it to every queue without awaiting, so one slow dashboard never
+delays the others.
+
+Slow-consumer policy when a subscriber's queue is full
+(EMERGENCY_SLOW_CONSUMER):
+    drop_oldest   discard the oldest queued event to make room (default)
+    disconnect    close the subscription; the client reconnects
+
+The last EMERGENCY_REPLAY_BUFFER_SIZE events are kept in a ring buffer so
+reconnecting clients (Last-Event-ID) are caught up from memory; older gaps
+fall back to the EmergencyEvent table.
+
+Event ids are drawn before their transaction commits, so id N can reach a
+client before a lower id that commits later. Replay therefore starts
+EMERGENCY_REPLAY_WINDOW ids before Last-Event-ID: a client is guaranteed
+every event whose id is above Last-Event-ID minus the window, and receives
+some it already has again, which it drops by id.
+
+Subscribers may filter by hospital, severity, alert type and patient set.
+Each subscription is indexed under one of its filters (the most selective)
+and carries a predicate compiled from the others, so publishing only
+visits the unfiltered subscribers and those indexed under the event's
+values.
+"""
+
+from collections import deque
+from typing import Any, Callable, Deque, Dict, FrozenSet, Iterable, List, Optional, Set, Tuple
+import asyncio
+import json
+import os
+import time
+
+from shared.metrics import metrics
+
+SUBSCRIBER_QUEUE_SIZE = int(os.getenv("EMERGENCY_SUBSCRIBER_QUEUE_SIZE", "256"))
+SLOW_CONSUMER_POLICY = os.getenv("EMERGENCY_SLOW_CONSUMER", "drop_oldest")  # drop_oldest | disconnect
+REPLAY_BUFFER_SIZE = int(os.getenv("EMERGENCY_REPLAY_BUFFER_SIZE", "1000"))
+# Ids before Last-Event-ID replayed again, for events that committed after it
+REPLAY_WINDOW = int(os.getenv("EMERGENCY_REPLAY_WINDOW", "50"))
+
+# (SSE event name, JSON data, publish time from time.monotonic(), event id, data)
+Event = Tuple[str, str, float, Optional[int], Dict[str, Any]]
+
+# Filter key -> event data field, most selective first (the index key)
+FILTER_FIELDS = {
+    "patient": "patient_id",
+    "hospital": "hospital_id",
+    "alert_type": "alert_type",
+    "severity": "severity"
+}
+
+Filters = Dict[str, FrozenSet[str]]
+
+
+def parse_filters(**values: Optional[Iterable[Any]]) -> Filters:
+    """Filter key -> allowed values as strings; empty filters are dropped"""
+    filters = {}
+    for key, allowed in values.items():
+        if key not in FILTER_FIELDS:
+            raise ValueError(f"unknown filter {key}")
+        if allowed:
+            filters[key] = frozenset(str(value) for value in allowed)
+    return filters
+
+
+def compile_predicate(filters: Filters) -> Callable[[Dict[str, Any]], bool]:
+    """One closure checking every filter against event data"""
+    checks = tuple((FILTER_FIELDS[key], allowed) for key, allowed in filters.items())
+    if not checks:
+        return lambda data: True
+
+    def matches(data: Dict[str, Any]) -> bool:
+        for field, allowed in checks:
+            value = data.get(field)
+            if value is None or str(value) not in allowed:
+                return False
+        return True
+    return matches
+
+
+class Subscription:
+    """One SSE client's bounded event queue and event filters"""
+
+    def __init__(
+        self,
+        filters: Optional[Filters] = None,
+        maxsize: int = SUBSCRIBER_QUEUE_SIZE,
+        policy: str = SLOW_CONSUMER_POLICY
+    ):
+        self.queue: "asyncio.Queue[Event]" = asyncio.Queue(maxsize=maxsize)
+        self.policy = policy
+        self.closed = False
+        self.dropped = 0
+        self.filters = filters or {}
+        self.matches = compile_predicate(self.filters)
+        # Index under the most selective filter; the rest stay in the predicate
+        self.index_key = next((key for key in FILTER_FIELDS if key in self.filters), None)
+        self.residual = compile_predicate({k: v for k, v in self.filters.items() if k != self.index_key})
+
+    def offer(self, event: Event) -> bool:
+        """Queue an event without waiting; False if the subscriber had to be closed"""
+        if self.closed:
+            return False
+        try:
+            self.queue.put_nowait(event)
+            return True
+        except asyncio.QueueFull:
+            pass
+        if self.policy == "disconnect":
+            self.close()
+            return False
+        self.queue.get_nowait()
+        self.queue.put_nowait(event)
+        self.dropped += 1
+        metrics.incr("emergency.dropped_events")
+        return True
+
+    def close(self) -> None:
+        if not self.closed:
+            self.closed = True
+            metrics.incr("emergency.slow_disconnects")
+            # Wake the reader so it notices
+            if self.queue.full():
+                self.queue.get_nowait()
+            self.queue.put_nowait(("", "", 0.0, None, {}))
+
+    async def get(self, timeout: float) -> Optional[Event]:
+        """Next event, or None on timeout; raises ConnectionAbortedError once closed"""
+        try:
+            event = await asyncio.wait_for(self.queue.get(), timeout=timeout)
+        except asyncio.TimeoutError:
+            return None
+        if self.closed:
+            raise ConnectionAbortedError("subscriber too slow")
+        metrics.observe("emergency.delivery_lag", time.monotonic() - event[2])
+        return event
+
+
+class EventHub:
+    """
+    Broadcast hub (one per process)
+    Usage:
+        subscription = hub.subscribe()
+        try:
+            event = await subscription.get(timeout=30)
+        finally:
+            hub.unsubscribe(subscription)
+        hub.publish("emergency_alert", {...})
+    """
+
+    def __init__(self, replay_size: int = REPLAY_BUFFER_SIZE):
+        self.subscribers: Set[Subscription] = set()
+        self.unfiltered: Set[Subscription] = set()
+        # filter key -> value -> subscriptions indexed under it
+        self.index: Dict[str, Dict[str, Set[Subscription]]] = {key: {} for key in FILTER_FIELDS}
+        self.recent: Deque[Event] = deque(maxlen=replay_size)
+        # Highest id pushed out of the ring buffer
+        self.evicted_id = 0
+
+    def subscribe(self, filters: Optional[Filters] = None, **options: Any) -> Subscription:
+        subscription = Subscription(filters, **options)
+        self.subscribers.add(subscription)
+        if subscription.index_key is None:
+            self.unfiltered.add(subscription)
+        else:
+            values = self.index[subscription.index_key]
+            for value in subscription.filters[subscription.index_key]:
+                values.setdefault(value, set()).add(subscription)
+        metrics.set_gauge("emergency.subscribers", len(self.subscribers))
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription) -> None:
+        if subscription not in self.subscribers:
+            return
+        self.subscribers.discard(subscription)
+        if subscription.index_key is None:
+            self.unfiltered.discard(subscription)
+        else:
+            values = self.index[subscription.index_key]
+            for value in subscription.filters[subscription.index_key]:
+                indexed = values.get(value)
+                if indexed is not None:
+                    indexed.discard(subscription)
+                    if not indexed:
+                        del values[value]
+        metrics.set_gauge("emergency.subscribers", len(self.subscribers))
+
+    def interested(self, data: Dict[str, Any]) -> List[Subscription]:
+        """Subscribers whose filters accept the event data"""
+        found = list(self.unfiltered)
+        for key, field in FILTER_FIELDS.items():
+            values = self.index[key]
+            value = data.get(field)
+            if not values or value is None:
+                continue
+            for subscription in values.get(str(value), ()):
+                if subscription.residual(data):
+                    found.append(subscription)
+        return found
+
+    def replay_since(self, last_id: int, window: Optional[int] = None) -> Optional[List[Event]]:
+        """
+        Buffered events with an id above last_id - window, in arrival order
+        None when the buffer does not reach back that far (read the database instead).
+        Call right after subscribe(), with no await in between, so nothing falls in the gap.
+        """
+        floor = last_id - (REPLAY_WINDOW if window is None else window)
+        if not self.recent or self.evicted_id > floor or self.recent[0][3] > floor + 1:
+            return None
+        return [event for event in self.recent if event[3] > floor]
+
+    def publish(self, name: str, data: Dict[str, Any], event_id: Optional[int] = None) -> int:
+        """Offer an event to every interested subscriber; returns how many accepted it"""
+        event = (name, json.dumps(data, default=str), time.monotonic(), event_id, data)
+        if event_id is not None:
+            if len(self.recent) == self.recent.maxlen:
+                self.evicted_id = max(self.evicted_id, self.recent[0][3])
+            self.recent.append(event)
+        delivered = 0
+        deepest = 0
+        for subscription in self.interested(data):
+            if subscription.offer(event):
+                delivered += 1
+                deepest = max(deepest, subscription.queue.qsize())
+            else:
+                self.unsubscribe(subscription)
+        metrics.incr("emergency.published")
+        metrics.incr("emergency.deliveries", delivered)
+        # Queue depth of the furthest-behind subscriber
+        metrics.set_gauge("emergency.max_lag_events", deepest)
+        return delivered
+
+
+hub = EventHub()
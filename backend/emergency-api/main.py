@@ -6,33 +6,62 @@ Port: 8004
 
 from fastapi import FastAPI, HTTPException, Depends, status, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import StreamingResponse
 from contextlib import asynccontextmanager
 from sse_starlette.sse import EventSourceResponse
 import sys
 import os
-import asyncio
 import json
+import time
 from typing import AsyncGenerator, List, Optional
 from datetime import datetime
 
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 from shared.database import connect_db, disconnect_db, get_prisma
+from shared.log import configure_logging, get_logger, shutdown_logging
+from shared.metrics import metrics
+from shared.emergency import ACTIVE_STATUSES, create_emergency_alert as create_alert, create_emergency_alerts
+from shared.events import (
+    add_handler,
+    publish_event,
+    remove_handler,
+    start_event_listener,
+    stop_event_listener,
+    use_local_bus
+)
 from shared.models import EmergencyAlertCreate, EmergencyAlertResponse, BaseResponse
 from prisma import Prisma
 
+from hub import REPLAY_WINDOW, Event, Filters, hub, parse_filters
+from stats import counters, start_counters, stop_counters
+
+# Longest gap replayed from the database; beyond it clients are told to resync
+REPLAY_MAX_EVENTS = int(os.getenv("EMERGENCY_REPLAY_MAX_EVENTS", "1000"))
+# Most alerts accepted by one POST /api/emergency/alerts/bulk
+BULK_MAX_ALERTS = int(os.getenv("EMERGENCY_BULK_MAX_ALERTS", "500"))
+
 
-# Global event queue for SSE
-emergency_queue: asyncio.Queue = asyncio.Queue()
+configure_logging("emergency-api")
+log = get_logger("emergency.api")
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     """Lifecycle manager for database connection"""
     await connect_db()
+    add_handler(hub.publish)
+    add_handler(counters.apply)
+    start_event_listener(get_prisma())
+    await start_counters(get_prisma())
+    log.info("startup")
     yield
+    await stop_counters()
+    await stop_event_listener()
+    remove_handler(counters.apply)
+    remove_handler(hub.publish)
     await disconnect_db()
+    log.info("shutdown")
+    shutdown_logging()
 
 
 app = FastAPI(
@@ -56,32 +85,145 @@ app.add_middleware(
 # ============================================================================
 
 async def broadcast_emergency(alert_data: dict):
-    """Broadcast emergency alert to all SSE subscribers"""
-    await emergency_queue.put(alert_data)
+    """Broadcast emergency alert to the SSE subscribers of every worker"""
+    await publish_event(get_prisma(), "emergency_alert", alert_data)
 
 
-async def event_generator(request: Request) -> AsyncGenerator[dict, None]:
-    """Generate server-sent events for emergency alerts"""
-    while True:
-        if await request.is_disconnected():
-            break
-        
-        try:
-            # Wait for new emergency with timeout
-            alert = await asyncio.wait_for(emergency_queue.get(), timeout=30.0)
-            yield {
-                "event": "emergency_alert",
-                "data": json.dumps(alert)
-            }
-        except asyncio.TimeoutError:
-            # Send keepalive ping
-            yield {
-                "event": "ping",
-                "data": json.dumps({"timestamp": datetime.now().isoformat()})
-            }
-        except Exception as e:
-            print(f"SSE Error: {e}")
-            break
+async def stored_events_since(db: Prisma, last_id: int) -> Optional[List[Event]]:
+    """
+    Stored events with an id above last_id - REPLAY_WINDOW, oldest first; None if they are gone or too many
+    The window covers events that committed after last_id was sent (see hub.py).
+    """
+    if use_local_bus() or not await db.emergencyevent.find_unique(where={"id": last_id}):
+        return None  # pruned (or never stored): the gap cannot be filled
+    rows = await db.emergencyevent.find_many(
+        where={"id": {"gt": last_id - REPLAY_WINDOW}},
+        order={"id": "asc"},
+        take=REPLAY_MAX_EVENTS + 1
+    )
+    if len(rows) > REPLAY_MAX_EVENTS:
+        return None
+    return [(row.event, row.data, time.monotonic(), row.id, json.loads(row.data)) for row in rows]
+
+
+def split_param(value: Optional[str]) -> List[str]:
+    """Comma-separated query parameter as a list"""
+    return [item.strip() for item in (value or "").split(",") if item.strip()]
+
+
+def alert_response(alert) -> EmergencyAlertResponse:
+    """Map an EmergencyAlert row onto the API's snake_case response model"""
+    return EmergencyAlertResponse(
+        id=alert.id,
+        alertId=alert.alertId,
+        patientId=alert.patientId,
+        hospitalId=alert.hospitalId,
+        alert_type=alert.alertType,
+        severity=alert.severity,
+        description=alert.description,
+        triggered_by=alert.triggeredBy,
+        trigger_data=alert.triggerData,
+        location=alert.location,
+        status=alert.status,
+        createdAt=alert.createdAt,
+        updatedAt=alert.updatedAt
+    )
+
+
+def status_event(event: str, alert, status: str, **fields) -> dict:
+    """Status-change broadcast, carrying the fields stream filters and counters use"""
+    return {
+        "event": event,
+        "alert_id": alert.alertId,
+        **fields,
+        "status": status,
+        "previous_status": alert.status,
+        "patient_id": alert.patientId,
+        "hospital_id": alert.hospital.name if alert.hospital else None,
+        "alert_type": alert.alertType,
+        "severity": alert.severity,
+        "timestamp": datetime.now().isoformat()
+    }
+
+
+async def change_status(db: Prisma, alert, data: dict) -> None:
+    """
+    Update an alert only if its status is still the one it was read with
+    A concurrent change raises 409 instead, so each transition is broadcast
+    (and moves the stats counters) exactly once.
+    """
+    changed = await db.emergencyalert.update_many(
+        where={"alertId": alert.alertId, "status": alert.status},
+        data=data
+    )
+    if changed != 1:
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail=f"Alert {alert.alertId} was updated concurrently, retry"
+        )
+
+
+async def event_generator(
+    request: Request,
+    last_event_id: Optional[int] = None,
+    filters: Optional[Filters] = None
+) -> AsyncGenerator[dict, None]:
+    """Generate server-sent events for emergency alerts, first replaying any missed since last_event_id"""
+    subscription = hub.subscribe(filters)
+    try:
+        replayed = set()
+        if last_event_id is not None:
+            missed = hub.replay_since(last_event_id)
+            if missed is not None:
+                metrics.incr("emergency.replay_memory")
+            else:
+                metrics.incr("emergency.replay_database")
+                missed = await stored_events_since(get_prisma(), last_event_id)
+            if missed is None:
+                # Too far behind: the client reloads the alert list instead
+                metrics.incr("emergency.replay_resync")
+                yield {
+                    "event": "resync",
+                    "data": json.dumps({"last_event_id": last_event_id, "timestamp": datetime.now().isoformat()})
+                }
+                missed = []
+            for name, data, _, event_id, fields in missed:
+                if not subscription.matches(fields):
+                    continue
+                replayed.add(event_id)
+                yield {"event": name, "data": data, "id": event_id}
+
+        while True:
+            if await request.is_disconnected():
+                break
+            
+            try:
+                # Wait for new emergency with timeout
+                event = await subscription.get(timeout=30.0)
+                if event is None:
+                    # Send keepalive ping
+                    yield {
+                        "event": "ping",
+                        "data": json.dumps({"timestamp": datetime.now().isoformat()})
+                    }
+                    continue
+                name, data, _, event_id, _ = event
+                if event_id in replayed:
+                    continue  # arrived while the database replay was running
+                yield {
+                    "event": name,
+                    "data": data,
+                    "id": event_id
+                }
+            except ConnectionAbortedError:
+                # Fell too far behind; the browser's EventSource reconnects
+                log.warning("sse.slow_consumer_disconnected")
+                break
+            except Exception:
+                log.exception("sse.error")
+                break
+    finally:
+        hub.unsubscribe(subscription)
 
 
 # ============================================================================
@@ -100,10 +242,28 @@ async def root():
 
 
 @app.get("/api/emergency/stream")
-async def emergency_stream(request: Request):
+async def emergency_stream(
+    request: Request,
+    last_event_id: Optional[int] = None,
+    hospital: Optional[str] = None,
+    severity: Optional[str] = None,
+    alert_type: Optional[str] = None,
+    patient_ids: Optional[str] = None
+):
     """
     Server-Sent Events endpoint for real-time emergency alerts
     
+    Filters are comma-separated and combine with AND, e.g.
+    ?hospital=City%20General&severity=critical,high&patient_ids=12,40.
+    Only matching events are sent.
+    
+    Every event carries an id. On reconnect the browser sends it back in the
+    Last-Event-ID header (or pass ?last_event_id=) and the missed events are
+    replayed; a "resync" event means the gap was too old or too long and
+    the alert list should be reloaded. Ids can arrive out of order, so replay
+    also repeats the last EMERGENCY_REPLAY_WINDOW ids before Last-Event-ID:
+    clients should ignore events whose id they have already handled.
+    
     Usage:
         const eventSource = new EventSource('http://localhost:8004/api/emergency/stream');
         eventSource.addEventListener('emergency_alert', (event) => {
@@ -111,7 +271,16 @@ async def emergency_stream(request: Request):
             console.log('New emergency:', alert);
         });
     """
-    return EventSourceResponse(event_generator(request))
+    header = request.headers.get("last-event-id", "")
+    if last_event_id is None and header.isdigit():
+        last_event_id = int(header)
+    filters = parse_filters(
+        hospital=split_param(hospital),
+        severity=split_param(severity),
+        alert_type=split_param(alert_type),
+        patient=split_param(patient_ids)
+    )
+    return EventSourceResponse(event_generator(request, last_event_id, filters))
 
 
 @app.post("/api/emergency/alerts", response_model=EmergencyAlertResponse, status_code=status.HTTP_201_CREATED)
@@ -121,79 +290,56 @@ async def create_emergency_alert(
 ):
     """Create a new emergency alert and broadcast via SSE"""
     try:
-        # Verify patient exists
-        patient = await db.patient.find_unique(
-            where={"patientId": alert.patient_id}
-        )
-        if not patient:
-            raise HTTPException(
-                status_code=status.HTTP_404_NOT_FOUND,
-                detail=f"Patient {alert.patient_id} not found"
-            )
-        
-        # Verify hospital if provided
-        hospital_db_id = None
-        if alert.hospital_id:
-            hospital = await db.hospital.find_unique(
-                where={"hospitalName": alert.hospital_id}
-            )
-            if hospital:
-                hospital_db_id = hospital.id
-        
-        # Create emergency alert
-        new_alert = await db.emergencyalert.create(
-            data={
-                "alertId": alert.alert_id,
-                "patientId": patient.id,
-                "hospitalId": hospital_db_id,
-                "alertType": alert.alert_type.value,
-                "severity": alert.severity.value,
-                "description": alert.description,
-                "triggeredBy": alert.triggered_by,
-                "triggerData": alert.trigger_data,
-                "location": alert.location,
-                "status": "active"
-            }
-        )
-        
-        # Set emergency flag on patient
-        await db.patient.update(
-            where={"id": patient.id},
-            data={
-                "emergencyFlag": True,
-                "emergencyType": alert.alert_type.value,
-                "emergencyNotes": alert.description
-            }
-        )
-        
-        # Prepare broadcast data
-        broadcast_data = {
-            "alert_id": new_alert.alertId,
-            "patient_id": alert.patient_id,
-            "patient_name": patient.name,
-            "alert_type": new_alert.alertType,
-            "severity": new_alert.severity,
-            "description": new_alert.description,
-            "location": alert.location,
-            "trigger_data": alert.trigger_data,
-            "timestamp": new_alert.createdAt.isoformat(),
-            "hospital_id": alert.hospital_id
-        }
-        
-        # Broadcast to SSE subscribers
-        await broadcast_emergency(broadcast_data)
+        # Also broadcasts to SSE subscribers
+        new_alert, broadcast_data = await create_alert(db, alert)
         
-        return new_alert
+        return alert_response(new_alert)
     
-    except HTTPException:
-        raise
+    except LookupError as e:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=str(e)
+        )
     except Exception as e:
+        log.exception("create_emergency_alert.failed")
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"Failed to create emergency alert: {str(e)}"
         )
 
 
+@app.post("/api/emergency/alerts/bulk", status_code=status.HTTP_201_CREATED)
+async def create_emergency_alerts_bulk(
+    alerts: List[EmergencyAlertCreate],
+    db: Prisma = Depends(get_prisma)
+):
+    """
+    Create many (e.g. device-triggered) alerts in one request and broadcast them via SSE
+    Alerts for unknown patients or with an existing alert id are rejected
+    individually; the rest are created together.
+    """
+    if len(alerts) > BULK_MAX_ALERTS:
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail=f"At most {BULK_MAX_ALERTS} alerts per request"
+        )
+    try:
+        created, rejected = await create_emergency_alerts(db, alerts)
+    except Exception as e:
+        log.exception("create_emergency_alerts_bulk.failed", alerts=len(alerts))
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Failed to create emergency alerts: {str(e)}"
+        )
+    
+    return {
+        "success": True,
+        "created": len(created),
+        "alerts": [alert_response(row) for row in created],
+        "rejected": rejected
+    }
+
+
 @app.get("/api/emergency/alerts/{alert_id}", response_model=EmergencyAlertResponse)
 async def get_emergency_alert(
     alert_id: str,
@@ -210,7 +356,7 @@ async def get_emergency_alert(
             detail=f"Alert {alert_id} not found"
         )
     
-    return alert
+    return alert_response(alert)
 
 
 @app.get("/api/emergency/alerts", response_model=List[EmergencyAlertResponse])
@@ -241,18 +387,18 @@ async def list_emergency_alerts(
         }
     )
     
-    return alerts
+    return [alert_response(alert) for alert in alerts]
 
 
-@app.get("/api/emergency/patients/{patient_id}/alerts")
+@app.get("/api/emergency/patients/{patient_id}/alerts", response_model=List[EmergencyAlertResponse])
 async def get_patient_alerts(
-    patient_id: str,
+    patient_id: int,
     active_only: bool = True,
     db: Prisma = Depends(get_prisma)
 ):
     """Get all emergency alerts for a specific patient"""
     patient = await db.patient.find_unique(
-        where={"patientId": patient_id}
+        where={"id": patient_id}
     )
     
     if not patient:
@@ -270,7 +416,7 @@ async def get_patient_alerts(
         order={"createdAt": "desc"}
     )
     
-    return alerts
+    return [alert_response(alert) for alert in alerts]
 
 
 @app.patch("/api/emergency/alerts/{alert_id}/acknowledge")
@@ -281,7 +427,8 @@ async def acknowledge_alert(
 ):
     """Acknowledge an emergency alert"""
     alert = await db.emergencyalert.find_unique(
-        where={"alertId": alert_id}
+        where={"alertId": alert_id},
+        include={"hospital": True}
     )
     
     if not alert:
@@ -294,22 +441,14 @@ async def acknowledge_alert(
     if responder_id and responder_id not in responders:
         responders.append(responder_id)
     
-    updated = await db.emergencyalert.update(
-        where={"alertId": alert_id},
-        data={
-            "status": "acknowledged",
-            "responseTime": datetime.now(),
-            "responders": responders
-        }
-    )
+    await change_status(db, alert, {
+        "status": "acknowledged",
+        "responseTime": datetime.now(),
+        "responders": responders
+    })
     
     # Broadcast status update
-    await broadcast_emergency({
-        "event": "alert_acknowledged",
-        "alert_id": alert_id,
-        "responder_id": responder_id,
-        "timestamp": datetime.now().isoformat()
-    })
+    await broadcast_emergency(status_event("alert_acknowledged", alert, "acknowledged", responder_id=responder_id))
     
     return BaseResponse(
         success=True,
@@ -326,7 +465,8 @@ async def respond_to_alert(
 ):
     """Mark alert as being responded to"""
     alert = await db.emergencyalert.find_unique(
-        where={"alertId": alert_id}
+        where={"alertId": alert_id},
+        include={"hospital": True}
     )
     
     if not alert:
@@ -339,22 +479,14 @@ async def respond_to_alert(
     if responder_id not in responders:
         responders.append(responder_id)
     
-    updated = await db.emergencyalert.update(
-        where={"alertId": alert_id},
-        data={
-            "status": "responding",
-            "responders": responders,
-            "notes": notes
-        }
-    )
+    await change_status(db, alert, {
+        "status": "responding",
+        "responders": responders,
+        "notes": notes
+    })
     
     # Broadcast status update
-    await broadcast_emergency({
-        "event": "alert_responding",
-        "alert_id": alert_id,
-        "responder_id": responder_id,
-        "timestamp": datetime.now().isoformat()
-    })
+    await broadcast_emergency(status_event("alert_responding", alert, "responding", responder_id=responder_id))
     
     return BaseResponse(
         success=True,
@@ -371,7 +503,7 @@ async def resolve_alert(
     """Resolve an emergency alert"""
     alert = await db.emergencyalert.find_unique(
         where={"alertId": alert_id},
-        include={"patient": True}
+        include={"patient": True, "hospital": True}
     )
     
     if not alert:
@@ -381,39 +513,28 @@ async def resolve_alert(
         )
     
     # Update alert status
-    await db.emergencyalert.update(
-        where={"alertId": alert_id},
-        data={
-            "status": "resolved",
-            "resolvedAt": datetime.now(),
-            "notes": resolution_notes
-        }
-    )
+    await change_status(db, alert, {
+        "status": "resolved",
+        "resolvedAt": datetime.now(),
+        "notes": resolution_notes
+    })
     
     # Clear emergency flag on patient if no other active alerts
     active_alerts = await db.emergencyalert.count(
         where={
             "patientId": alert.patientId,
-            "status": {"in": ["active", "acknowledged", "responding"]}
+            "status": {"in": list(ACTIVE_STATUSES)}
         }
     )
     
     if active_alerts == 0:
         await db.patient.update(
             where={"id": alert.patientId},
-            data={
-                "emergencyFlag": False,
-                "emergencyType": None,
-                "emergencyNotes": None
-            }
+            data={"emergency": False}
         )
     
     # Broadcast resolution
-    await broadcast_emergency({
-        "event": "alert_resolved",
-        "alert_id": alert_id,
-        "timestamp": datetime.now().isoformat()
-    })
+    await broadcast_emergency(status_event("alert_resolved", alert, "resolved"))
     
     return BaseResponse(
         success=True,
@@ -430,7 +551,7 @@ async def mark_false_alarm(
     """Mark an alert as a false alarm"""
     alert = await db.emergencyalert.find_unique(
         where={"alertId": alert_id},
-        include={"patient": True}
+        include={"patient": True, "hospital": True}
     )
     
     if not alert:
@@ -439,31 +560,20 @@ async def mark_false_alarm(
             detail=f"Alert {alert_id} not found"
         )
     
-    await db.emergencyalert.update(
-        where={"alertId": alert_id},
-        data={
-            "status": "false_alarm",
-            "resolvedAt": datetime.now(),
-            "notes": notes
-        }
-    )
+    await change_status(db, alert, {
+        "status": "false_alarm",
+        "resolvedAt": datetime.now(),
+        "notes": notes
+    })
     
     # Clear emergency flag on patient
     await db.patient.update(
         where={"id": alert.patientId},
-        data={
-            "emergencyFlag": False,
-            "emergencyType": None,
-            "emergencyNotes": None
-        }
+        data={"emergency": False}
     )
     
     # Broadcast false alarm
-    await broadcast_emergency({
-        "event": "false_alarm",
-        "alert_id": alert_id,
-        "timestamp": datetime.now().isoformat()
-    })
+    await broadcast_emergency(status_event("false_alarm", alert, "false_alarm"))
     
     return BaseResponse(
         success=True,
@@ -471,33 +581,32 @@ async def mark_false_alarm(
     )
 
 
+@app.get("/metrics")
+def get_metrics():
+    """In-process metrics (SSE subscribers, dropped events, delivery lag) for this worker"""
+    return {
+        "service": "emergency-api",
+        **metrics.snapshot(),
+        "timestamp": datetime.now().isoformat()
+    }
+
+
 # ============================================================================
 # EMERGENCY STATISTICS
 # ============================================================================
 
 @app.get("/api/emergency/statistics")
-async def get_emergency_statistics(
-    db: Prisma = Depends(get_prisma)
-):
-    """Get emergency system statistics"""
-    total_alerts = await db.emergencyalert.count()
-    active_alerts = await db.emergencyalert.count(where={"status": "active"})
-    responding_alerts = await db.emergencyalert.count(where={"status": "responding"})
-    resolved_alerts = await db.emergencyalert.count(where={"status": "resolved"})
-    false_alarms = await db.emergencyalert.count(where={"status": "false_alarm"})
-    
-    # Critical severity count
-    critical_alerts = await db.emergencyalert.count(
-        where={"severity": "critical", "status": {"in": ["active", "responding"]}}
-    )
-    
+async def get_emergency_statistics():
+    """Get emergency system statistics (in-memory counters, see stats.py)"""
     return {
-        "total_alerts": total_alerts,
-        "active_alerts": active_alerts,
-        "responding_alerts": responding_alerts,
-        "resolved_alerts": resolved_alerts,
-        "false_alarms": false_alarms,
-        "critical_active": critical_alerts,
+        "total_alerts": counters.total(),
+        "active_alerts": counters.total(status="active"),
+        "responding_alerts": counters.total(status="responding"),
+        "resolved_alerts": counters.total(status="resolved"),
+        "false_alarms": counters.total(status="false_alarm"),
+        # Critical severity count
+        "critical_active": counters.total("active", "critical") + counters.total("responding", "critical"),
+        "reconciled_at": counters.reconciled_at.isoformat() if counters.reconciled_at else None,
         "timestamp": datetime.now().isoformat()
     }
 
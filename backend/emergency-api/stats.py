@@ -0,0 +1,101 @@
+"""
+Emergency Alert Counters
+Alert counts per (severity, status), kept in memory so the statistics
+endpoint answers without touching the database. Every alert event that
+reaches this worker (create and status changes, from any process via
+shared/events.py) moves one alert between cells; a single GROUP BY replaces
+the counts every EMERGENCY_STATS_RECONCILE_SECONDS to correct drift
+(events missed while the listener reconnected, direct database edits).
+"""
+
+from typing import Any, Dict, Optional, Tuple
+from datetime import datetime
+import asyncio
+import os
+
+from prisma import Prisma
+
+from shared.log import get_logger
+from shared.metrics import metrics
+
+log = get_logger("emergency.stats")
+
+RECONCILE_SECONDS = int(os.getenv("EMERGENCY_STATS_RECONCILE_SECONDS", "60"))
+
+COUNT_SQL = 'SELECT "severity", "status", COUNT(*)::int AS "count" FROM "EmergencyAlert" GROUP BY "severity", "status"'
+
+
+class AlertCounters:
+    """(severity, status) -> number of alerts"""
+
+    def __init__(self):
+        self.counts: Dict[Tuple[str, str], int] = {}
+        self.reconciled_at: Optional[datetime] = None
+
+    def apply(self, name: str, data: Dict[str, Any], event_id: Optional[int] = None) -> None:
+        """Event handler: count a created alert or move one between statuses"""
+        status, severity = data.get("status"), data.get("severity")
+        if status is None or severity is None:
+            return
+        previous = data.get("previous_status")
+        if previous is not None:
+            key = (severity, previous)
+            self.counts[key] = max(self.counts.get(key, 0) - 1, 0)
+        self.counts[(severity, status)] = self.counts.get((severity, status), 0) + 1
+
+    async def reconcile(self, db: Prisma) -> int:
+        """Replace the counts with the database's; returns how far off they were"""
+        rows = await db.query_raw(COUNT_SQL)
+        fresh = {(r["severity"], r["status"]): r["count"] for r in rows}
+        drift = sum(abs(fresh.get(key, 0) - self.counts.get(key, 0)) for key in set(fresh) | set(self.counts))
+        self.counts = fresh
+        self.reconciled_at = datetime.now()
+        metrics.set_gauge("emergency.stats_drift", drift)
+        return drift
+
+    def total(self, status: Optional[str] = None, severity: Optional[str] = None) -> int:
+        return sum(
+            count for (sev, stat), count in self.counts.items()
+            if (status is None or stat == status) and (severity is None or sev == severity)
+        )
+
+
+counters = AlertCounters()
+
+
+async def reconcile_loop(db: Prisma) -> None:
+    """Background task: reconcile the counters every RECONCILE_SECONDS"""
+    while True:
+        await asyncio.sleep(RECONCILE_SECONDS)
+        try:
+            drift = await counters.reconcile(db)
+            if drift:
+                log.info("stats.reconciled", drift=drift)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            metrics.incr("emergency.stats_errors")
+            log.exception("stats.reconcile_failed")
+
+
+reconcile_task: Optional[asyncio.Task] = None
+
+
+async def start_counters(db: Prisma) -> None:
+    """Load the counts, then keep reconciling them in the background"""
+    global reconcile_task
+    try:
+        await counters.reconcile(db)
+    except Exception:
+        metrics.incr("emergency.stats_errors")
+        log.exception("stats.reconcile_failed")
+    if reconcile_task is None:
+        reconcile_task = asyncio.create_task(reconcile_loop(db))
+
+
+async def stop_counters() -> None:
+    global reconcile_task
+    if reconcile_task is not None:
+        reconcile_task.cancel()
+        await asyncio.gather(reconcile_task, return_exceptions=True)
+        reconcile_task = None
@@ -0,0 +1,14 @@
+"""
+Test setup for the Emergency API
+Run from emergency-api/:  pytest
+Uses the in-process event bus, so no database or LISTEN connection is needed.
+"""
+
+import os
+import sys
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, ".."))
+sys.path.insert(0, os.path.join(HERE, "..", ".."))
+
+os.environ.setdefault("EMERGENCY_EVENT_BUS", "local")
@@ -0,0 +1,88 @@
+"""Event hub fan-out, slow-consumer policy and replay"""
+
+import asyncio
+
+import pytest
+
+from hub import EventHub, parse_filters
+
+
+def alert(n, **data):
+    return {"alert_id": n, "patient_id": 1, "hospital_id": "h1", "severity": "high", "alert_type": "fall", **data}
+
+
+def test_drop_oldest_keeps_newest_events():
+    async def run():
+        hub = EventHub()
+        subscription = hub.subscribe(maxsize=2, policy="drop_oldest")
+        for n in range(1, 5):
+            hub.publish("emergency_alert", alert(n), n)
+        events = [await subscription.get(timeout=0.1) for _ in range(2)]
+        return subscription, [event[3] for event in events]
+    subscription, ids = asyncio.run(run())
+    assert ids == [3, 4]
+    assert subscription.dropped == 2
+
+
+def test_disconnect_policy_closes_slow_subscriber():
+    async def run():
+        hub = EventHub()
+        slow = hub.subscribe(maxsize=1, policy="disconnect")
+        fast = hub.subscribe(maxsize=10)
+        hub.publish("emergency_alert", alert(1), 1)
+        delivered = hub.publish("emergency_alert", alert(2), 2)
+        with pytest.raises(ConnectionAbortedError):
+            await slow.get(timeout=0.1)
+        return hub, slow, fast, delivered
+    hub, slow, fast, delivered = asyncio.run(run())
+    assert delivered == 1
+    assert slow not in hub.subscribers
+    assert fast.queue.qsize() == 2
+
+
+def test_filters_route_events():
+    async def run():
+        hub = EventHub()
+        critical = hub.subscribe(parse_filters(severity=["critical"]))
+        other_hospital = hub.subscribe(parse_filters(hospital=["h2"]))
+        hub.publish("emergency_alert", alert(1, severity="critical"), 1)
+        hub.publish("emergency_alert", alert(2), 2)
+        return critical.queue.qsize(), other_hospital.queue.qsize()
+    assert asyncio.run(run()) == (1, 0)
+
+
+def test_replay_since():
+    async def run():
+        hub = EventHub(replay_size=3)
+        for n in range(1, 6):
+            hub.publish("emergency_alert", alert(n), n)
+        return hub
+    hub = asyncio.run(run())
+    assert [event[3] for event in hub.replay_since(3, window=0)] == [4, 5]
+    assert hub.replay_since(5, window=0) == []
+    # The buffer only holds ids 3-5: older gaps come from the database
+    assert hub.replay_since(1, window=0) is None
+    assert hub.replay_since(4, window=3) is None
+
+
+def test_replay_repeats_a_window_for_late_commits():
+    async def run():
+        hub = EventHub()
+        # Id 3 was drawn first but its transaction committed after id 4's
+        for n in (1, 2, 4, 3, 5):
+            hub.publish("emergency_alert", alert(n), n)
+        return hub
+    hub = asyncio.run(run())
+    # A client that saw 4 before disconnecting still gets 3; it drops the repeated 4 itself
+    assert [event[3] for event in hub.replay_since(4, window=2)] == [4, 3, 5]
+
+
+def test_unsubscribe_removes_index_entries():
+    async def run():
+        hub = EventHub()
+        subscription = hub.subscribe(parse_filters(patient=[1, 2]))
+        hub.unsubscribe(subscription)
+        return hub
+    hub = asyncio.run(run())
+    assert hub.index["patient"] == {}
+    assert not hub.subscribers
@@ -0,0 +1,45 @@
+"""Patient alert listing (needs the service's FastAPI dependencies)"""
+
+import asyncio
+from datetime import datetime
+from types import SimpleNamespace
+
+import pytest
+
+pytest.importorskip("fastapi")
+pytest.importorskip("sse_starlette")
+
+from main import get_patient_alerts
+
+
+class Table:
+    def __init__(self, rows):
+        self.rows = rows
+        self.calls = []
+
+    async def find_unique(self, where):
+        self.calls.append(where)
+        return next((row for row in self.rows if row.id == where.get("id")), None)
+
+    async def find_many(self, where, order=None):
+        self.calls.append(where)
+        return [row for row in self.rows if all(getattr(row, k) == v for k, v in where.items())]
+
+
+def alert_row(n, patient_id):
+    now = datetime(2024, 1, 1)
+    return SimpleNamespace(
+        id=n, alertId=f"a{n}", patientId=patient_id, hospitalId=1, alertType="fall", severity="high",
+        description="", triggeredBy="wearable", triggerData=None, location=None, status="active",
+        createdAt=now, updatedAt=now
+    )
+
+
+def test_patient_alerts_are_looked_up_by_id_and_mapped():
+    db = SimpleNamespace(
+        patient=Table([SimpleNamespace(id=7)]),
+        emergencyalert=Table([alert_row(1, 7), alert_row(2, 8)])
+    )
+    alerts = asyncio.run(get_patient_alerts(7, True, db))
+    assert db.patient.calls == [{"id": 7}]
+    assert [(alert.alertId, alert.alert_type) for alert in alerts] == [("a1", "fall")]
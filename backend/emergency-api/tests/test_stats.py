@@ -0,0 +1,42 @@
+"""In-memory alert counters"""
+
+import asyncio
+
+from stats import AlertCounters
+
+
+class Db:
+    def __init__(self, rows):
+        self.rows = rows
+
+    async def query_raw(self, query, *args):
+        return self.rows
+
+
+def test_create_and_status_change_move_counts():
+    counters = AlertCounters()
+    counters.apply("emergency_alert", {"status": "active", "severity": "high"})
+    counters.apply("emergency_alert", {"status": "active", "severity": "high"})
+    counters.apply("alert_status", {"status": "resolved", "previous_status": "active", "severity": "high"})
+    assert counters.total(status="active") == 1
+    assert counters.total(status="resolved") == 1
+    assert counters.total() == 2
+
+
+def test_events_without_status_are_ignored():
+    counters = AlertCounters()
+    counters.apply("alert_status", {"alert_id": 1})
+    assert counters.total() == 0
+
+
+def test_reconcile_replaces_counts_and_reports_drift():
+    counters = AlertCounters()
+    counters.apply("emergency_alert", {"status": "active", "severity": "high"})
+    db = Db([
+        {"severity": "high", "status": "active", "count": 3},
+        {"severity": "critical", "status": "resolved", "count": 1}
+    ])
+    drift = asyncio.run(counters.reconcile(db))
+    assert drift == 3
+    assert counters.total(status="active") == 3
+    assert counters.total(severity="critical") == 1
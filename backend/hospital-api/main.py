@@ -13,17 +13,25 @@ import os
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 from shared.database import connect_db, disconnect_db, get_prisma
+from shared.log import configure_logging, get_logger, shutdown_logging
 from shared.models import HospitalCreate, HospitalResponse, BaseResponse
 from prisma import Prisma
 from typing import List, Optional
 
 
+configure_logging("hospital-api")
+log = get_logger("hospital.api")
+
+
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     """Lifecycle manager for database connection"""
     await connect_db()
+    log.info("startup")
     yield
     await disconnect_db()
+    log.info("shutdown")
+    shutdown_logging()
 
 
 app = FastAPI(
@@ -84,6 +92,7 @@ async def create_hospital(
     except HTTPException:
         raise
     except Exception as e:
+        log.exception("create_hospital.failed")
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"Failed to create hospital: {str(e)}"
@@ -155,6 +164,7 @@ async def update_hospital(
         )
         return updated_hospital
     except Exception as e:
+        log.exception("update_hospital.failed")
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"Failed to update hospital: {str(e)}"
@@ -14,6 +14,7 @@ import os
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 from shared.database import connect_db, disconnect_db, get_prisma
+from shared.log import configure_logging, get_logger, shutdown_logging
 from shared.models import (
     PatientCreate,
     PatientUpdate,
@@ -27,12 +28,19 @@ from prisma import Prisma
 from typing import List, Optional
 
 
+configure_logging("patient-api")
+log = get_logger("patient.api")
+
+
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     """Lifecycle manager for database connection"""
     await connect_db()
+    log.info("startup")
     yield
     await disconnect_db()
+    log.info("shutdown")
+    shutdown_logging()
 
 
 # Initialize FastAPI app
@@ -89,6 +97,7 @@ async def create_patient(
         return new_patient
     
     except Exception as e:
+        log.exception("create_patient.failed")
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"Failed to create patient: {str(e)}"
@@ -159,6 +168,7 @@ async def update_patient(
         )
         return updated_patient
     except Exception as e:
+        log.exception("update_patient.failed")
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"Failed to update patient: {str(e)}"
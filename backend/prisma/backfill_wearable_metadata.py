@@ -0,0 +1,247 @@
+"""
+CloudCare Migration - Backfill WearableData metadata columns
+Copies method/itemId/source/startTime/endTime out of the legacy JSON
+`description` into their indexed columns, one id range at a time so
+each UPDATE holds its row locks only briefly.
+
+Record types are stored normalised (lower case, see
+ingest.normalize_method), so lookups match them exactly: rows synced
+before that are renamed, and rows that only differed from an already
+keyed record by the case of their method are duplicates of it.
+
+Then fills in the content `digest` of every keyed row that lacks one
+(decrypting its payload with the owner's key), so the first sync after
+the migration recognises unchanged records instead of rewriting them all.
+--all-digests recomputes every digest, for rows synced before the digest
+covered stored content only.
+
+Usage:
+    python prisma/backfill_wearable_metadata.py [--chunk-size 5000] [--delete-duplicates] [--all-digests]
+
+Safe to re-run: rows that already have a normalised `method` (and `digest`) are skipped.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import sys
+
+from prisma import Prisma
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "wearables-api"))
+
+from crypto import decrypt_data, encrypted_payload, get_encryption_key_from_password  # noqa: E402
+from ingest import content_digest, parse_timestamp  # noqa: E402
+
+db = Prisma()
+
+# Legacy rows written by the wearables sync endpoint store their metadata as JSON
+LEGACY_FILTER = """
+    "method" IS NULL
+    AND "description" LIKE '{%'
+    AND "description" LIKE '%"method"%'
+"""
+
+# Only the lowest id per (patientId, method, itemId) is keyed; older retry
+# duplicates would otherwise violate the unique constraint
+BACKFILL_CHUNK_SQL = f"""
+UPDATE "WearableData" AS w
+SET "method"    = lower(btrim(src.d->>'method')),
+    "itemId"    = src.d->>'itemId',
+    "source"    = src.d->>'source',
+    "startTime" = (src.d->>'startTime')::timestamptz AT TIME ZONE 'UTC',
+    "endTime"   = (src.d->>'endTime')::timestamptz AT TIME ZONE 'UTC'
+FROM (
+    SELECT DISTINCT ON ("patientId", lower(btrim("description"::jsonb->>'method')), "description"::jsonb->>'itemId')
+           "id", "description"::jsonb AS d
+    FROM "WearableData"
+    WHERE "id" >= $1 AND "id" < $2 AND {LEGACY_FILTER}
+    ORDER BY "patientId", lower(btrim("description"::jsonb->>'method')), "description"::jsonb->>'itemId', "id"
+) AS src
+WHERE w."id" = src."id"
+  AND NOT EXISTS (
+      SELECT 1 FROM "WearableData" AS x
+      WHERE x."patientId" = w."patientId"
+        AND x."method" = lower(btrim(src.d->>'method'))
+        AND x."itemId" = src.d->>'itemId'
+  )
+"""
+
+# Keyed rows whose method is not normalised yet (ingest.normalize_method)
+UNNORMALIZED_FILTER = """
+    "method" IS NOT NULL
+    AND "method" <> lower(btrim("method"))
+"""
+
+# Same rule as the legacy backfill: the lowest id per normalised key is renamed
+# unless that record is already stored under the normalised method
+NORMALIZE_CHUNK_SQL = f"""
+UPDATE "WearableData" AS w
+SET "method" = lower(btrim(w."method"))
+FROM (
+    SELECT DISTINCT ON ("patientId", lower(btrim("method")), "itemId") "id", "timestamp"
+    FROM "WearableData"
+    WHERE "id" >= $1 AND "id" < $2 AND {UNNORMALIZED_FILTER}
+    ORDER BY "patientId", lower(btrim("method")), "itemId", "id"
+) AS src
+WHERE w."id" = src."id" AND w."timestamp" = src."timestamp"
+  AND NOT EXISTS (
+      SELECT 1 FROM "WearableData" AS x
+      WHERE x."patientId" = w."patientId"
+        AND x."method" = lower(btrim(w."method"))
+        AND x."itemId" = w."itemId"
+  )
+"""
+
+# Archived days (the method inside the archive blob is normalised when it is read)
+NORMALIZE_ARCHIVE_SQL = """
+UPDATE "WearableArchive" AS a
+SET "method" = lower(btrim(a."method"))
+FROM (
+    SELECT DISTINCT ON ("patientId", lower(btrim("method")), "bucketStart") "id"
+    FROM "WearableArchive"
+    WHERE "method" <> lower(btrim("method"))
+    ORDER BY "patientId", lower(btrim("method")), "bucketStart", "id"
+) AS src
+WHERE a."id" = src."id"
+  AND NOT EXISTS (
+      SELECT 1 FROM "WearableArchive" AS x
+      WHERE x."patientId" = a."patientId"
+        AND x."method" = lower(btrim(a."method"))
+        AND x."bucketStart" = a."bucketStart"
+  )
+"""
+
+
+# Keyed rows with the owner's password hash (the payload encryption key is derived from it)
+DIGEST_ROWS_SQL = """
+SELECT w."id", w."timestamp", w."startTime", w."endTime", w."source", w."description", u."password"
+FROM "WearableData" AS w
+JOIN "Patient" AS p ON p."id" = w."patientId"
+JOIN "UserLogin" AS u ON u."id" = p."userLoginId"
+WHERE w."id" >= $1 AND w."id" < $2 AND w."method" IS NOT NULL {only_missing}
+"""
+
+SET_DIGESTS_SQL = """
+UPDATE "WearableData" AS w
+SET "digest" = v."digest"
+FROM jsonb_to_recordset($1::jsonb) AS v("id" int, "timestamp" timestamp, "digest" text)
+WHERE w."id" = v."id" AND w."timestamp" = v."timestamp"
+"""
+
+
+def row_digest(r) -> str:
+    """Digest of a stored row, as ingest computes it for an incoming item"""
+    key = get_encryption_key_from_password(r["password"])
+    token = encrypted_payload(r["description"])
+    payload = decrypt_data(token, key) if token else {}
+    return content_digest(
+        payload,
+        r["source"],
+        parse_timestamp(r["timestamp"]),
+        parse_timestamp(r["startTime"]) if r["startTime"] else None,
+        parse_timestamp(r["endTime"]) if r["endTime"] else None
+    )
+
+
+async def backfill_digests(chunk_size: int, all_digests: bool):
+    """Compute missing content digests in id-range chunks"""
+    bounds = await db.query_raw('SELECT MIN("id") AS lo, MAX("id") AS hi FROM "WearableData"')
+    lo, hi = bounds[0]["lo"], bounds[0]["hi"]
+    if lo is None:
+        return
+
+    sql = DIGEST_ROWS_SQL.format(only_missing="" if all_digests else 'AND w."digest" IS NULL')
+    print(f"🔄 Computing content digests for ids {lo}..{hi}")
+    updated = skipped = 0
+    for start in range(lo, hi + 1, chunk_size):
+        values = []
+        for r in await db.query_raw(sql, start, start + chunk_size):
+            try:
+                values.append({"id": r["id"], "timestamp": r["timestamp"], "digest": row_digest(r)})
+            except Exception:
+                skipped += 1  # undecryptable payload: its next resync rewrites it
+        if values:
+            updated += await db.execute_raw(SET_DIGESTS_SQL, json.dumps(values))
+    print(f"   ✓ {updated} digests set, {skipped} rows skipped (payload not decryptable)")
+
+
+async def normalize_methods(chunk_size: int, delete_duplicates: bool):
+    """Rename keyed rows to their normalised method in id-range chunks"""
+    bounds = await db.query_raw(
+        f'SELECT MIN("id") AS lo, MAX("id") AS hi FROM "WearableData" WHERE {UNNORMALIZED_FILTER}'
+    )
+    lo, hi = bounds[0]["lo"], bounds[0]["hi"]
+    if lo is not None:
+        print(f"🔄 Normalising record types for ids {lo}..{hi}")
+        updated = 0
+        for start in range(lo, hi + 1, chunk_size):
+            updated += await db.execute_raw(NORMALIZE_CHUNK_SQL, start, start + chunk_size)
+        print(f"   ✓ {updated} rows renamed")
+
+        # Whatever is left differs from a keyed record only by the case of its method
+        leftover = await db.query_raw(
+            f'SELECT COUNT(*)::int AS n FROM "WearableData" WHERE {UNNORMALIZED_FILTER}'
+        )
+        duplicates = leftover[0]["n"]
+        if duplicates and delete_duplicates:
+            deleted = await db.execute_raw(f'DELETE FROM "WearableData" WHERE {UNNORMALIZED_FILTER}')
+            print(f"   🗑️  Deleted {deleted} duplicate rows")
+        elif duplicates:
+            print(f"   ⚠️  {duplicates} rows duplicate a record stored under its normalised method (re-run with --delete-duplicates)")
+
+    renamed = await db.execute_raw(NORMALIZE_ARCHIVE_SQL)
+    if renamed:
+        print(f"   ✓ {renamed} archived days renamed")
+
+
+async def backfill(chunk_size: int, delete_duplicates: bool):
+    """Backfill metadata columns in id-range chunks"""
+    bounds = await db.query_raw(
+        f'SELECT MIN("id") AS lo, MAX("id") AS hi FROM "WearableData" WHERE {LEGACY_FILTER}'
+    )
+    lo, hi = bounds[0]["lo"], bounds[0]["hi"]
+    if lo is None:
+        print("✅ No legacy wearable rows to backfill")
+        return
+
+    print(f"🔄 Backfilling WearableData ids {lo}..{hi} in chunks of {chunk_size}")
+    updated = 0
+    for start in range(lo, hi + 1, chunk_size):
+        updated += await db.execute_raw(BACKFILL_CHUNK_SQL, start, start + chunk_size)
+        print(f"   ✓ ids < {start + chunk_size}: {updated} rows backfilled")
+
+    # Whatever is left is a retry duplicate of an already keyed row
+    leftover = await db.query_raw(
+        f'SELECT COUNT(*)::int AS n FROM "WearableData" WHERE {LEGACY_FILTER}'
+    )
+    duplicates = leftover[0]["n"]
+    if duplicates and delete_duplicates:
+        deleted = await db.execute_raw(f'DELETE FROM "WearableData" WHERE {LEGACY_FILTER}')
+        print(f"   🗑️  Deleted {deleted} duplicate rows")
+    elif duplicates:
+        print(f"   ⚠️  {duplicates} duplicate rows left unkeyed (re-run with --delete-duplicates)")
+
+    print(f"✅ Backfill complete: {updated} rows")
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Backfill WearableData metadata columns")
+    parser.add_argument("--chunk-size", type=int, default=5000)
+    parser.add_argument("--delete-duplicates", action="store_true")
+    parser.add_argument("--all-digests", action="store_true")
+    args = parser.parse_args()
+
+    await db.connect()
+    try:
+        await backfill(args.chunk_size, args.delete_duplicates)
+        await normalize_methods(args.chunk_size, args.delete_duplicates)
+        await backfill_digests(args.chunk_size, args.all_digests)
+    finally:
+        await db.disconnect()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
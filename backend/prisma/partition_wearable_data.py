@@ -0,0 +1,141 @@
+"""
+CloudCare Migration - Partition WearableData by timestamp
+Rebuilds "WearableData" as a table range-partitioned by "timestamp"
+(monthly or weekly, see WEARABLES_PARTITION_INTERVAL):
+
+    1. create "WearableData_partitioned" with the same columns, keys and
+       foreign keys, plus partitions covering every stored timestamp
+    2. copy rows across one id range at a time, so each INSERT is short
+    3. under a brief exclusive lock, copy rows inserted meanwhile and swap
+       the tables; the old table is kept as
+       wearable_partitions."WearableData_unpartitioned" (--drop-old drops it)
+
+Stop the wearables API first: rows updated or deleted during the copy are
+not carried over (devices simply retry their syncs). Run `prisma db push`
+with the updated schema beforehand so the keys already include "timestamp".
+Afterwards the container entrypoint no longer pushes schema changes that
+touch WearableData; apply those to the partitioned table by hand.
+
+Usage:
+    python prisma/partition_wearable_data.py [--chunk-size 50000] [--drop-old]
+
+Safe to re-run: an already partitioned table is left alone.
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+from datetime import datetime, timedelta
+
+from prisma import Prisma
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "wearables-api"))
+
+from ingest import parse_timestamp  # noqa: E402
+from partitions import (  # noqa: E402
+    PARTITION_SCHEMA,
+    PARTITIONS_AHEAD,
+    create_partitions,
+    is_partitioned,
+    next_period,
+    period_start
+)
+from rollups import to_utc_naive  # noqa: E402
+
+db = Prisma()
+
+NEW = '"WearableData_partitioned"'
+
+CREATE_SQL = [
+    f'CREATE TABLE {NEW} (LIKE "WearableData" INCLUDING DEFAULTS) PARTITION BY RANGE ("timestamp")',
+    f'ALTER TABLE {NEW} ADD CONSTRAINT "WearableData_partitioned_pkey" PRIMARY KEY ("id", "timestamp")',
+    f'CREATE UNIQUE INDEX "WearableData_partitioned_key" ON {NEW} ("patientId", "method", "itemId", "timestamp")',
+    f'CREATE INDEX "WearableData_partitioned_method_idx" ON {NEW} ("patientId", "method", "timestamp")',
+    f'CREATE INDEX "WearableData_partitioned_timestamp_idx" ON {NEW} ("patientId", "timestamp")',
+    f'ALTER TABLE {NEW} ADD CONSTRAINT "WearableData_partitioned_patientId_fkey" FOREIGN KEY ("patientId") '
+    f'REFERENCES "Patient"("id") ON DELETE RESTRICT ON UPDATE CASCADE',
+    f'ALTER TABLE {NEW} ADD CONSTRAINT "WearableData_partitioned_recordId_fkey" FOREIGN KEY ("recordId") '
+    f'REFERENCES "Record"("id") ON DELETE SET NULL ON UPDATE CASCADE',
+]
+
+# Old table out of the Prisma schema, new one under the names Prisma expects
+SWAP_SQL = [
+    'ALTER SEQUENCE "WearableData_id_seq" OWNED BY NONE',  # or it would move with the old table
+    f'ALTER TABLE "WearableData" SET SCHEMA {PARTITION_SCHEMA}',
+    f'ALTER TABLE {PARTITION_SCHEMA}."WearableData" RENAME TO "WearableData_unpartitioned"',
+    f'ALTER TABLE {NEW} RENAME TO "WearableData"',
+    'ALTER TABLE "WearableData" RENAME CONSTRAINT "WearableData_partitioned_pkey" TO "WearableData_pkey"',
+    'ALTER INDEX "WearableData_partitioned_key" RENAME TO "WearableData_patientId_method_itemId_timestamp_key"',
+    'ALTER INDEX "WearableData_partitioned_method_idx" RENAME TO "WearableData_patientId_method_timestamp_idx"',
+    'ALTER INDEX "WearableData_partitioned_timestamp_idx" RENAME TO "WearableData_patientId_timestamp_idx"',
+    'ALTER TABLE "WearableData" RENAME CONSTRAINT "WearableData_partitioned_patientId_fkey" TO "WearableData_patientId_fkey"',
+    'ALTER TABLE "WearableData" RENAME CONSTRAINT "WearableData_partitioned_recordId_fkey" TO "WearableData_recordId_fkey"',
+    'ALTER SEQUENCE "WearableData_id_seq" OWNED BY "WearableData"."id"',
+]
+
+COPY_SQL = f'INSERT INTO {NEW} SELECT * FROM "WearableData" WHERE "id" >= $1 AND "id" < $2'
+
+
+async def migrate(chunk_size: int, drop_old: bool):
+    """Copy WearableData into a partitioned twin and swap them"""
+    if await is_partitioned(db):
+        print("✅ WearableData is already partitioned")
+        return
+
+    bounds = await db.query_raw(
+        'SELECT MIN("id") AS lo, MAX("id") AS hi, MIN("timestamp") AS first, MAX("timestamp") AS last FROM "WearableData"'
+    )
+    lo, hi = bounds[0]["lo"], bounds[0]["hi"]
+    now = datetime.utcnow()
+    first = to_utc_naive(parse_timestamp(bounds[0]["first"])) if bounds[0]["first"] else now
+    last = to_utc_naive(parse_timestamp(bounds[0]["last"])) if bounds[0]["last"] else now
+    ahead = period_start(now)
+    for _ in range(PARTITIONS_AHEAD):
+        ahead = next_period(ahead)
+
+    await db.execute_raw(f'DROP TABLE IF EXISTS {NEW}')  # leftover of an interrupted run
+    for statement in CREATE_SQL:
+        await db.execute_raw(statement)
+    created = await create_partitions(db, min(first, now), max(last, ahead), NEW)
+    print(f"🧱 Created {len(created)} partitions in schema {PARTITION_SCHEMA}")
+
+    copied = 0
+    if lo is not None:
+        print(f"🔄 Copying WearableData ids {lo}..{hi} in chunks of {chunk_size}")
+        for start in range(lo, hi + 1, chunk_size):
+            copied += await db.execute_raw(COPY_SQL, start, start + chunk_size)
+            print(f"   ✓ ids < {start + chunk_size}: {copied} rows copied")
+
+    async with db.tx(timeout=timedelta(minutes=5)) as transaction:
+        await transaction.execute_raw('LOCK TABLE "WearableData" IN ACCESS EXCLUSIVE MODE')
+        tail = await transaction.execute_raw(COPY_SQL, (hi or 0) + 1, 2 ** 31 - 1)
+        for statement in SWAP_SQL:
+            await transaction.execute_raw(statement)
+    print(f"   ✓ {tail} rows inserted during the copy carried over")
+
+    if drop_old:
+        await db.execute_raw(f'DROP TABLE {PARTITION_SCHEMA}."WearableData_unpartitioned"')
+        print("   🗑️  Dropped the unpartitioned table")
+    else:
+        print(f'   ℹ️  Old table kept as {PARTITION_SCHEMA}."WearableData_unpartitioned"')
+
+    print(f"✅ WearableData partitioned: {copied + tail} rows")
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Partition WearableData by timestamp")
+    parser.add_argument("--chunk-size", type=int, default=50000)
+    parser.add_argument("--drop-old", action="store_true")
+    args = parser.parse_args()
+
+    await db.connect()
+    try:
+        await migrate(args.chunk_size, args.drop_old)
+    finally:
+        await db.disconnect()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,117 @@
+"""
+CloudCare Benchmark - Cross-process emergency event delivery
+Measures end-to-end latency from NOTIFY to SSE subscriber queue across N
+emergency-api-like worker processes. Each worker holds one LISTEN
+connection (shared/events.py) feeding its own EventHub with S subscribers,
+exactly as the API does; the latency of an event is the time from just
+before pg_notify until a subscriber dequeues it.
+
+Needs a reachable Postgres (DATABASE_URL) and asyncpg.
+
+Usage:
+    python scripts/benchmark_emergency_fanout.py [--workers 4] [--subscribers 100] [--events 500] [--rate 200]
+"""
+
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import sys
+import time
+
+import asyncpg
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "emergency-api"))
+
+from hub import EventHub  # noqa: E402
+from shared import events  # noqa: E402
+from shared.metrics import metrics  # noqa: E402
+
+
+async def run_worker(dsn: str, count: int, subscribers: int, ready, results) -> None:
+    hub = EventHub()
+    subscriptions = [hub.subscribe(maxsize=count + 1) for _ in range(subscribers)]
+    events.add_handler(hub.publish)
+    listener = asyncio.create_task(events.listen_loop(dsn))
+    while metrics.snapshot()["gauges"].get("events.listening") != 1:
+        await asyncio.sleep(0.05)
+    ready.put(os.getpid())
+
+    latencies = []
+
+    async def consume(subscription):
+        for _ in range(count):
+            event = await subscription.get(timeout=30)
+            if event is None:
+                return
+            latencies.append(time.time() - json.loads(event[1])["published_at"])
+
+    await asyncio.gather(*(consume(s) for s in subscriptions))
+    listener.cancel()
+    await asyncio.gather(listener, return_exceptions=True)
+    results.put(latencies)
+
+
+def worker(dsn: str, count: int, subscribers: int, ready, results) -> None:
+    asyncio.run(run_worker(dsn, count, subscribers, ready, results))
+
+
+async def publish(dsn: str, count: int, rate: float) -> float:
+    connection = await asyncpg.connect(dsn)
+    started = time.perf_counter()
+    try:
+        for seq in range(count):
+            payload = events.encode_event("benchmark", {"seq": seq, "published_at": time.time()})
+            await connection.execute("SELECT pg_notify($1, $2)", events.CHANNEL, payload)
+            await asyncio.sleep(1 / rate)
+    finally:
+        await connection.close()
+    return time.perf_counter() - started
+
+
+def percentile(values, q: float) -> float:
+    return values[min(int(len(values) * q), len(values) - 1)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark cross-process emergency event delivery")
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--subscribers", type=int, default=100, help="SSE subscribers per worker")
+    parser.add_argument("--events", type=int, default=500)
+    parser.add_argument("--rate", type=float, default=200, help="events published per second")
+    args = parser.parse_args()
+
+    dsn = events.listener_dsn()
+    if not dsn:
+        sys.exit("DATABASE_URL is not set")
+
+    ready, results = multiprocessing.Queue(), multiprocessing.Queue()
+    processes = [
+        multiprocessing.Process(target=worker, args=(dsn, args.events, args.subscribers, ready, results))
+        for _ in range(args.workers)
+    ]
+    for process in processes:
+        process.start()
+    for _ in processes:
+        ready.get(timeout=30)
+
+    print(f"📡 {args.workers} workers x {args.subscribers} subscribers listening; "
+          f"publishing {args.events} events at {args.rate:g}/s")
+    elapsed = asyncio.run(publish(dsn, args.events, args.rate))
+
+    latencies = sorted(value for _ in processes for value in results.get(timeout=60))
+    for process in processes:
+        process.join()
+
+    expected = args.events * args.workers * args.subscribers
+    print(f"   published in {elapsed:.2f}s, delivered {len(latencies):,} of {expected:,}")
+    if latencies:
+        print(f"{'p50':>8}{'p95':>10}{'p99':>10}{'max':>10}  (ms)")
+        print("".join(f"{percentile(latencies, q) * 1000:>{w}.2f}" for q, w in ((0.5, 8), (0.95, 10), (0.99, 10), (1.0, 10))))
+    print("✅ done" if len(latencies) == expected else "⚠️  some events were not delivered")
+
+
+if __name__ == "__main__":
+    main()
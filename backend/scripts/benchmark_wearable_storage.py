@@ -0,0 +1,165 @@
+"""
+CloudCare Benchmark - Wearable sample storage layouts
+Compares bytes per sample and read throughput of:
+
+    rows      one WearableData row per reading with a Fernet-encrypted JSON
+              description (the original layout)
+    samples   one WearableSample row per reading (WEARABLES_SAMPLE_STORE=rows)
+    segments  compressed per-day WearableSegment blocks (WEARABLES_SAMPLE_STORE=segments)
+
+Runs offline on synthetic heart-rate data. Row sizes are estimated from
+Postgres' on-disk format (24-byte tuple header + 4-byte line pointer +
+column widths, plus one B-tree entry per index); segment sizes are the
+exact encoded blob plus the same per-row overhead.
+
+Usage:
+    python scripts/benchmark_wearable_storage.py [--days 7] [--interval 5] [--samples-per-record 60]
+"""
+
+import argparse
+import base64
+import json
+import os
+import sys
+import time
+import uuid
+from datetime import datetime, timezone
+
+import numpy as np
+from cryptography.fernet import Fernet
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "wearables-api"))
+
+from segments import decode_segment, encode_segment  # noqa: E402
+
+TUPLE_OVERHEAD = 24 + 4
+INDEX_ENTRY_OVERHEAD = 8 + 4
+
+
+def varlena(text: str) -> int:
+    size = len(text.encode())
+    return size + (1 if size < 127 else 4)
+
+
+def index_entry(*widths: int) -> int:
+    return INDEX_ENTRY_OVERHEAD + sum(widths)
+
+
+def synthesize(days: int, interval: int, per_record: int, seed: int = 7):
+    """Heart-rate samples every `interval` seconds, grouped into Health Connect records"""
+    rng = np.random.default_rng(seed)
+    count = days * 86400 // interval
+    start = np.datetime64("2024-01-01T00:00:00", "ms").astype(np.int64)
+    jitter = rng.integers(-200, 200, count) * (rng.random(count) < 0.02)
+    times = np.sort(start + np.arange(count, dtype=np.int64) * interval * 1000 + jitter)
+    values = np.rint(72 + 12 * np.sin(np.arange(count) / 720) + rng.normal(0, 3, count))
+    owners = np.arange(count) // per_record
+    item_ids = [str(uuid.UUID(int=int(rng.integers(0, 2 ** 63)) << 64)) for _ in range(owners[-1] + 1)]
+    return times, values, owners, item_ids
+
+
+def iso(ms: int) -> str:
+    return datetime.fromtimestamp(ms / 1000, tz=timezone.utc).isoformat()
+
+
+def bench_rows(times, values, owners, item_ids, cipher):
+    """Original layout: one row per reading, payload encrypted into description"""
+    descriptions = []
+    for t, v, owner in zip(times.tolist(), values.tolist(), owners.tolist()):
+        payload = {"time": iso(t), "beatsPerMinute": int(v)}
+        token = cipher.encrypt(json.dumps(payload).encode()).decode()
+        descriptions.append(json.dumps({"encrypted": token}))
+
+    method, digest, source = "heartRate", "0" * 64, "com.google.android.apps.fitness"
+    heap = 0
+    for description, owner in zip(descriptions, owners.tolist()):
+        heap += TUPLE_OVERHEAD + 4 + 4 + 8 + 4 + 8 + 8  # id, patientId, timestamp, heartRate, endTime, createdAt
+        heap += varlena(description) + varlena(method) + varlena(item_ids[owner]) + varlena(digest) + varlena(source)
+    indexes = len(descriptions) * (
+        index_entry(4)                                         # primary key
+        + index_entry(4, varlena(method), varlena(item_ids[0]))  # (patientId, method, itemId)
+        + index_entry(4, varlena(method), 8)                   # (patientId, method, timestamp)
+        + index_entry(4, 8)                                    # (patientId, timestamp)
+    )
+
+    started = time.perf_counter()
+    decoded = [json.loads(cipher.decrypt(json.loads(d)["encrypted"].encode())) for d in descriptions]
+    elapsed = time.perf_counter() - started
+    assert len(decoded) == len(times)
+    return heap + indexes, elapsed
+
+
+def bench_samples(times, values, owners, item_ids):
+    """WearableSample layout: one narrow row per reading"""
+    metric = "heartRate"
+    heap = len(times) * (TUPLE_OVERHEAD + 4 + 4 + 8 + 8 + varlena(metric) + varlena(item_ids[0]))
+    indexes = len(times) * (
+        index_entry(4)                                              # primary key
+        + index_entry(4, varlena(item_ids[0]), varlena(metric), 8)  # (patientId, itemId, metric, timestamp)
+        + index_entry(4, varlena(metric), 8)                        # (patientId, metric, timestamp)
+    )
+
+    # Reading rows back yields one Python object per sample (as Prisma returns them)
+    rows = [
+        {"itemId": item_ids[owner], "timestamp": datetime.fromtimestamp(t / 1000, tz=timezone.utc).replace(tzinfo=None), "value": v}
+        for t, v, owner in zip(times.tolist(), values.tolist(), owners.tolist())
+    ]
+    started = time.perf_counter()
+    parsed = np.array([r["value"] for r in rows])
+    stamps = np.array([r["timestamp"] for r in rows], dtype="datetime64[ms]")
+    elapsed = time.perf_counter() - started
+    assert len(parsed) == len(stamps) == len(times)
+    return heap + indexes, elapsed
+
+
+def bench_segments(times, values, owners, item_ids):
+    """WearableSegment layout: one compressed block per UTC day"""
+    day = 86400 * 1000
+    blobs = []
+    for start in range(int(times[0] // day) * day, int(times[-1]) + 1, day):
+        mask = (times >= start) & (times < start + day)
+        if not mask.any():
+            continue
+        used, local = np.unique(owners[mask], return_inverse=True)
+        blobs.append(encode_segment(times[mask], values[mask], local, [item_ids[i] for i in used]))
+
+    heap = sum(TUPLE_OVERHEAD + 4 + 4 + varlena("heartRate") + 8 + 4 + 8 + 8 + 8 * 3 + 8 + len(b) + 4 for b in blobs)
+    indexes = len(blobs) * (index_entry(4) + index_entry(4, varlena("heartRate"), 8))
+
+    started = time.perf_counter()
+    decoded = [decode_segment(b) for b in blobs]
+    elapsed = time.perf_counter() - started
+    assert sum(len(d["time"]) for d in decoded) == len(times)
+    return heap + indexes, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark wearable sample storage layouts")
+    parser.add_argument("--days", type=int, default=7)
+    parser.add_argument("--interval", type=int, default=5, help="seconds between samples")
+    parser.add_argument("--samples-per-record", type=int, default=60)
+    args = parser.parse_args()
+
+    times, values, owners, item_ids = synthesize(args.days, args.interval, args.samples_per_record)
+    cipher = Fernet(base64.urlsafe_b64encode(b"benchmark-password-hash".ljust(32)[:32]))
+    count = len(times)
+    print(f"📊 {count:,} heart-rate samples over {args.days} days "
+          f"({args.interval}s interval, {args.samples_per_record} per record)\n")
+
+    results = [
+        ("rows", *bench_rows(times, values, owners, item_ids, cipher)),
+        ("samples", *bench_samples(times, values, owners, item_ids)),
+        ("segments", *bench_segments(times, values, owners, item_ids)),
+    ]
+
+    print(f"{'layout':<10}{'total bytes':>14}{'bytes/sample':>14}{'read samples/s':>18}")
+    for name, size, elapsed in results:
+        rate = count / elapsed if elapsed else float("inf")
+        print(f"{name:<10}{size:>14,}{size / count:>14.2f}{rate:>18,.0f}")
+
+    baseline = results[0][1]
+    print(f"\n✅ segments use {baseline / results[2][1]:.0f}x less space than rows")
+
+
+if __name__ == "__main__":
+    main()
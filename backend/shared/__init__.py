@@ -9,11 +9,13 @@ from .database import (
     get_prisma,
     prisma_client
 )
+from .cache import TTLCache
 
 __all__ = [
     "connect_db",
     "disconnect_db",
     "get_db",
     "get_prisma",
-    "prisma_client"
+    "prisma_client",
+    "TTLCache"
 ]
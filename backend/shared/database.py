@@ -9,8 +9,12 @@ from typing import AsyncGenerator
 import os
 from dotenv import load_dotenv
 
+from .log import get_logger
+
 load_dotenv()
 
+log = get_logger("database")
+
 # Global Prisma client instance
 prisma_client = Prisma()
 
@@ -19,14 +23,14 @@ async def connect_db():
     """Connect to the database"""
     if not prisma_client.is_connected():
         await prisma_client.connect()
-        print("✓ Database connected successfully")
+        log.info("database.connected")
 
 
 async def disconnect_db():
     """Disconnect from the database"""
     if prisma_client.is_connected():
         await prisma_client.disconnect()
-        print("✓ Database disconnected")
+        log.info("database.disconnected")
 
 
 @asynccontextmanager
@@ -41,8 +45,8 @@ async def get_db() -> AsyncGenerator[Prisma, None]:
         await connect_db()
     try:
         yield prisma_client
-    except Exception as e:
-        print(f"Database error: {e}")
+    except Exception:
+        log.exception("database.error")
         raise
 
 
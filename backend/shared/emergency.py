@@ -0,0 +1,221 @@
+"""
+Shared emergency alert logic for CloudCare APIs
+Alerts are created the same way whether a user POSTs to the Emergency API
+or a service raises one automatically (e.g. wearable anomaly detection).
+
+Creation is latency-critical: the patient and hospital lookups run
+concurrently, the alert insert and the patient's emergency flag commit in
+one transaction, and the event is published right after the commit.
+
+Automatically raised alerts can ask for a cooldown: an alert is then
+dropped while the same patient has an alert of the same type and trigger
+metric, at the same or a higher severity, that is still active or younger
+than the cooldown. An escalation (say critical after high) always goes
+through. The check runs
+in the insert transaction under a per-patient advisory lock, so it holds
+across every worker and replica.
+"""
+
+import asyncio
+import json
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional, Tuple
+
+from prisma import Prisma
+
+from .events import publish_event, publish_events
+from .models import EmergencyAlertCreate
+
+# Statuses that keep a patient's emergency flag raised
+ACTIVE_STATUSES = ("active", "acknowledged", "responding")
+
+COOLDOWN_ERROR = "Cooling down"
+
+# Higher ranks escalate past a cooldown set by lower ones
+SEVERITY_RANK = {"low": 0, "medium": 1, "high": 2, "critical": 3}
+
+# pg_advisory_xact_lock(namespace, patient id) serialises cooldown checks per patient
+COOLDOWN_LOCK_SQL = """
+SELECT pg_advisory_xact_lock(7201, p::int)
+FROM jsonb_array_elements_text($1::jsonb) AS p
+ORDER BY p::int
+"""
+
+
+def new_alert_id() -> str:
+    """Alert id for automatically raised alerts"""
+    return f"ALERT-{uuid.uuid4().hex[:12].upper()}"
+
+
+def alert_row(alert: EmergencyAlertCreate, patient_db_id: int, hospital_db_id: Optional[int]) -> Dict[str, Any]:
+    return {
+        "alertId": alert.alert_id,
+        "patientId": patient_db_id,
+        "hospitalId": hospital_db_id,
+        "alertType": alert.alert_type,
+        "severity": alert.severity,
+        "description": alert.description,
+        "triggeredBy": alert.triggered_by,
+        "triggerData": alert.trigger_data,
+        "location": alert.location,
+        "status": "active"
+    }
+
+
+def broadcast_payload(alert: EmergencyAlertCreate, patient: Any, new_alert: Any) -> Dict[str, Any]:
+    return {
+        "alert_id": new_alert.alertId,
+        "patient_id": alert.patient_id,
+        "patient_name": patient.name,
+        "alert_type": new_alert.alertType,
+        "severity": new_alert.severity,
+        "status": new_alert.status,
+        "description": new_alert.description,
+        "triggered_by": new_alert.triggeredBy,
+        "location": alert.location,
+        "trigger_data": alert.trigger_data,
+        "timestamp": new_alert.createdAt.isoformat(),
+        "hospital_id": alert.hospital_id
+    }
+
+
+async def _nothing() -> None:
+    return None
+
+
+def cooldown_key(patient_id: int, alert_type: str, trigger_data: Optional[str]) -> Tuple[int, str, Optional[str]]:
+    """Alerts sharing patient, type and trigger metric (trigger_data JSON "metric") cool down together"""
+    try:
+        metric = json.loads(trigger_data).get("metric") if trigger_data else None
+    except (ValueError, AttributeError):
+        metric = None
+    return patient_id, alert_type, metric
+
+
+def severity_rank(severity: Optional[str]) -> int:
+    return SEVERITY_RANK.get((severity or "").lower(), 0)
+
+
+async def cooling_down(
+    transaction: Prisma,
+    alerts: List[EmergencyAlertCreate],
+    seconds: int
+) -> Dict[Tuple[int, str, Optional[str]], int]:
+    """
+    Cooldown key -> highest severity rank of its alerts still active or younger than seconds
+    Locks the patients until commit. createdAt is stamped in UTC, so the
+    window is measured with an aware UTC clock whatever the server's zone.
+    """
+    patient_ids = sorted({a.patient_id for a in alerts})
+    await transaction.execute_raw(COOLDOWN_LOCK_SQL, json.dumps(patient_ids))
+    recent = await transaction.emergencyalert.find_many(where={
+        "patientId": {"in": patient_ids},
+        "alertType": {"in": sorted({a.alert_type for a in alerts})},
+        "OR": [
+            {"status": {"in": list(ACTIVE_STATUSES)}},
+            {"createdAt": {"gte": datetime.now(timezone.utc) - timedelta(seconds=seconds)}}
+        ]
+    })
+    cooling: Dict[Tuple[int, str, Optional[str]], int] = {}
+    for r in recent:
+        key = cooldown_key(r.patientId, r.alertType, r.triggerData)
+        cooling[key] = max(cooling.get(key, 0), severity_rank(r.severity))
+    return cooling
+
+
+async def create_emergency_alert(db: Prisma, alert: EmergencyAlertCreate) -> Tuple[Any, Dict[str, Any]]:
+    """
+    Store an alert, raise the patient's emergency flag and publish it to every SSE stream
+    Returns (alert row, SSE broadcast payload); raises LookupError for an unknown patient.
+    """
+    # Hospitals are referenced by name
+    patient, hospital = await asyncio.gather(
+        db.patient.find_unique(where={"id": alert.patient_id}),
+        db.hospital.find_unique(where={"name": alert.hospital_id}) if alert.hospital_id else _nothing()
+    )
+    if not patient:
+        raise LookupError(f"Patient {alert.patient_id} not found")
+
+    async with db.tx() as transaction:
+        new_alert = await transaction.emergencyalert.create(
+            data=alert_row(alert, patient.id, hospital.id if hospital else None)
+        )
+        if not patient.emergency:
+            await transaction.patient.update(where={"id": patient.id}, data={"emergency": True})
+
+    broadcast_data = broadcast_payload(alert, patient, new_alert)
+    await publish_event(db, "emergency_alert", broadcast_data)
+    return new_alert, broadcast_data
+
+
+async def create_emergency_alerts(
+    db: Prisma,
+    alerts: List[EmergencyAlertCreate],
+    cooldown_seconds: int = 0
+) -> Tuple[List[Any], List[Dict[str, str]]]:
+    """
+    Create many alerts set-wise: three concurrent lookups, one transaction, one publish
+    Returns (created alert rows, rejected [{"alert_id", "error"}]); unknown
+    patients, duplicate alert ids and (with cooldown_seconds) alerts still
+    cooling down are rejected without failing the rest. An alert more
+    severe than everything cooling down under its key is an escalation and
+    is created.
+    """
+    patient_ids = sorted({a.patient_id for a in alerts})
+    hospital_names = sorted({a.hospital_id for a in alerts if a.hospital_id})
+    patients, hospitals, existing = await asyncio.gather(
+        db.patient.find_many(where={"id": {"in": patient_ids}}),
+        db.hospital.find_many(where={"name": {"in": hospital_names}}) if hospital_names else _nothing(),
+        db.emergencyalert.find_many(where={"alertId": {"in": [a.alert_id for a in alerts]}})
+    )
+    patients_by_id = {p.id: p for p in patients}
+    hospital_ids = {h.name: h.id for h in hospitals or []}
+    taken = {a.alertId for a in existing}
+
+    accepted: List[EmergencyAlertCreate] = []
+    rejected: List[Dict[str, str]] = []
+    for alert in alerts:
+        if alert.patient_id not in patients_by_id:
+            rejected.append({"alert_id": alert.alert_id, "error": f"Patient {alert.patient_id} not found"})
+        elif alert.alert_id in taken:
+            rejected.append({"alert_id": alert.alert_id, "error": "Duplicate alert id"})
+        else:
+            taken.add(alert.alert_id)
+            accepted.append(alert)
+    if not accepted:
+        return [], rejected
+
+    async with db.tx() as transaction:
+        if cooldown_seconds:
+            cooling = await cooling_down(transaction, accepted, cooldown_seconds)
+            kept = []
+            for alert in accepted:
+                key = cooldown_key(alert.patient_id, alert.alert_type, alert.trigger_data)
+                rank = severity_rank(alert.severity)
+                if key in cooling and rank <= cooling[key]:
+                    rejected.append({"alert_id": alert.alert_id, "error": COOLDOWN_ERROR})
+                else:
+                    cooling[key] = rank
+                    kept.append(alert)
+            accepted = kept
+            if not accepted:
+                return [], rejected
+
+        flagged = sorted({a.patient_id for a in accepted if not patients_by_id[a.patient_id].emergency})
+        await transaction.emergencyalert.create_many(
+            data=[alert_row(a, a.patient_id, hospital_ids.get(a.hospital_id)) for a in accepted]
+        )
+        if flagged:
+            await transaction.patient.update_many(where={"id": {"in": flagged}}, data={"emergency": True})
+        rows = await transaction.emergencyalert.find_many(
+            where={"alertId": {"in": [a.alert_id for a in accepted]}}
+        )
+
+    by_alert_id = {row.alertId: row for row in rows}
+    created = [by_alert_id[a.alert_id] for a in accepted]
+    await publish_events(db, [
+        ("emergency_alert", broadcast_payload(a, patients_by_id[a.patient_id], row))
+        for a, row in zip(accepted, created)
+    ])
+    return created, rejected
@@ -3,9 +3,29 @@
 
 echo "🔄 Checking database and running Prisma setup..."
 
+# Once prisma/partition_wearable_data.py has partitioned WearableData, never let
+# `db push --accept-data-loss` change it: Prisma does not model partitioned
+# tables. If the pending diff touches WearableData the push is skipped; apply
+# that change by hand on the partitioned table (or re-run the migration).
+PARTITIONED=$(psql "${DATABASE_URL%%\?*}" -tAc "SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass('public.\"WearableData\"')" 2>/dev/null)
+PUSH=1
+if [ "$PARTITIONED" = "1" ]; then
+    if ! prisma migrate diff --from-schema-datasource /app/prisma/schema.prisma \
+        --to-schema-datamodel /app/prisma/schema.prisma --script > /tmp/pending.sql 2>&1 \
+        || grep -q '"WearableData"' /tmp/pending.sql; then
+        PUSH=0
+        echo "⚠️  Pending schema changes touch the partitioned WearableData table (or could not be diffed); skipping prisma db push:"
+        cat /tmp/pending.sql
+    fi
+fi
+
 # Push schema directly (works better for fresh setups)
-echo "📊 Pushing Prisma schema to database..."
-prisma db push --accept-data-loss --skip-generate --schema=/app/prisma/schema.prisma 2>&1 | tee /tmp/migrate.log
+if [ "$PUSH" = "1" ]; then
+    echo "📊 Pushing Prisma schema to database..."
+    prisma db push --accept-data-loss --skip-generate --schema=/app/prisma/schema.prisma 2>&1 | tee /tmp/migrate.log
+else
+    echo "Schema push skipped" > /tmp/migrate.log
+fi
 
 if grep -q "already in sync" /tmp/migrate.log || grep -q "Your database is now in sync" /tmp/migrate.log; then
     echo "✅ Database schema is ready"
@@ -0,0 +1,228 @@
+"""
+Cross-process emergency events for CloudCare APIs
+Alert and status events are published with Postgres NOTIFY on one channel.
+Every emergency-api process holds a single LISTEN connection and hands what
+it receives to its local handlers (the SSE hub), so a dashboard sees an
+alert whichever worker, replica or service created it:
+
+    wearables-api, emergency-api
+        -> NOTIFY cloudcare_emergency (sent when the transaction commits)
+        -> LISTEN in each emergency-api worker -> its hub -> its SSE clients
+
+    EMERGENCY_EVENT_BUS   postgres (default) | local
+                          local delivers in-process only: tests and
+                          single-process development without a database
+
+Every event is also stored in EmergencyEvent in the same statement; its id
+is the SSE event id, so clients that reconnect with Last-Event-ID can be
+replayed what they missed (including events sent while a listener was
+reconnecting). Ids follow insert order, so an event whose transaction
+commits late can arrive after one with a higher id; replay covers that
+with a trailing window of ids (see emergency-api/hub.py). Stored events are
+pruned after EMERGENCY_EVENT_RETENTION_HOURS.
+
+NOTIFY payloads are capped at 8000 bytes by Postgres; oversized events are
+sent without their trigger_data (the stored copy keeps it).
+"""
+
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from datetime import datetime, timedelta
+import asyncio
+import itertools
+import json
+import os
+import time
+
+from prisma import Prisma
+
+from .log import get_logger
+from .metrics import metrics
+
+try:
+    import asyncpg
+except ImportError:  # optional: without it only the local bus is available
+    asyncpg = None
+
+log = get_logger("events")
+
+EVENT_BUS = os.getenv("EMERGENCY_EVENT_BUS", "postgres")  # postgres | local
+CHANNEL = "cloudcare_emergency"
+MAX_PAYLOAD_BYTES = 7900
+RECONNECT_MAX_SECONDS = 30
+EVENT_RETENTION_HOURS = int(os.getenv("EMERGENCY_EVENT_RETENTION_HOURS", "24"))
+PRUNE_INTERVAL_SECONDS = 3600
+
+# Store a batch of events and notify each with its id in one statement
+# ($1: JSON array of {event, data, payload}); ids are drawn in array order
+PUBLISH_SQL = """
+WITH input AS (
+    SELECT nextval(pg_get_serial_sequence('"EmergencyEvent"', 'id'))::int AS "id", "event", "data", "payload"
+    FROM jsonb_to_recordset($1::jsonb) AS t("event" text, "data" text, "payload" text)
+),
+stored AS (
+    INSERT INTO "EmergencyEvent" ("id", "event", "data") SELECT "id", "event", "data" FROM input
+)
+SELECT pg_notify($2, (jsonb_build_object('id', "id") || "payload"::jsonb)::text) FROM input
+"""
+
+# handler(event name, event data, event id)
+Handler = Callable[[str, Dict[str, Any], Optional[int]], Any]
+
+_handlers: List[Handler] = []
+
+# Event ids on the local bus (nothing is stored)
+_local_ids = itertools.count(1)
+
+
+def use_local_bus() -> bool:
+    return EVENT_BUS == "local" or asyncpg is None
+
+
+def add_handler(handler: Handler) -> None:
+    """Receive every event delivered to this process"""
+    if handler not in _handlers:
+        _handlers.append(handler)
+
+
+def remove_handler(handler: Handler) -> None:
+    if handler in _handlers:
+        _handlers.remove(handler)
+
+
+def encode_event(name: str, data: Dict[str, Any], event_id: Optional[int] = None) -> str:
+    message = {"event": name, "data": data, "sent": time.time()}
+    if event_id is not None:
+        message["id"] = event_id
+    payload = json.dumps(message, default=str)
+    if len(payload.encode()) > MAX_PAYLOAD_BYTES and "trigger_data" in data:
+        metrics.incr("events.truncated")
+        message["data"] = {**data, "trigger_data": None, "truncated": True}
+        payload = json.dumps(message, default=str)
+    return payload
+
+
+def dispatch(payload: str) -> None:
+    """Hand a received payload to this process's handlers"""
+    try:
+        message = json.loads(payload)
+    except ValueError:
+        metrics.incr("events.malformed")
+        return
+    metrics.incr("events.received")
+    # Publisher clock to this process; both read the same NTP-synced host clocks
+    metrics.observe("events.delivery_latency", max(time.time() - message.get("sent", time.time()), 0.0))
+    for handler in list(_handlers):
+        try:
+            handler(message["event"], message["data"], message.get("id"))
+        except Exception:
+            metrics.incr("events.handler_errors")
+            log.exception("events.handler_failed", event=message.get("event"))
+
+
+async def publish_events(db: Prisma, batch: List[Tuple[str, Dict[str, Any]]]) -> bool:
+    """
+    Store events and publish them, in order, to every listening process (one round trip)
+    Inside a transaction both happen when it commits. Returns False (and
+    logs) on failure; the caller's own writes are unaffected.
+    """
+    if not batch:
+        return True
+    try:
+        if use_local_bus():
+            for name, data in batch:
+                dispatch(encode_event(name, data, next(_local_ids)))
+        else:
+            rows = [
+                {"event": name, "data": json.dumps(data, default=str), "payload": encode_event(name, data)}
+                for name, data in batch
+            ]
+            await db.execute_raw(PUBLISH_SQL, json.dumps(rows), CHANNEL)
+        metrics.incr("events.published", len(batch))
+        return True
+    except Exception:
+        metrics.incr("events.publish_errors")
+        log.exception("events.publish_failed", events=len(batch), event=batch[0][0])
+        return False
+
+
+async def publish_event(db: Prisma, name: str, data: Dict[str, Any]) -> bool:
+    """Store one event and publish it to every listening process"""
+    return await publish_events(db, [(name, data)])
+
+
+def listener_dsn() -> str:
+    """DATABASE_URL without Prisma-only query parameters (?schema=...)"""
+    return os.getenv("DATABASE_URL", "").split("?", 1)[0]
+
+
+async def listen_loop(dsn: str, channel: str = CHANNEL) -> None:
+    """Background task: hold one LISTEN connection, reconnecting with backoff"""
+    delay = 1
+    while True:
+        connection = None
+        try:
+            connection = await asyncpg.connect(dsn)
+            lost = asyncio.Event()
+            connection.add_termination_listener(lambda _: lost.set())
+            await connection.add_listener(channel, lambda _conn, _pid, _channel, payload: dispatch(payload))
+            metrics.set_gauge("events.listening", 1)
+            log.info("events.listening", channel=channel)
+            delay = 1
+            await lost.wait()
+            log.warning("events.connection_lost", channel=channel)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            log.warning("events.listen_failed", error=str(e), retry_in=delay)
+        finally:
+            metrics.set_gauge("events.listening", 0)
+            if connection is not None and not connection.is_closed():
+                await connection.close()
+        metrics.incr("events.reconnects")
+        await asyncio.sleep(delay)
+        delay = min(delay * 2, RECONNECT_MAX_SECONDS)
+
+
+async def prune_events(db: Prisma, now: Optional[datetime] = None) -> int:
+    """Delete stored events older than EVENT_RETENTION_HOURS"""
+    cutoff = (now or datetime.utcnow()) - timedelta(hours=EVENT_RETENTION_HOURS)
+    return await db.emergencyevent.delete_many(where={"createdAt": {"lt": cutoff}})
+
+
+async def prune_loop(db: Prisma) -> None:
+    """Background task: prune stored events every PRUNE_INTERVAL_SECONDS"""
+    while True:
+        try:
+            pruned = await prune_events(db)
+            if pruned:
+                metrics.incr("events.pruned", pruned)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            log.exception("events.prune_failed")
+        await asyncio.sleep(PRUNE_INTERVAL_SECONDS)
+
+
+# One listener connection and one pruner per process (neither with the local bus)
+listener_task: Optional[asyncio.Task] = None
+prune_task: Optional[asyncio.Task] = None
+
+
+def start_event_listener(db: Prisma, dsn: Optional[str] = None) -> None:
+    global listener_task, prune_task
+    if use_local_bus():
+        log.info("events.local_bus", reason="asyncpg missing" if asyncpg is None else EVENT_BUS)
+        return
+    if listener_task is None:
+        listener_task = asyncio.create_task(listen_loop(dsn or listener_dsn()))
+    if prune_task is None:
+        prune_task = asyncio.create_task(prune_loop(db))
+
+
+async def stop_event_listener() -> None:
+    global listener_task, prune_task
+    for task in (listener_task, prune_task):
+        if task is not None:
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+    listener_task = prune_task = None
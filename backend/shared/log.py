@@ -0,0 +1,183 @@
+"""
+Shared structured logging for CloudCare APIs
+Request handlers only build a LogRecord and drop it on an in-memory queue;
+a background thread formats and writes it, so slow stdout (docker log
+drivers, terminals) never stalls the event loop.
+
+    LOG_LEVEL         DEBUG | INFO | WARNING | ERROR (default INFO)
+    LOG_FORMAT        json (one object per line, default) | text
+    LOG_QUEUE_SIZE    records buffered before new ones are dropped
+    LOG_SAMPLE        per-event overrides of the sampling interval,
+                      e.g. "auth.token_valid=100,fetch.page=10"
+
+Usage:
+    log = get_logger("wearables")
+    log.info("sync.complete", patient_id=7, new=120)
+    log.debug("auth.token_valid", every=100, user=email)   # 1 in 100 emitted
+    log.exception("sync.error", method=method)             # with traceback
+"""
+
+import json
+import logging
+import os
+import queue
+import sys
+import threading
+import traceback
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+from typing import Any, Dict, Optional
+
+from .metrics import metrics
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json")
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+
+ROOT = "cloudcare"
+
+
+def _parse_sampling(raw: str) -> Dict[str, int]:
+    rates = {}
+    for item in raw.split(","):
+        name, _, every = item.partition("=")
+        if name.strip() and every.strip().isdigit():
+            rates[name.strip()] = max(int(every), 1)
+    return rates
+
+
+SAMPLE_OVERRIDES = _parse_sampling(os.getenv("LOG_SAMPLE", ""))
+
+# Written by the formatter; caller fields never override them
+RESERVED_KEYS = frozenset(("ts", "level", "service", "logger", "event"))
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line: ts, level, service, event and the call's fields"""
+
+    def __init__(self, service: str):
+        super().__init__()
+        self.service = service
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, tz=timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname.lower(),
+            "service": self.service,
+            "logger": record.name,
+            "event": record.getMessage()
+        }
+        # A caller field named like a reserved key is kept with a "field_" prefix
+        for key, value in getattr(record, "fields", {}).items():
+            entry[f"field_{key}" if key in RESERVED_KEYS else key] = value
+        if record.exc_info:
+            entry["error"] = "".join(traceback.format_exception(*record.exc_info)).rstrip()
+        return json.dumps(entry, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    """Human-readable lines for local development"""
+
+    def __init__(self, service: str):
+        super().__init__()
+        self.service = service
+
+    def format(self, record: logging.LogRecord) -> str:
+        when = datetime.fromtimestamp(record.created).strftime("%H:%M:%S")
+        fields = " ".join(f"{key}={value}" for key, value in getattr(record, "fields", {}).items())
+        line = f"{when} {record.levelname:<7} [{self.service}] {record.getMessage()} {fields}".rstrip()
+        if record.exc_info:
+            line += "\n" + "".join(traceback.format_exception(*record.exc_info)).rstrip()
+        return line
+
+
+class DroppingQueueHandler(QueueHandler):
+    """Never blocks the caller: when the queue is full the record is dropped and counted"""
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            metrics.incr("logging.dropped")
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Same process: hand the record over as is and format it on the writer thread
+        return record
+
+
+class StructLogger:
+    """Thin wrapper turning keyword arguments into structured fields"""
+
+    def __init__(self, logger: logging.Logger):
+        self.logger = logger
+        self._counts: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def _sampled(self, event: str, every: int) -> Optional[int]:
+        """Sampling interval if this occurrence should be emitted, else None"""
+        every = SAMPLE_OVERRIDES.get(event, every)
+        if every <= 1:
+            return 1
+        with self._lock:
+            count = self._counts.get(event, 0)
+            self._counts[event] = count + 1
+        return every if count % every == 0 else None
+
+    def log(self, level: int, event: str, every: int = 1, exc_info: Any = None, **fields: Any) -> None:
+        if not self.logger.isEnabledFor(level):
+            return
+        sampled = self._sampled(event, every)
+        if sampled is None:
+            return
+        if sampled > 1:
+            fields["sampled"] = sampled
+        self.logger.log(level, event, exc_info=exc_info, extra={"fields": fields})
+
+    def debug(self, event: str, **fields: Any) -> None:
+        self.log(logging.DEBUG, event, **fields)
+
+    def info(self, event: str, **fields: Any) -> None:
+        self.log(logging.INFO, event, **fields)
+
+    def warning(self, event: str, **fields: Any) -> None:
+        self.log(logging.WARNING, event, **fields)
+
+    def error(self, event: str, **fields: Any) -> None:
+        self.log(logging.ERROR, event, **fields)
+
+    def exception(self, event: str, **fields: Any) -> None:
+        """Error with the active exception's traceback"""
+        self.log(logging.ERROR, event, exc_info=True, **fields)
+
+
+_listener: Optional[QueueListener] = None
+
+
+def configure_logging(service: str, level: str = LOG_LEVEL, fmt: str = LOG_FORMAT) -> None:
+    """Route every CloudCare logger through the background writer (idempotent)"""
+    global _listener
+    if _listener is not None:
+        return
+    output = logging.StreamHandler(sys.stdout)
+    output.setFormatter(TextFormatter(service) if fmt == "text" else JsonFormatter(service))
+
+    records: "queue.Queue[logging.LogRecord]" = queue.Queue(maxsize=LOG_QUEUE_SIZE)
+    root = logging.getLogger(ROOT)
+    root.handlers = [DroppingQueueHandler(records)]
+    root.setLevel(level)
+    root.propagate = False
+
+    _listener = QueueListener(records, output, respect_handler_level=False)
+    _listener.start()
+
+
+def shutdown_logging() -> None:
+    """Flush queued records and stop the writer thread"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+def get_logger(name: str) -> StructLogger:
+    return StructLogger(logging.getLogger(f"{ROOT}.{name}"))
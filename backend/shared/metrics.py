@@ -0,0 +1,66 @@
+"""
+Shared in-process metrics for CloudCare APIs
+Counters, gauges and timings exposed as a JSON snapshot by each service
+"""
+
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator
+
+
+class Metrics:
+    """
+    Minimal metrics registry (one per process)
+    Usage:
+        metrics.incr("sync.items", 500)
+        with metrics.timer("crypto.encrypt"):
+            ...
+        metrics.snapshot()
+    """
+
+    def __init__(self):
+        self._counters: Dict[str, float] = defaultdict(float)
+        self._gauges: Dict[str, float] = {}
+        self._timings: Dict[str, Dict[str, float]] = {}
+
+    def incr(self, name: str, value: float = 1) -> None:
+        self._counters[name] += value
+
+    def set_gauge(self, name: str, value: float) -> None:
+        self._gauges[name] = value
+
+    def observe(self, name: str, seconds: float) -> None:
+        """Record one duration sample (count, total and max are kept)"""
+        timing = self._timings.get(name)
+        if timing is None:
+            timing = self._timings[name] = {"count": 0, "total_seconds": 0.0, "max_seconds": 0.0}
+        timing["count"] += 1
+        timing["total_seconds"] += seconds
+        if seconds > timing["max_seconds"]:
+            timing["max_seconds"] = seconds
+
+    @contextmanager
+    def timer(self, name: str) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start)
+
+    def snapshot(self) -> Dict[str, Any]:
+        timings = {}
+        for name, timing in self._timings.items():
+            timings[name] = {
+                **timing,
+                "avg_seconds": timing["total_seconds"] / timing["count"] if timing["count"] else 0.0
+            }
+        return {
+            "counters": dict(self._counters),
+            "gauges": dict(self._gauges),
+            "timings": timings
+        }
+
+
+# Process-wide registry
+metrics = Metrics()
@@ -0,0 +1,277 @@
+"""
+Streaming Vitals Anomaly Detection
+Every ingested batch is checked against per-patient rules before the sync
+request returns:
+
+    threshold   heart rate / SpO2 outside fixed clinical bounds
+    zscore      readings far from the patient's own rolling baseline
+                (trailing window of the last WINDOW_SIZE readings, cached
+                per patient and metric)
+
+Detection is vectorised over the whole batch with NumPy and timed against
+a budget of ANOMALY_BUDGET_MS per 1,000 readings. Findings become
+EmergencyAlert rows through the shared emergency alert logic, created in
+the background so alert writes never hold up the sync response.
+
+State is per process. The cooldown cache only saves database work: the
+cooldown itself is enforced when the alert is inserted (an active or
+recent critical_vitals alert for the same patient and metric at the same
+or a higher severity suppresses the new one), so several workers or
+replicas never double-alert, while an escalation always gets through. The
+z-score baselines are not shared, though; with more than one worker each
+baseline is built only from the batches that worker ingested. This can
+delay or weaken the zscore rule, while threshold rules are unaffected.
+"""
+
+from typing import Any, Dict, List, Optional, Set, Tuple
+from datetime import datetime
+import asyncio
+import json
+import os
+import time
+
+import numpy as np
+from prisma import Prisma
+
+from shared.cache import TTLCache
+from shared.emergency import COOLDOWN_ERROR, create_emergency_alerts, new_alert_id, severity_rank
+from shared.log import get_logger
+from shared.metrics import metrics
+from shared.models import EmergencyAlertCreate
+
+from rollups import to_utc_naive
+from samples import sample_metric
+
+log = get_logger("wearables.anomaly")
+
+ANOMALY_DETECTION = os.getenv("WEARABLES_ANOMALY_DETECTION", "on") == "on"
+WINDOW_SIZE = int(os.getenv("WEARABLES_ANOMALY_WINDOW", "256"))
+MIN_BASELINE = int(os.getenv("WEARABLES_ANOMALY_MIN_BASELINE", "30"))
+Z_THRESHOLD = float(os.getenv("WEARABLES_ANOMALY_Z_THRESHOLD", "4.0"))
+Z_MIN_POINTS = int(os.getenv("WEARABLES_ANOMALY_Z_MIN_POINTS", "3"))
+MAX_AGE_SECONDS = int(os.getenv("WEARABLES_ANOMALY_MAX_AGE_SECONDS", "1800"))
+COOLDOWN_SECONDS = int(os.getenv("WEARABLES_ANOMALY_COOLDOWN_SECONDS", "600"))
+ANOMALY_BUDGET_MS = float(os.getenv("WEARABLES_ANOMALY_BUDGET_MS", "2.0"))
+
+# Ignore baselines flatter than this (a resting, perfectly steady signal is not a reason to alert)
+MIN_STD = {"heartRate": 2.0, "oxygenLevel": 0.5}
+
+# metric -> [(severity, low, high)], most severe first; a reading outside (low, high) fires
+THRESHOLDS = {
+    "heartRate": [("critical", 40, 180), ("high", 45, 150)],
+    "oxygenLevel": [("critical", 85, None), ("high", 90, None)]
+}
+
+UNITS = {"heartRate": "bpm", "oxygenLevel": "%"}
+LABELS = {"heartRate": "Heart rate", "oxygenLevel": "SpO2"}
+
+# (patient_id, metric) -> trailing readings; idle patients age out
+windows = TTLCache(maxsize=50_000, ttl=6 * 3600)
+
+# (patient_id, metric) -> severity rank of the alert created for it, while it
+# cools down; a local shortcut, shared/emergency.py enforces the cooldown
+# across processes
+cooldowns = TTLCache(maxsize=50_000, ttl=COOLDOWN_SECONDS)
+
+pending_alerts: Set[asyncio.Task] = set()
+
+
+def _row_series(records: List[Dict[str, Any]], column: str) -> Tuple[np.ndarray, np.ndarray]:
+    rows = [record["row"] for record in records if record["row"].get(column) is not None]
+    times = np.array([to_utc_naive(row["timestamp"]) for row in rows], dtype="datetime64[ms]")
+    values = np.array([row[column] for row in rows], dtype=np.float64)
+    return times, values
+
+
+def vital_series(
+    method: str,
+    prepared: List[Dict[str, Any]],
+    expanded: Optional[Dict[str, np.ndarray]],
+    keep: Optional[Set[str]] = None
+) -> Dict[str, Tuple[np.ndarray, np.ndarray]]:
+    """
+    (times, values) per monitored metric for a prepared batch
+    Heart-rate samples are used individually when the records carry them.
+    keep: optional set of itemIds to evaluate (e.g. only new/changed records)
+    """
+    records = prepared if keep is None else [r for r in prepared if r["row"]["itemId"] in keep]
+    series = {}
+    if sample_metric(method) == "heartRate" and expanded is not None and len(expanded["owner"]):
+        mask = np.ones(len(expanded["owner"]), dtype=bool)
+        if keep is not None:
+            kept = np.array([record["row"]["itemId"] in keep for record in prepared], dtype=bool)
+            mask = kept[expanded["owner"]]
+        series["heartRate"] = (expanded["time"][mask], expanded["value"][mask])
+    else:
+        series["heartRate"] = _row_series(records, "heartRate")
+    series["oxygenLevel"] = _row_series(records, "oxygenLevel")
+    return {metric: s for metric, s in series.items() if len(s[1])}
+
+
+def _rolling_z(history: np.ndarray, values: np.ndarray, metric: str) -> np.ndarray:
+    """z-score of each value against the WINDOW_SIZE readings preceding it (NaN without a baseline)"""
+    combined = np.concatenate([history, values])
+    sums = np.concatenate([[0.0], np.cumsum(combined)])
+    squares = np.concatenate([[0.0], np.cumsum(combined * combined)])
+    end = np.arange(len(history), len(combined))
+    start = np.maximum(end - WINDOW_SIZE, 0)
+    count = end - start
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mean = (sums[end] - sums[start]) / count
+        std = np.sqrt(np.maximum((squares[end] - squares[start]) / count - mean * mean, 0.0))
+        z = (values - mean) / std
+    z[(count < MIN_BASELINE) | (std < MIN_STD.get(metric, 1.0))] = np.nan
+    return z
+
+
+def _finding(
+    metric: str,
+    rule: str,
+    severity: str,
+    times: np.ndarray,
+    values: np.ndarray,
+    fired: np.ndarray,
+    score: np.ndarray,
+    **extra
+) -> Dict[str, Any]:
+    """Summarise the readings that fired a rule around the worst one (highest score)"""
+    worst = int(np.argmax(np.where(fired, score, -np.inf)))
+    return {
+        "metric": metric,
+        "rule": rule,
+        "severity": severity,
+        "value": float(values[worst]),
+        "time": times[worst].astype(datetime).isoformat(),
+        "readings": int(fired.sum()),
+        **extra
+    }
+
+
+def detect_anomalies(
+    patient_id: int,
+    series: Dict[str, Tuple[np.ndarray, np.ndarray]],
+    now: Optional[datetime] = None
+) -> List[Dict[str, Any]]:
+    """
+    Evaluate one batch and advance the patient's baselines
+    Only readings newer than MAX_AGE_SECONDS can fire (back-filled history
+    still feeds the baseline); once an alert was created for a (patient,
+    metric), only a more severe finding fires again during its cooldown.
+    Returns one finding per metric that fired.
+    """
+    started = time.perf_counter()
+    now = np.datetime64(to_utc_naive(now or datetime.utcnow()), "ms")
+    findings = []
+    total = 0
+
+    for metric, (times, values) in series.items():
+        total += len(values)
+        order = np.argsort(times, kind="stable")
+        times, values = times[order], values[order]
+        key = (patient_id, metric)
+        history = windows.get(key)
+        if history is None:
+            history = np.empty(0, dtype=np.float64)
+
+        recent = times >= now - np.timedelta64(MAX_AGE_SECONDS, "s")
+        z = _rolling_z(history, values, metric)
+        windows.set(key, np.concatenate([history, values])[-WINDOW_SIZE:])
+
+        if not recent.any():
+            continue
+
+        finding = None
+        for severity, low, high in THRESHOLDS.get(metric, []):
+            excess = np.full(len(values), -np.inf)
+            if low is not None:
+                excess = np.maximum(excess, low - values)
+            if high is not None:
+                excess = np.maximum(excess, values - high)
+            breach = recent & (excess > 0)
+            if breach.any():
+                finding = _finding(metric, "threshold", severity, times, values, breach, excess, low=low, high=high)
+                break
+        if finding is None:
+            deviation = np.abs(np.nan_to_num(z))
+            outlier = recent & (deviation > Z_THRESHOLD)
+            if outlier.sum() >= Z_MIN_POINTS:
+                finding = _finding(
+                    metric, "zscore", "medium", times, values, outlier, deviation,
+                    z=round(float(deviation[outlier].max()), 2)
+                )
+        if finding is not None:
+            cooling = cooldowns.get(key)
+            if cooling is None or severity_rank(finding["severity"]) > cooling:
+                findings.append(finding)
+
+    elapsed = time.perf_counter() - started
+    metrics.observe("anomaly.detect", elapsed)
+    metrics.incr("anomaly.readings", total)
+    if total:
+        per_thousand = elapsed * 1000 * 1000 / total
+        metrics.set_gauge("anomaly.ms_per_1000_readings", per_thousand)
+        if per_thousand > ANOMALY_BUDGET_MS and total >= 1000:
+            metrics.incr("anomaly.over_budget")
+    return findings
+
+
+def describe(finding: Dict[str, Any]) -> str:
+    metric = finding["metric"]
+    label, unit = LABELS.get(metric, metric), UNITS.get(metric, "")
+    value = f"{finding['value']:g}{unit if unit == '%' else ' ' + unit}"
+    if finding["rule"] == "threshold":
+        bounds = " / ".join(
+            f"{side} {bound:g}" for side, bound in (("below", finding["low"]), ("above", finding["high"])) if bound is not None
+        )
+        return f"{label} {value} outside safe range ({bounds}) in {finding['readings']} wearable reading(s)"
+    return f"{label} {value} deviates from the patient's baseline (z={finding['z']}) in {finding['readings']} readings"
+
+
+async def raise_alerts(db: Prisma, patient_id: int, findings: List[Dict[str, Any]]) -> None:
+    """
+    Create one EmergencyAlert per finding, all in one batch
+    Only created alerts start a local cooldown, so a failed or rejected
+    insert is retried by the next batch that sees the anomaly.
+    """
+    alerts = [
+        EmergencyAlertCreate(
+            alert_id=new_alert_id(),
+            patient_id=patient_id,
+            alert_type="critical_vitals",
+            severity=finding["severity"],
+            description=describe(finding),
+            triggered_by="wearable",
+            trigger_data=json.dumps(finding)
+        )
+        for finding in findings
+    ]
+    try:
+        created, rejected = await create_emergency_alerts(db, alerts, cooldown_seconds=COOLDOWN_SECONDS)
+        findings_by_alert = {alert.alert_id: finding for alert, finding in zip(alerts, findings)}
+        for row in created:
+            finding = findings_by_alert[row.alertId]
+            cooldowns.set((patient_id, finding["metric"]), severity_rank(finding["severity"]))
+        metrics.incr("anomaly.alerts", len(created))
+        suppressed = [r for r in rejected if r["error"] == COOLDOWN_ERROR]
+        if suppressed:
+            metrics.incr("anomaly.suppressed", len(suppressed))
+            rejected = [r for r in rejected if r["error"] != COOLDOWN_ERROR]
+        if rejected:
+            metrics.incr("anomaly.alert_errors", len(rejected))
+            log.warning("anomaly.alerts_rejected", patient_id=patient_id, rejected=rejected)
+    except Exception:
+        metrics.incr("anomaly.alert_errors", len(alerts))
+        log.exception("anomaly.alert_failed", patient_id=patient_id, findings=[f["metric"] for f in findings])
+
+
+def schedule_alerts(db: Prisma, patient_id: int, findings: List[Dict[str, Any]]) -> None:
+    """Create the alerts in the background; the sync response does not wait"""
+    task = asyncio.create_task(raise_alerts(db, patient_id, findings))
+    pending_alerts.add(task)
+    task.add_done_callback(pending_alerts.discard)
+
+
+async def drain_alerts() -> None:
+    """Wait for in-flight alert writes (called on shutdown)"""
+    if pending_alerts:
+        await asyncio.gather(*pending_alerts, return_exceptions=True)
@@ -0,0 +1,269 @@
+"""
+Wearable Archive (hot/cold tiering)
+WearableData rows older than ARCHIVE_AFTER_DAYS are moved out of the hot
+table into one WearableArchive row per (patient, method, UTC day):
+
+    header      magic, row count
+    columns     JSON object of column -> list of values (times as epoch ms),
+                zlib-compressed as a whole
+
+Storing each column contiguously lets zlib collapse the repetitive method,
+source and timing columns, so a day of records costs a fraction of its
+hot-table size and none of its index entries.
+
+The archive job runs in the background in batches of ARCHIVE_BATCH_SIZE
+rows, one short transaction each: lock the oldest rows of one patient,
+merge them into their day blobs, delete them from the hot table. A
+per-patient advisory lock keeps concurrent workers off the same blobs.
+
+Archived records are read-only. Sync and delete only touch the hot table
+and rollups keep covering archived days (rebuild_rollups never recomputes
+a day before the cutoff), so ARCHIVE_AFTER_DAYS should stay
+well beyond how far back devices resync (Health Connect serves 30 days).
+"""
+
+from typing import Any, Dict, List, Optional, Set, Tuple
+from datetime import datetime, timezone
+import asyncio
+import json
+import os
+import struct
+import time
+import zlib
+
+from prisma import Prisma
+from prisma.fields import Base64
+
+from shared.log import get_logger
+from shared.metrics import metrics
+
+from ingest import normalize_method, parse_timestamp
+from rollups import ARCHIVE_AFTER_DAYS, archive_cutoff, to_utc_naive, truncate
+
+log = get_logger("wearables.archive")
+
+ARCHIVE_BATCH_SIZE = int(os.getenv("WEARABLES_ARCHIVE_BATCH_SIZE", "2000"))
+ARCHIVE_INTERVAL_SECONDS = int(os.getenv("WEARABLES_ARCHIVE_INTERVAL_SECONDS", "3600"))
+ARCHIVE_COMPRESSION_LEVEL = int(os.getenv("WEARABLES_ARCHIVE_COMPRESSION_LEVEL", "9"))
+
+MAGIC = b"WA1"
+HEADER = struct.Struct("<3sI")
+
+# Advisory lock namespace (pg_try_advisory_xact_lock(ARCHIVE_LOCK, patientId))
+ARCHIVE_LOCK = 0x5741
+
+COLUMNS = (
+    "id", "method", "itemId", "digest", "source", "recordId", "timestamp", "startTime", "endTime",
+    "heartRate", "steps", "sleepHours", "oxygenLevel", "description"
+)
+TIME_COLUMNS = ("timestamp", "startTime", "endTime")
+
+SELECT_SQL = """
+SELECT {columns}
+FROM "WearableData"
+WHERE "patientId" = $1::int AND "timestamp" < $2::timestamp
+ORDER BY "timestamp"
+LIMIT $3::int
+FOR UPDATE
+""".format(columns=", ".join(f'"{column}"' for column in COLUMNS))
+
+
+def _to_ms(value: Optional[datetime]) -> Optional[int]:
+    if value is None:
+        return None
+    return int(to_utc_naive(value).replace(tzinfo=timezone.utc).timestamp() * 1000)
+
+
+def _from_ms(value: Optional[int]) -> Optional[datetime]:
+    if value is None:
+        return None
+    return datetime.fromtimestamp(value / 1000, tz=timezone.utc).replace(tzinfo=None)
+
+
+def encode_archive(rows: List[Dict[str, Any]]) -> bytes:
+    """Pack WearableData rows (naive UTC datetimes) into one archive blob"""
+    columns = {}
+    for column in COLUMNS:
+        values = [row.get(column) for row in rows]
+        columns[column] = [_to_ms(v) for v in values] if column in TIME_COLUMNS else values
+    body = zlib.compress(json.dumps(columns, separators=(",", ":")).encode(), ARCHIVE_COMPRESSION_LEVEL)
+    return HEADER.pack(MAGIC, len(rows)) + body
+
+
+def decode_archive(blob: bytes) -> List[Dict[str, Any]]:
+    """Unpack an archive blob into WearableData-shaped dicts in time order"""
+    magic, count = HEADER.unpack_from(blob, 0)
+    if magic != MAGIC:
+        raise ValueError("not a wearable archive")
+    columns = json.loads(zlib.decompress(blob[HEADER.size:]))
+    for column in TIME_COLUMNS:
+        columns[column] = [_from_ms(v) for v in columns[column]]
+    return [{column: columns[column][i] for column in COLUMNS} for i in range(count)]
+
+
+def _from_raw(r: Dict[str, Any]) -> Dict[str, Any]:
+    row = dict(r)
+    for column in TIME_COLUMNS:
+        row[column] = to_utc_naive(parse_timestamp(r[column])) if r.get(column) else None
+    return row
+
+
+async def archive_batch(db: Prisma, patient_id: int, cutoff: datetime, batch_size: Optional[int] = None) -> int:
+    """
+    Move up to batch_size of a patient's oldest rows before cutoff into the archive
+    Returns how many rows moved (0 when none are due or another worker holds the patient).
+    """
+    batch_size = batch_size or ARCHIVE_BATCH_SIZE
+    async with db.tx() as transaction:
+        locked = await transaction.query_raw(
+            'SELECT pg_try_advisory_xact_lock($1::int, $2::int) AS "locked"', ARCHIVE_LOCK, patient_id
+        )
+        if not locked or not locked[0]["locked"]:
+            return 0
+        raw = await transaction.query_raw(SELECT_SQL, patient_id, cutoff.isoformat(), batch_size)
+        if not raw:
+            return 0
+
+        groups: Dict[Tuple[str, datetime], List[Dict[str, Any]]] = {}
+        for row in map(_from_raw, raw):
+            groups.setdefault((row["method"] or "", truncate(row["timestamp"], "day")), []).append(row)
+
+        stored = await transaction.wearablearchive.find_many(
+            where={"patientId": patient_id, "bucketStart": {"in": sorted({day for _, day in groups})}}
+        )
+        existing = {(a.method, to_utc_naive(a.bucketStart)): a for a in stored}
+
+        for key, rows in groups.items():
+            method, day = key
+            merged = {row["id"]: row for row in decode_archive(existing[key].data.decode())} if key in existing else {}
+            merged.update((row["id"], row) for row in rows)
+            ordered = sorted(merged.values(), key=lambda row: (row["timestamp"], row["id"]))
+            data = {
+                "data": Base64.encode(encode_archive(ordered)),
+                "count": len(ordered),
+                "firstTime": ordered[0]["timestamp"],
+                "lastTime": ordered[-1]["timestamp"]
+            }
+            await transaction.wearablearchive.upsert(
+                where={"patientId_method_bucketStart": {"patientId": patient_id, "method": method, "bucketStart": day}},
+                data={
+                    "create": {"patientId": patient_id, "method": method, "bucketStart": day, **data},
+                    "update": data
+                }
+            )
+
+        ids = [r["id"] for r in raw]
+        placeholders = ", ".join(f"${i}::int" for i in range(3, len(ids) + 3))
+        # The timestamp bound keeps the delete on the partitions being archived
+        await transaction.execute_raw(
+            f'DELETE FROM "WearableData" WHERE "patientId" = $1::int AND "timestamp" < $2::timestamp '
+            f'AND "id" IN ({placeholders})',
+            patient_id, cutoff.isoformat(), *ids
+        )
+    return len(raw)
+
+
+async def archive_once(db: Prisma, now: Optional[datetime] = None) -> int:
+    """One pass over every patient; returns the number of rows archived"""
+    cutoff = archive_cutoff(now)
+    if cutoff is None:
+        return 0
+    started = time.perf_counter()
+    moved = 0
+    for patient in await db.query_raw('SELECT "id" FROM "Patient" ORDER BY "id"'):
+        while True:
+            count = await archive_batch(db, patient["id"], cutoff)
+            moved += count
+            if count:
+                metrics.incr("archive.batches")
+                metrics.incr("archive.rows", count)
+            if count < ARCHIVE_BATCH_SIZE:
+                break
+            await asyncio.sleep(0)  # let requests in between batches
+    metrics.observe("archive.pass", time.perf_counter() - started)
+    return moved
+
+
+async def archive_loop(db: Prisma) -> None:
+    """Background task: archive due rows every ARCHIVE_INTERVAL_SECONDS"""
+    while True:
+        try:
+            moved = await archive_once(db)
+            if moved:
+                log.info("archive.pass", archived=moved, after_days=ARCHIVE_AFTER_DAYS)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            metrics.incr("archive.errors")
+            log.exception("archive.error")
+        await asyncio.sleep(ARCHIVE_INTERVAL_SECONDS)
+
+
+async def read_archived(
+    db: Prisma,
+    patient_id: int,
+    limit: int,
+    method: Optional[str] = None,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    exclude: Optional[Set[Tuple[Optional[str], Optional[str]]]] = None
+) -> List[Dict[str, Any]]:
+    """
+    Newest-first archived records in [start, end), walking back one day at a time until limit is reached
+    exclude: (method, itemId) of records already served from the hot table (resynced copies win)
+    """
+    exclude = exclude or set()
+    start = to_utc_naive(start) if start else None
+    end = to_utc_naive(end) if end else None
+    where: Dict[str, Any] = {"patientId": patient_id}
+    if method is not None:
+        where["method"] = method
+
+    found: List[Dict[str, Any]] = []
+    before = end
+    while len(found) < limit:
+        bounds: Dict[str, datetime] = {}
+        if before:
+            bounds["lt"] = before
+        if start:
+            bounds["gte"] = truncate(start, "day")
+        newest = await db.wearablearchive.find_first(
+            where={**where, **({"bucketStart": bounds} if bounds else {})},
+            order={"bucketStart": "desc"}
+        )
+        if newest is None:
+            break
+        before = to_utc_naive(newest.bucketStart)
+        # Every method archived for that day
+        day = await db.wearablearchive.find_many(where={**where, "bucketStart": newest.bucketStart})
+        metrics.incr("archive.reads", len(day))
+        rows = [row for archive in day for row in decode_archive(archive.data.decode())]
+        for row in rows:
+            if row["method"]:
+                row["method"] = normalize_method(row["method"])  # archived before methods were normalised
+        rows.sort(key=lambda row: (row["timestamp"], row["id"]), reverse=True)
+        for row in rows:
+            if (row["method"], row["itemId"]) in exclude:
+                continue
+            if (start and row["timestamp"] < start) or (end and row["timestamp"] >= end):
+                continue
+            found.append(row)
+    return found[:limit]
+
+
+# Background archive job, only started when WEARABLES_ARCHIVE_AFTER_DAYS > 0
+archive_task: Optional[asyncio.Task] = None
+
+
+def start_archiver(db: Prisma) -> None:
+    global archive_task
+    if ARCHIVE_AFTER_DAYS > 0 and archive_task is None:
+        archive_task = asyncio.create_task(archive_loop(db))
+
+
+async def stop_archiver() -> None:
+    global archive_task
+    if archive_task is not None:
+        archive_task.cancel()
+        await asyncio.gather(archive_task, return_exceptions=True)
+        archive_task = None
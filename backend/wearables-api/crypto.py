@@ -0,0 +1,115 @@
+"""
+Wearable Payload Encryption (HCGateway v2 Pattern)
+Fernet ciphers are cached per derived key, and large batches are
+encrypted/decrypted on a worker pool instead of the event loop.
+"""
+
+from typing import Any, Dict, List, Optional
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
+import base64
+import json
+import os
+
+from cryptography.fernet import Fernet
+
+from shared.cache import TTLCache
+from shared.metrics import metrics
+
+# Batches at or above this size leave the event loop
+CRYPTO_OFFLOAD_THRESHOLD = int(os.getenv("WEARABLES_CRYPTO_OFFLOAD_THRESHOLD", "64"))
+CRYPTO_WORKERS = int(os.getenv("WEARABLES_CRYPTO_WORKERS", str(min(4, os.cpu_count() or 1))))
+
+# Derived key -> Fernet; one entry per active user
+cipher_cache = TTLCache(
+    maxsize=int(os.getenv("WEARABLES_CIPHER_CACHE_SIZE", "10000")),
+    ttl=float(os.getenv("WEARABLES_CIPHER_CACHE_TTL", "3600"))
+)
+
+crypto_executor = ThreadPoolExecutor(max_workers=CRYPTO_WORKERS, thread_name_prefix="wearables-crypto")
+
+
+def get_encryption_key_from_password(password_hash: str) -> bytes:
+    """Generate encryption key from hashed password (matches HCGateway pattern)"""
+    key = base64.urlsafe_b64encode(password_hash.encode("utf-8").ljust(32)[:32])
+    return key
+
+
+def get_cipher(encryption_key: bytes) -> Fernet:
+    """Return the cached Fernet instance for a derived key"""
+    cipher = cipher_cache.get(encryption_key)
+    if cipher is None:
+        cipher = Fernet(encryption_key)
+        cipher_cache.set(encryption_key, cipher)
+    return cipher
+
+
+def encrypt_data(data: Dict[str, Any], encryption_key: bytes) -> str:
+    """Encrypt wearable data using Fernet"""
+    data_json = json.dumps(data).encode()
+    encrypted = get_cipher(encryption_key).encrypt(data_json)
+    return encrypted.decode()
+
+
+def decrypt_data(encrypted_data: str, encryption_key: bytes) -> Dict[str, Any]:
+    """Decrypt wearable data"""
+    decrypted = get_cipher(encryption_key).decrypt(encrypted_data.encode())
+    return json.loads(decrypted.decode())
+
+
+def encrypted_payload(description: Optional[str]) -> str:
+    """Extract the Fernet token from a WearableData description ('' if none)"""
+    if not description or not description.startswith("{"):
+        return ""
+    try:
+        return json.loads(description).get("encrypted") or ""
+    except json.JSONDecodeError:
+        return ""
+
+
+def _encrypt_chunk(cipher: Fernet, payloads: List[Dict[str, Any]]) -> List[str]:
+    return [cipher.encrypt(json.dumps(data).encode()).decode() for data in payloads]
+
+
+def _decrypt_chunk(cipher: Fernet, tokens: List[str]) -> List[Optional[Dict[str, Any]]]:
+    results = []
+    for token in tokens:
+        try:
+            results.append(json.loads(cipher.decrypt(token.encode()).decode()) if token else {})
+        except Exception:
+            results.append(None)
+    return results
+
+
+async def _run_batch(func, cipher: Fernet, items: List[Any]) -> List[Any]:
+    """Run func over items inline for small batches, else split across the worker pool"""
+    if len(items) < CRYPTO_OFFLOAD_THRESHOLD:
+        return func(cipher, items)
+
+    loop = asyncio.get_running_loop()
+    chunk_size = -(-len(items) // CRYPTO_WORKERS)
+    futures = [
+        loop.run_in_executor(crypto_executor, func, cipher, items[start:start + chunk_size])
+        for start in range(0, len(items), chunk_size)
+    ]
+    metrics.incr("crypto.offloaded_batches")
+    results = []
+    for chunk in await asyncio.gather(*futures):
+        results.extend(chunk)
+    return results
+
+
+async def encrypt_batch(payloads: List[Dict[str, Any]], encryption_key: bytes) -> List[str]:
+    """Encrypt many payloads with one cipher, preserving order"""
+    with metrics.timer("crypto.encrypt_batch"):
+        encrypted = await _run_batch(_encrypt_chunk, get_cipher(encryption_key), payloads)
+    metrics.incr("crypto.encrypted_items", len(payloads))
+    return encrypted
+
+
+async def decrypt_batch(tokens: List[str], encryption_key: bytes) -> List[Optional[Dict[str, Any]]]:
+    """Decrypt many tokens with one cipher; undecryptable entries come back as None"""
+    with metrics.timer("crypto.decrypt_batch"):
+        decrypted = await _run_batch(_decrypt_chunk, get_cipher(encryption_key), tokens)
+    metrics.incr("crypto.decrypted_items", len(tokens))
+    return decrypted
@@ -0,0 +1,498 @@
+"""
+Wearable Ingest Pipeline
+Validates and transforms a whole HCGateway sync payload up front,
+classifies it against existing rows by (patientId, method, itemId),
+then writes only new/changed records in chunked batches.
+"""
+
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+from datetime import datetime
+import hashlib
+import json
+import os
+
+from prisma import Prisma
+
+from shared.log import get_logger
+
+from rollups import (
+    RESOLUTIONS,
+    ROLLUP_METRICS,
+    aggregate_points,
+    points_from_rows,
+    points_from_samples,
+    rebuild_rollup_days,
+    row_metrics,
+    to_utc_naive,
+    upsert_rollups
+)
+from segments import SAMPLE_STORE, covered_days, read_segments, write_segments
+
+log = get_logger("wearables.ingest")
+
+# Rows per create_many statement (Postgres caps a statement at 65535 bind params)
+INGEST_CHUNK_SIZE = int(os.getenv("WEARABLES_INGEST_CHUNK_SIZE", "1000"))
+
+# itemIds per DELETE statement; each chunk commits on its own to keep row locks short
+DELETE_CHUNK_SIZE = int(os.getenv("WEARABLES_DELETE_CHUNK_SIZE", "2000"))
+
+# Keys that describe the record rather than the measurement
+NON_DATA_KEYS = ("metadata", "time", "startTime", "endTime")
+
+# Columns a changed record rewrites, with their Postgres types
+UPDATE_COLUMNS = (
+    ("digest", "text"), ("source", "text"), ("timestamp", "timestamp"), ("startTime", "timestamp"),
+    ("endTime", "timestamp"), ("heartRate", "int"), ("steps", "int"), ("sleepHours", "float8"),
+    ("oxygenLevel", "float8"), ("description", "text")
+)
+
+# Delete the samples of some records ($2: JSON array of itemIds), returning their metrics
+DELETE_SAMPLES_SQL = """
+WITH removed AS (
+    DELETE FROM "WearableSample"
+    WHERE "patientId" = $1::int AND "itemId" IN (SELECT jsonb_array_elements_text($2::jsonb))
+    RETURNING "metric"
+)
+SELECT DISTINCT "metric" FROM removed
+"""
+
+# Rewrite a chunk of changed records in one statement ($1: JSON array of rows);
+# $4/$5 bound the stored timestamps so WearableData partitions are pruned
+UPDATE_SQL = """
+UPDATE "WearableData" AS w
+SET {assignments}
+FROM jsonb_to_recordset($1::jsonb) AS v("itemId" text, "storedTimestamp" timestamp, {columns})
+WHERE w."patientId" = $2::int AND w."method" = $3 AND w."itemId" = v."itemId"
+  AND w."timestamp" = v."storedTimestamp"
+  AND w."timestamp" >= $4::timestamp AND w."timestamp" <= $5::timestamp
+""".format(
+    assignments=", ".join(f'"{name}" = v."{name}"' for name, _ in UPDATE_COLUMNS),
+    columns=", ".join(f'"{name}" {kind}' for name, kind in UPDATE_COLUMNS)
+)
+
+
+def normalize_method(method: str) -> str:
+    """
+    Canonical record type (HCGateway clients disagree on its case)
+    Applied once where a method enters the API, so storage and every
+    lookup match it exactly and can use the (patientId, method, ...) indexes.
+    """
+    return method.strip().lower()
+
+
+def parse_timestamp(value: str) -> datetime:
+    """Parse an ISO-8601 Health Connect timestamp (trailing 'Z' allowed)"""
+    return datetime.fromisoformat(value.replace('Z', '+00:00'))
+
+
+def content_digest(
+    payload: Dict[str, Any],
+    source: Optional[str],
+    timestamp: datetime,
+    start_time: Optional[datetime],
+    end_time: Optional[datetime]
+) -> str:
+    """
+    SHA-256 of what a record stores (payload, origin, times), so a retry
+    with the same content is recognised; computable from stored rows too
+    (see prisma/backfill_wearable_metadata.py)
+    """
+    content = {
+        "payload": payload,
+        "source": source,
+        "timestamp": to_utc_naive(timestamp).isoformat(),
+        "startTime": to_utc_naive(start_time).isoformat() if start_time else None,
+        "endTime": to_utc_naive(end_time).isoformat() if end_time else None
+    }
+    return hashlib.sha256(json.dumps(content, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def transform_item(method: str, item: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Transform one HCGateway item into a prepared record
+    Raises ValueError/TypeError when the item cannot be stored
+    """
+    if not isinstance(item, dict):
+        raise ValueError("item is not an object")
+
+    # Extract metadata (items without a Health Connect id are keyed by content)
+    metadata = item.get("metadata") or {}
+    if metadata.get("id"):
+        item_id = str(metadata["id"])
+    else:
+        item_hash = hashlib.sha256(json.dumps(item, sort_keys=True, default=str).encode()).hexdigest()
+        item_id = f"wearable_{item_hash[:32]}"
+    data_origin = metadata.get("dataOrigin", "Unknown")
+
+    # Extract timing
+    if "time" in item:
+        # Instant reading
+        timestamp = parse_timestamp(item["time"])
+        start_time = None
+        end_time = None
+    elif "startTime" in item and "endTime" in item:
+        # Time series
+        start_time = parse_timestamp(item["startTime"])
+        end_time = parse_timestamp(item["endTime"])
+        timestamp = start_time
+    else:
+        raise ValueError(f"item {item_id} has no timing info")
+
+    # Extract data fields (exclude metadata and timing)
+    data_obj = {k: v for k, v in item.items() if k not in NON_DATA_KEYS}
+
+    # Content digest decides whether a retried item changed
+    digest = content_digest(data_obj, data_origin, timestamp, start_time, end_time)
+
+    # Extract key vitals for quick access
+    heart_rate = data_obj.get("beatsPerMinute") or data_obj.get("heartRate")
+    steps = data_obj.get("count") or data_obj.get("steps")
+    sleep_hours = None
+    oxygen_level = data_obj.get("percentage") or data_obj.get("oxygenLevel")
+
+    # Calculate sleep hours if sleep session
+    if method.lower() == "sleepsession" and start_time and end_time:
+        sleep_hours = (end_time - start_time).total_seconds() / 3600
+
+    return {
+        "row": {
+            "method": method,
+            "itemId": item_id,
+            "digest": digest,
+            "source": data_origin,
+            "startTime": start_time,
+            "endTime": end_time,
+            "timestamp": timestamp,
+            "heartRate": int(heart_rate) if heart_rate else None,
+            "steps": int(steps) if steps else None,
+            "sleepHours": float(sleep_hours) if sleep_hours else None,
+            "oxygenLevel": float(oxygen_level) if oxygen_level else None
+        },
+        "payload": data_obj
+    }
+
+
+def prepare_batch(
+    method: str,
+    items: List[Dict[str, Any]]
+) -> Tuple[List[Dict[str, Any]], List[int]]:
+    """
+    Validate and transform every item of a sync payload
+    Returns (prepared records tagged with their request index, rejected indices)
+    """
+    prepared = []
+    rejected = []
+    for idx, item in enumerate(items):
+        try:
+            record = transform_item(method, item)
+        except (ValueError, TypeError, AttributeError, KeyError) as e:
+            log.warning("ingest.item_rejected", every=50, method=method, index=idx, reason=str(e))
+            rejected.append(idx)
+            continue
+        record["index"] = idx
+        prepared.append(record)
+    return prepared, rejected
+
+
+def dedupe_prepared(prepared: List[Dict[str, Any]]) -> Tuple[List[Dict[str, Any]], int]:
+    """Collapse repeats of the same itemId within one payload (last occurrence wins)"""
+    latest = {}
+    for record in prepared:
+        latest[record["row"]["itemId"]] = record
+    return list(latest.values()), len(prepared) - len(latest)
+
+
+async def classify_existing(
+    db: Prisma,
+    patient_id: int,
+    method: str,
+    prepared: List[Dict[str, Any]],
+    chunk_size: Optional[int] = None
+) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]], int]:
+    """
+    Split records into (new, changed, unchanged count) with one indexed
+    lookup per chunk on the (patientId, method, itemId, timestamp) unique key
+    Each lookup is bounded to its chunk's timestamp range so it only scans
+    the WearableData partitions the chunk falls in. itemIds it does not find
+    are looked up once more without the bound, so a record whose timestamp
+    moved outside the range is recognised as changed instead of being stored
+    a second time. Changed records get their stored timestamp, endTime and
+    rollup metrics as row["storedTimestamp"], ["storedEndTime"] and
+    ["storedMetrics"].
+    """
+    chunk_size = chunk_size or INGEST_CHUNK_SIZE
+    existing = {}
+    for start in range(0, len(prepared), chunk_size):
+        chunk = prepared[start:start + chunk_size]
+        times = [to_utc_naive(record["row"]["timestamp"]) for record in chunk]
+        rows = await db.wearabledata.find_many(
+            where={
+                "patientId": patient_id,
+                "method": method,
+                "itemId": {"in": [record["row"]["itemId"] for record in chunk]},
+                "timestamp": {"gte": min(times), "lte": max(times)}
+            }
+        )
+        existing.update({row.itemId: row for row in rows})
+
+    # Records that moved in time (or are new): same key, any partition
+    unmatched = list(dict.fromkeys(
+        record["row"]["itemId"] for record in prepared if record["row"]["itemId"] not in existing
+    ))
+    for start in range(0, len(unmatched), chunk_size):
+        rows = await db.wearabledata.find_many(
+            where={"patientId": patient_id, "method": method, "itemId": {"in": unmatched[start:start + chunk_size]}}
+        )
+        existing.update({row.itemId: row for row in rows})
+
+    new, changed, unchanged = [], [], 0
+    for record in prepared:
+        item_id = record["row"]["itemId"]
+        stored = existing.get(item_id)
+        if stored is None:
+            for key in STORED_KEYS:
+                record["row"].pop(key, None)  # a retried batch may carry them
+            new.append(record)
+        elif stored.digest != record["row"]["digest"]:
+            record["row"]["storedTimestamp"] = stored.timestamp
+            record["row"]["storedEndTime"] = stored.endTime
+            record["row"]["storedMetrics"] = sorted(row_metrics([vars(stored)]))
+            changed.append(record)
+        else:
+            unchanged += 1
+    return new, changed, unchanged
+
+
+# What classify_existing records about a changed record's stored version
+STORED_KEYS = ("storedTimestamp", "storedEndTime", "storedMetrics")
+
+
+def _update_value(value: Any) -> Any:
+    return to_utc_naive(value).isoformat() if isinstance(value, datetime) else value
+
+
+async def update_changed(db: Prisma, rows: List[Dict[str, Any]], chunk_size: Optional[int] = None) -> int:
+    """
+    Rewrite changed records of one patient and method, one UPDATE ... FROM per chunk
+    Rows are matched on their storedTimestamp (set by classify_existing).
+    """
+    chunk_size = chunk_size or INGEST_CHUNK_SIZE
+    updated = 0
+    for start in range(0, len(rows), chunk_size):
+        chunk = rows[start:start + chunk_size]
+        stored = [to_utc_naive(row["storedTimestamp"]) for row in chunk]
+        values = [
+            {
+                "itemId": row["itemId"],
+                "storedTimestamp": stored_at.isoformat(),
+                **{name: _update_value(row.get(name)) for name, _ in UPDATE_COLUMNS}
+            }
+            for row, stored_at in zip(chunk, stored)
+        ]
+        updated += await db.execute_raw(
+            UPDATE_SQL, json.dumps(values), chunk[0]["patientId"], chunk[0]["method"],
+            min(stored).isoformat(), max(stored).isoformat()
+        )
+    return updated
+
+
+def build_rows(
+    patient_id: int,
+    prepared: List[Dict[str, Any]],
+    encrypted: List[str]
+) -> List[Dict[str, Any]]:
+    """Combine prepared records with their encrypted payloads into WearableData rows"""
+    rows = []
+    for record, encrypted_data in zip(prepared, encrypted):
+        row = dict(record["row"])
+        row["patientId"] = patient_id
+        row["description"] = json.dumps({"encrypted": encrypted_data})
+        rows.append(row)
+    return rows
+
+
+async def write_batch(
+    db: Prisma,
+    new_rows: List[Dict[str, Any]],
+    changed_rows: List[Dict[str, Any]],
+    samples: Optional[List[Dict[str, Any]]] = None,
+    chunk_size: Optional[int] = None
+) -> Tuple[int, int]:
+    """
+    Insert new rows in chunked create_many statements and rewrite changed
+    rows with set-based UPDATEs, all inside one transaction. Returns (inserted, updated).
+    Rows that a concurrent retry inserted first are skipped, not duplicated.
+    samples are the WearableSample rows of the new and changed records;
+    a changed record's previous samples are replaced.
+    Rollups are merged incrementally for inserts and rebuilt for the days
+    touched by changed rows. When skip_duplicates dropped some new rows, a
+    concurrent writer already stored and counted them, so the new rows'
+    days are rebuilt instead of merged.
+    """
+    chunk_size = chunk_size or INGEST_CHUNK_SIZE
+    samples = samples or []
+    if not new_rows and not changed_rows:
+        return 0, 0
+
+    inserted = 0
+    async with db.tx() as transaction:
+        for start in range(0, len(new_rows), chunk_size):
+            inserted += await transaction.wearabledata.create_many(
+                data=new_rows[start:start + chunk_size],
+                skip_duplicates=True
+            )
+        if changed_rows:
+            await update_changed(transaction, changed_rows, chunk_size)
+
+        replaced_metrics: List[str] = []
+        if SAMPLE_STORE == "segments":
+            # Sample-metric rollups are read from the segments themselves
+            patient_id = (new_rows or changed_rows)[0]["patientId"]
+            await write_segments(
+                transaction, patient_id, samples,
+                replaced={row["itemId"] for row in changed_rows},
+                replaced_days=covered_days(changed_rows)
+            )
+        else:
+            if changed_rows:
+                replaced_metrics = await delete_samples(
+                    transaction, changed_rows[0]["patientId"], [row["itemId"] for row in changed_rows]
+                )
+            for start in range(0, len(samples), chunk_size * 4):
+                await transaction.wearablesample.create_many(
+                    data=samples[start:start + chunk_size * 4],
+                    skip_duplicates=True
+                )
+
+        if inserted and inserted < len(new_rows):
+            await rebuild_days(
+                transaction, new_rows[0]["patientId"], covered_days(new_rows),
+                row_metrics(new_rows) | {sample["metric"] for sample in samples}
+            )
+        elif inserted:
+            patient_id = new_rows[0]["patientId"]
+            new_ids = {row["itemId"] for row in new_rows}
+            new_samples = [sample for sample in samples if sample["itemId"] in new_ids]
+            sampled = {(sample["itemId"], sample["metric"]) for sample in new_samples}
+            points = list(points_from_rows(new_rows, sampled))
+            if SAMPLE_STORE != "segments":
+                points += list(points_from_samples(new_samples))
+            await upsert_rollups(transaction, patient_id, aggregate_points(points))
+        if changed_rows:
+            # The days and metrics of both the new and the stored version of each record
+            stored_versions = [
+                {"timestamp": row["storedTimestamp"], "endTime": row.get("storedEndTime")} for row in changed_rows
+            ]
+            changed_ids = {row["itemId"] for row in changed_rows}
+            metrics = row_metrics(changed_rows) | set(replaced_metrics)
+            metrics |= {metric for row in changed_rows for metric in row.get("storedMetrics", ())}
+            metrics |= {sample["metric"] for sample in samples if sample["itemId"] in changed_ids}
+            await rebuild_days(
+                transaction, changed_rows[0]["patientId"],
+                covered_days(changed_rows) | covered_days(stored_versions), metrics
+            )
+    return inserted, len(changed_rows)
+
+
+async def delete_samples(db: Prisma, patient_id: int, item_ids: List[str]) -> List[str]:
+    """Delete the WearableSample rows of some records; returns the metrics they had"""
+    removed = await db.query_raw(DELETE_SAMPLES_SQL, patient_id, json.dumps(item_ids))
+    return [r["metric"] for r in removed]
+
+
+async def rebuild_days(db: Prisma, patient_id: int, days: Iterable[datetime], metrics: Iterable[str]) -> None:
+    """
+    Rebuild the rollups of some metrics on some days from the stored data
+    With the segment store, records whose readings live in segments are
+    skipped for those metrics, as at ingest (their rollups are read from
+    the segments).
+    """
+    days = sorted(set(days))
+    sampled = None
+    if SAMPLE_STORE == "segments" and days:
+        series = await read_segments(db, patient_id, None, days[0], days[-1] + RESOLUTIONS["day"])
+        sampled = {(item_id, metric) for metric, s in series.items() for item_id in set(s["itemId"].tolist())}
+    await rebuild_rollup_days(db, patient_id, days, metrics, sampled)
+
+
+async def store_rows(
+    db: Prisma,
+    patient_id: int,
+    method: str,
+    rows: List[Dict[str, Any]],
+    samples: Optional[List[Dict[str, Any]]] = None
+) -> Dict[str, int]:
+    """Classify fully built rows against stored data and write them (spool drainer path)"""
+    records = [{"row": row} for row in rows]
+    new, changed, unchanged = await classify_existing(db, patient_id, method, records)
+    written_ids = {record["row"]["itemId"] for record in new + changed}
+    inserted, updated = await write_batch(
+        db,
+        [record["row"] for record in new],
+        [record["row"] for record in changed],
+        [sample for sample in samples or [] if sample["itemId"] in written_ids]
+    )
+    return {"new": inserted, "updated": updated, "duplicates": unchanged + len(new) - inserted}
+
+
+async def delete_items(
+    db: Prisma,
+    patient_id: int,
+    method: str,
+    item_ids: Iterable[str],
+    chunk_size: Optional[int] = None,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None
+) -> List[str]:
+    """
+    Delete records by Health Connect id with one set-based statement per
+    chunk on the (patientId, method, itemId) unique key. Their samples go
+    with them and rollups are rebuilt for the days they covered.
+    start/end (inclusive) bound the records' timestamps so only the matching
+    WearableData partitions are scanned; records outside them are kept.
+    Unknown ids are ignored; returns the itemIds that were deleted.
+    """
+    chunk_size = chunk_size or DELETE_CHUNK_SIZE
+    item_ids = list(dict.fromkeys(str(item_id) for item_id in item_ids))
+    bounds, bound_params = "", []
+    if start is not None:
+        bound_params.append(to_utc_naive(start).isoformat())
+        bounds += f' AND "timestamp" >= ${len(bound_params) + 2}::timestamp'
+    if end is not None:
+        bound_params.append(to_utc_naive(end).isoformat())
+        bounds += f' AND "timestamp" <= ${len(bound_params) + 2}::timestamp'
+    first_id = len(bound_params) + 3
+    deleted: List[str] = []
+    for offset in range(0, len(item_ids), chunk_size):
+        chunk = item_ids[offset:offset + chunk_size]
+        placeholders = ", ".join(f"${i}" for i in range(first_id, len(chunk) + first_id))
+        async with db.tx() as transaction:
+            removed = await transaction.query_raw(
+                f'DELETE FROM "WearableData" WHERE "patientId" = $1::int AND "method" = $2{bounds} '
+                f'AND "itemId" IN ({placeholders}) '
+                f'RETURNING "itemId", "timestamp", "endTime", "heartRate", "steps", "sleepHours", "oxygenLevel"',
+                patient_id, method, *bound_params, *chunk
+            )
+            if not removed:
+                continue
+            rows = [
+                {
+                    "itemId": r["itemId"],
+                    "timestamp": parse_timestamp(r["timestamp"]),
+                    "endTime": parse_timestamp(r["endTime"]) if r.get("endTime") else None,
+                    **{metric: r.get(metric) for metric in ROLLUP_METRICS}
+                }
+                for r in removed
+            ]
+            removed_ids = sorted({row["itemId"] for row in rows})
+            days = covered_days(rows)
+            metrics = row_metrics(rows)
+
+            if SAMPLE_STORE == "segments":
+                await write_segments(transaction, patient_id, [], replaced=set(removed_ids), replaced_days=days)
+            else:
+                metrics |= set(await delete_samples(transaction, patient_id, removed_ids))
+
+            await rebuild_days(transaction, patient_id, days, metrics)
+            deleted.extend(removed_ids)
+    return deleted
@@ -0,0 +1,283 @@
+"""
+Latest-Vitals Cache
+Write-through cache of each patient's newest vitals, updated by the sync
+path as batches are accepted, so dashboard tiles never query Postgres in
+steady state.
+
+Backends:
+    local   per-process TTLCache (default)
+    redis   shared across workers/instances when WEARABLES_REDIS_URL is set
+
+Entries (all times epoch milliseconds, UTC):
+    {"t": newest WearableData timestamp, "row": {heartRate, steps, sleepHours, oxygenLevel},
+     "hr": [newest heart-rate sample time, value] | null, "p": 1 while partial}
+
+Every write is a compare-by-timestamp upsert (UPSERT_SCRIPT in Redis): the
+row and the heart-rate sample are each replaced only by newer ones, so
+ingest and a concurrent database fill can land in either order. An entry
+first created by ingest is partial, since a back-filled batch is not
+necessarily the newest data; readers treat it as a miss, and the
+database fill merges into it and completes it.
+"""
+
+from typing import Any, Dict, Iterable, List, Optional
+from datetime import datetime, timezone
+import json
+import os
+
+from prisma import Prisma
+
+from shared.cache import TTLCache
+from shared.log import get_logger
+from shared.metrics import metrics
+
+from ingest import parse_timestamp
+from rollups import to_utc_naive
+from segments import SAMPLE_STORE, latest_segment_samples
+
+try:
+    import redis.asyncio as aioredis
+except ImportError:  # optional: the local cache is used without it
+    aioredis = None
+
+log = get_logger("wearables.latest")
+
+REDIS_URL = os.getenv("WEARABLES_REDIS_URL", "")
+LATEST_CACHE_TTL = int(os.getenv("WEARABLES_LATEST_CACHE_TTL", str(24 * 3600)))
+LATEST_CACHE_SIZE = int(os.getenv("WEARABLES_LATEST_CACHE_SIZE", "100000"))
+LATEST_BATCH_MAX = int(os.getenv("WEARABLES_LATEST_BATCH_MAX", "500"))
+
+KEY_PREFIX = "wearables:latest:"
+VITAL_COLUMNS = ("heartRate", "steps", "sleepHours", "oxygenLevel")
+EMPTY_ENTRY = {"t": None, "row": None, "hr": None}
+
+# Merge an update into an entry atomically, newest values winning (concurrent writers
+# from other workers); ARGV[3] is "fill" for database loads, which complete the entry
+UPSERT_SCRIPT = """
+local current = redis.call('GET', KEYS[1])
+local update = cjson.decode(ARGV[1])
+local entry
+if current then
+    entry = cjson.decode(current)
+    if update.t ~= cjson.null and (entry.t == cjson.null or update.t >= entry.t) then
+        entry.t = update.t
+        entry.row = update.row
+    end
+    if update.hr ~= cjson.null and (entry.hr == cjson.null or update.hr[1] >= entry.hr[1]) then
+        entry.hr = update.hr
+    end
+else
+    entry = update
+    entry.p = 1
+end
+if ARGV[3] == 'fill' then entry.p = nil end
+local encoded = cjson.encode(entry)
+redis.call('SET', KEYS[1], encoded, 'EX', ARGV[2])
+return encoded
+"""
+
+LATEST_ROWS_SQL = """
+SELECT DISTINCT ON ("patientId") "patientId", "timestamp", "heartRate", "steps", "sleepHours", "oxygenLevel"
+FROM "WearableData"
+WHERE "patientId" IN ({ids})
+ORDER BY "patientId", "timestamp" DESC
+"""
+
+LATEST_SAMPLES_SQL = """
+SELECT DISTINCT ON ("patientId") "patientId", "timestamp", "value"
+FROM "WearableSample"
+WHERE "metric" = 'heartRate' AND "patientId" IN ({ids})
+ORDER BY "patientId", "timestamp" DESC
+"""
+
+
+def to_ms(value: datetime) -> int:
+    return int(to_utc_naive(value).replace(tzinfo=timezone.utc).timestamp() * 1000)
+
+
+def from_ms(value: int) -> datetime:
+    return datetime.fromtimestamp(value / 1000, tz=timezone.utc).replace(tzinfo=None)
+
+
+def entry_from_batch(rows: List[Dict[str, Any]], samples: List[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+    """The newest row and heart-rate sample of a written batch as a cache update"""
+    newest_row = max(rows, key=lambda row: to_ms(row["timestamp"]), default=None)
+    heart_rate = [sample for sample in samples if sample["metric"] == "heartRate"]
+    newest_sample = max(heart_rate, key=lambda sample: to_ms(sample["timestamp"]), default=None)
+    if newest_row is None and newest_sample is None:
+        return None
+    return {
+        "t": to_ms(newest_row["timestamp"]) if newest_row else None,
+        "row": {column: newest_row.get(column) for column in VITAL_COLUMNS} if newest_row else None,
+        "hr": [to_ms(newest_sample["timestamp"]), newest_sample["value"]] if newest_sample else None
+    }
+
+
+def merge_entry(entry: Optional[Dict[str, Any]], update: Dict[str, Any], fill: bool) -> Dict[str, Any]:
+    """Python twin of UPSERT_SCRIPT"""
+    if entry is None:
+        merged = {**update, "p": 1}
+    else:
+        merged = dict(entry)
+        if update["t"] is not None and (merged["t"] is None or update["t"] >= merged["t"]):
+            merged["t"] = update["t"]
+            merged["row"] = update["row"]
+        if update["hr"] is not None and (merged["hr"] is None or update["hr"][0] >= merged["hr"][0]):
+            merged["hr"] = update["hr"]
+    if fill:
+        merged.pop("p", None)
+    return merged
+
+
+def render(patient_id: int, entry: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """Response body of /wearables/latest for a cached entry (None for a patient without data)"""
+    if entry["t"] is None and entry["hr"] is None:
+        return None
+    row = entry["row"] or {}
+    heart_rate = row.get("heartRate")
+    # Heart-rate records span a window; their newest sample is the real latest reading
+    if entry["hr"] is not None and (heart_rate is None or entry["t"] is None or entry["hr"][0] >= entry["t"]):
+        heart_rate = int(round(entry["hr"][1]))
+    timestamp = entry["t"] if entry["t"] is not None else entry["hr"][0]
+    return {
+        "patientId": patient_id,
+        "timestamp": from_ms(timestamp).isoformat(),
+        "heartRate": heart_rate,
+        "steps": row.get("steps"),
+        "sleepHours": row.get("sleepHours"),
+        "oxygenLevel": row.get("oxygenLevel")
+    }
+
+
+async def load_latest(db: Prisma, patient_ids: List[int]) -> Dict[int, Dict[str, Any]]:
+    """
+    Build entries from Postgres (two DISTINCT ON queries for the whole set)
+    Patients without data get an empty entry, so they are not re-queried on every refresh.
+    """
+    if not patient_ids:
+        return {}
+    ids = ", ".join(f"${i}::int" for i in range(1, len(patient_ids) + 1))
+    entries: Dict[int, Dict[str, Any]] = {pid: dict(EMPTY_ENTRY) for pid in patient_ids}
+
+    for r in await db.query_raw(LATEST_ROWS_SQL.format(ids=ids), *patient_ids):
+        entries[r["patientId"]] = {
+            "t": to_ms(parse_timestamp(r["timestamp"])),
+            "row": {column: r[column] for column in VITAL_COLUMNS},
+            "hr": None
+        }
+
+    if SAMPLE_STORE == "segments":
+        for patient_id, sample in (await latest_segment_samples(db, patient_ids, "heartRate")).items():
+            entries[patient_id]["hr"] = [to_ms(sample[0]), sample[1]]
+    else:
+        for r in await db.query_raw(LATEST_SAMPLES_SQL.format(ids=ids), *patient_ids):
+            entries[r["patientId"]]["hr"] = [to_ms(parse_timestamp(r["timestamp"])), r["value"]]
+    return entries
+
+
+class LatestVitalsCache:
+    """Latest-vitals entries per patient in a local TTLCache or Redis"""
+
+    def __init__(self, redis_url: str = REDIS_URL):
+        self.local = TTLCache(maxsize=LATEST_CACHE_SIZE, ttl=LATEST_CACHE_TTL)
+        self.redis = None
+        self._upsert = None
+        if redis_url:
+            if aioredis is None:
+                log.warning("latest.redis_unavailable", reason="redis package not installed", backend="local")
+            else:
+                self.redis = aioredis.from_url(redis_url, decode_responses=True)
+                self._upsert = self.redis.register_script(UPSERT_SCRIPT)
+
+    @property
+    def backend(self) -> str:
+        return "redis" if self.redis is not None else "local"
+
+    async def get_many(self, patient_ids: List[int]) -> Dict[int, Dict[str, Any]]:
+        """Complete entries only; partial ones count as misses"""
+        if self.redis is not None:
+            values = await self.redis.mget([f"{KEY_PREFIX}{pid}" for pid in patient_ids])
+            found = {pid: json.loads(v) for pid, v in zip(patient_ids, values) if v is not None}
+        else:
+            found = {pid: self.local.get(pid) for pid in patient_ids}
+        return {pid: entry for pid, entry in found.items() if entry is not None and not entry.get("p")}
+
+    async def set_many(self, entries: Dict[int, Dict[str, Any]]) -> Dict[int, Dict[str, Any]]:
+        """
+        Merge database-loaded entries into the cache and return the merged entries
+        Values an ingest wrote while the load was running survive if they are newer.
+        """
+        if not entries:
+            return {}
+        if self.redis is not None:
+            async with self.redis.pipeline(transaction=False) as pipe:
+                for pid, entry in entries.items():
+                    await self._upsert(
+                        keys=[f"{KEY_PREFIX}{pid}"], args=[json.dumps(entry), LATEST_CACHE_TTL, "fill"], client=pipe
+                    )
+                merged = await pipe.execute()
+            return {pid: json.loads(value) for pid, value in zip(entries, merged)}
+        merged = {}
+        for pid, entry in entries.items():
+            merged[pid] = merge_entry(self.local.get(pid), entry, fill=True)
+            self.local.set(pid, merged[pid])
+        return merged
+
+    async def observe(self, patient_id: int, rows: List[Dict[str, Any]], samples: List[Dict[str, Any]]) -> None:
+        """Write-through from the sync path: upsert the batch's values where they are newer"""
+        update = entry_from_batch(rows, samples)
+        if update is None:
+            return
+        try:
+            if self.redis is not None:
+                await self._upsert(
+                    keys=[f"{KEY_PREFIX}{patient_id}"], args=[json.dumps(update), LATEST_CACHE_TTL, "observe"]
+                )
+                return
+            self.local.set(patient_id, merge_entry(self.local.get(patient_id), update, fill=False))
+        except Exception as e:
+            # A stale tile is better than a failed sync: drop the entry so the next read reloads
+            metrics.incr("latest.write_errors")
+            log.warning("latest.write_failed", patient_id=patient_id, error=str(e))
+            await self.invalidate(patient_id)
+
+    async def invalidate(self, patient_id: int) -> None:
+        self.local.pop(patient_id)
+        if self.redis is not None:
+            try:
+                await self.redis.delete(f"{KEY_PREFIX}{patient_id}")
+            except Exception as e:
+                log.warning("latest.invalidate_failed", patient_id=patient_id, error=str(e))
+
+    async def close(self) -> None:
+        if self.redis is not None:
+            await self.redis.aclose()
+
+
+async def latest_vitals(db: Prisma, cache: LatestVitalsCache, patient_ids: Iterable[int]) -> Dict[int, Dict[str, Any]]:
+    """Rendered latest vitals per patient with data: cache first, one DB round for the misses"""
+    patient_ids = list(dict.fromkeys(patient_ids))
+    try:
+        entries = await cache.get_many(patient_ids)
+    except Exception as e:
+        metrics.incr("latest.read_errors")
+        log.warning("latest.read_failed", error=str(e))
+        entries = {}
+    metrics.incr("latest.hits", len(entries))
+
+    missing = [pid for pid in patient_ids if pid not in entries]
+    if missing:
+        metrics.incr("latest.misses", len(missing))
+        loaded = await load_latest(db, missing)
+        try:
+            loaded = await cache.set_many(loaded)
+        except Exception as e:
+            metrics.incr("latest.write_errors")
+            log.warning("latest.fill_failed", error=str(e))
+        entries.update(loaded)
+
+    rendered = {pid: render(pid, entries[pid]) for pid in patient_ids}
+    return {pid: body for pid, body in rendered.items() if body is not None}
+
+
+latest_cache = LatestVitalsCache()
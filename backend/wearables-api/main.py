@@ -6,28 +6,68 @@ Compatible with HCGateway mobile app for Android Health Connect data sync.
 Simplified schema integration with CloudCare patient records.
 """
 
-from fastapi import FastAPI, HTTPException, Depends, status, Header, Request
+from fastapi import FastAPI, HTTPException, Depends, Header, Request, Response, Body
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
-from typing import Optional, List, Dict, Any
-from datetime import datetime, timedelta
+from typing import Optional, List, Dict, Any, AsyncGenerator, Union
+from datetime import datetime, timedelta, timezone
 import sys
 import os
 import json
-import base64
+import hashlib
 import secrets
 
 # Add parent directory for shared modules
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 from shared.database import get_prisma, connect_db, disconnect_db
+from shared.cache import TTLCache
 from prisma import Prisma
 
+from shared.log import configure_logging, get_logger, shutdown_logging
+from shared.metrics import metrics
+
+from ingest import (
+    INGEST_CHUNK_SIZE,
+    build_rows,
+    classify_existing,
+    dedupe_prepared,
+    delete_items,
+    normalize_method,
+    prepare_batch,
+    write_batch
+)
+
 # Encryption imports (HCGateway compatible)
-from cryptography.fernet import Fernet
-from argon2 import PasswordHasher
+from anomaly import ANOMALY_DETECTION, detect_anomalies, drain_alerts, schedule_alerts, vital_series
+from archive import archive_cutoff, read_archived, start_archiver, stop_archiver
+from crypto import (
+    crypto_executor,
+    decrypt_batch,
+    encrypt_batch,
+    encrypted_payload,
+    get_encryption_key_from_password
+)
+from latest import LATEST_BATCH_MAX, latest_cache, latest_vitals
+from rollups import RESOLUTIONS, read_rollups, to_utc_naive
+from spool import INGEST_MODE, SpoolFull, ingest_spool
+from samples import expand_samples, sample_rows, summarize_samples
+from segments import SAMPLE_STORE, decode_segment, segment_rollups
+from streaming import SyncBodyError, decoded_text, iter_chunks, iter_sync_items
+from queries import (
+    FETCH_MAX_LIMIT,
+    QueryError,
+    advance_query,
+    build_fetch_query,
+    encode_cursor,
+    page_args
+)
+from partitions import start_partition_manager, stop_partition_manager
+from passwords import PasswordPoolFull, password_pool
 
-ph = PasswordHasher()
+configure_logging("wearables-api")
+log = get_logger("wearables.api")
 
 app = FastAPI(
     title="CloudCare Wearables API",
@@ -44,6 +84,7 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor"],
 )
 
 # =============================================================================
@@ -53,18 +94,31 @@ app.add_middleware(
 @app.on_event("startup")
 async def startup():
     await connect_db()
-    print("=" * 60)
-    print("✅ CloudCare Wearables API Started")
-    print("📱 HCGateway v2 Compatible - Mobile devices can connect!")
-    print("🌐 Network: Accessible on http://0.0.0.0:8005")
-    print("📡 Local: http://localhost:8005")
-    print("📚 Docs: http://localhost:8005/docs")
-    print("=" * 60)
+    if INGEST_MODE == "spool":
+        await ingest_spool.start(get_prisma())
+    start_partition_manager(get_prisma())
+    start_archiver(get_prisma())
+    log.info(
+        "startup",
+        port=8005,
+        docs="http://localhost:8005/docs",
+        ingest_mode=INGEST_MODE,
+        sample_store=SAMPLE_STORE
+    )
 
 @app.on_event("shutdown")
 async def shutdown():
+    if INGEST_MODE == "spool":
+        await ingest_spool.stop()
+    await stop_archiver()
+    await stop_partition_manager()
+    await drain_alerts()
+    await latest_cache.close()
     await disconnect_db()
-    print("🔌 Wearables API disconnected from database")
+    crypto_executor.shutdown(wait=False)
+    password_pool.shutdown()
+    log.info("shutdown")
+    shutdown_logging()
 
 # =============================================================================
 # PYDANTIC MODELS (HCGateway v2 Compatible)
@@ -90,69 +144,155 @@ class FetchRequest(BaseModel):
     queries: Optional[Dict[str, Any]] = {}
 
 # =============================================================================
-# ENCRYPTION UTILITIES (HCGateway v2 Pattern)
+# TOKEN STORAGE (Indexed session table + in-process TTL cache)
 # =============================================================================
 
-def get_encryption_key_from_password(password_hash: str) -> bytes:
-    """Generate encryption key from hashed password (matches HCGateway pattern)"""
-    key = base64.urlsafe_b64encode(password_hash.encode("utf-8").ljust(32)[:32])
-    return key
+class RefreshReuseError(Exception):
+    """A rotated-out refresh token was presented again; its session has been revoked"""
 
-def encrypt_data(data: Dict[str, Any], encryption_key: bytes) -> str:
-    """Encrypt wearable data using Fernet"""
-    fernet = Fernet(encryption_key)
-    data_json = json.dumps(data).encode()
-    encrypted = fernet.encrypt(data_json)
-    return encrypted.decode()
+    def __init__(self, session_id: int):
+        super().__init__(f"refresh token reuse on session {session_id}")
+        self.session_id = session_id
 
-def decrypt_data(encrypted_data: str, encryption_key: bytes) -> Dict[str, Any]:
-    """Decrypt wearable data"""
-    fernet = Fernet(encryption_key)
-    decrypted = fernet.decrypt(encrypted_data.encode())
-    return json.loads(decrypted.decode())
+# Authenticated context per token hash, so repeat bearer checks skip the database
+SESSION_CACHE_TTL = float(os.getenv("WEARABLES_SESSION_CACHE_TTL", "60"))
+session_cache = TTLCache(
+    maxsize=int(os.getenv("WEARABLES_SESSION_CACHE_SIZE", "50000")),
+    ttl=SESSION_CACHE_TTL
+)
 
-# =============================================================================
-# TOKEN STORAGE (Database-backed for persistence)
-# =============================================================================
+# Access tokens are short-lived; refresh tokens rotate on every use
+ACCESS_TOKEN_TTL = timedelta(hours=float(os.getenv("WEARABLES_ACCESS_TOKEN_TTL_HOURS", "12")))
+REFRESH_TOKEN_TTL = timedelta(days=float(os.getenv("WEARABLES_REFRESH_TOKEN_TTL_DAYS", "30")))
+
+def hash_token(token: str) -> str:
+    """Hash a bearer/refresh token for storage and lookup (raw tokens are never stored)"""
+    return hashlib.sha256(token.encode("utf-8")).hexdigest()
 
 async def store_token(token: str, refresh: str, user_id: int, expiry: datetime, db: Prisma):
-    """Store token in database for persistence across restarts"""
-    await db.userlogin.update(
-        where={"id": user_id},
+    """Persist a new device session; a user may hold several at once"""
+    now = datetime.now()
+    # Opportunistically drop this user's dead sessions (indexed on userLoginId)
+    await db.devicesession.delete_many(
+        where={
+            "userLoginId": user_id,
+            "expiresAt": {"lt": now},
+            "OR": [{"refreshExpiresAt": None}, {"refreshExpiresAt": {"lt": now}}]
+        }
+    )
+    await db.devicesession.create(
         data={
-            "description": json.dumps({
-                "token": token,
-                "refresh": refresh,
-                "expiry": expiry.isoformat()
-            })
+            "userLoginId": user_id,
+            "tokenHash": hash_token(token),
+            "refreshHash": hash_token(refresh),
+            "expiresAt": expiry,
+            "refreshExpiresAt": now + REFRESH_TOKEN_TTL
         }
     )
 
+async def rotate_refresh_token(refresh: str, db: Prisma) -> Optional[LoginResponse]:
+    """
+    Exchange a refresh token for a new access/refresh pair on the same session
+    One indexed lookup plus one conditional update; SHA-256 only, no argon2.
+    Returns None for unknown or expired tokens. Presenting an already rotated
+    refresh token revokes the whole session (RefreshReuseError). Used tokens
+    are kept for one refresh lifetime; revoked and expired sessions take
+    theirs with them (ON DELETE CASCADE).
+    """
+    refresh_hash = hash_token(refresh)
+    now = datetime.now()
+    
+    session = await db.devicesession.find_unique(where={"refreshHash": refresh_hash})
+    if session is None:
+        used = await db.usedrefreshtoken.find_unique(
+            where={"refreshHash": refresh_hash},
+            include={"session": True}
+        )
+        if used is not None:
+            await revoke_session(used.session, db)
+            raise RefreshReuseError(used.sessionId)
+        return None
+    
+    refresh_expiry = (session.refreshExpiresAt or session.expiresAt).replace(tzinfo=None)
+    if now > refresh_expiry:
+        return None
+    
+    token = secrets.token_urlsafe(32)
+    new_refresh = secrets.token_urlsafe(32)
+    expiry = now + ACCESS_TOKEN_TTL
+    
+    async with db.tx() as transaction:
+        # Conditional on the presented hash: a concurrent rotation wins exactly once
+        rotated = await transaction.devicesession.update_many(
+            where={"id": session.id, "refreshHash": refresh_hash},
+            data={
+                "tokenHash": hash_token(token),
+                "refreshHash": hash_token(new_refresh),
+                "expiresAt": expiry,
+                "refreshExpiresAt": now + REFRESH_TOKEN_TTL,
+                "rotatedAt": now
+            }
+        )
+        if rotated:
+            await transaction.usedrefreshtoken.create(
+                data={"sessionId": session.id, "refreshHash": refresh_hash}
+            )
+            # A token used that long ago has expired anyway, so its reuse needs no detecting
+            await transaction.usedrefreshtoken.delete_many(
+                where={"sessionId": session.id, "usedAt": {"lt": now - REFRESH_TOKEN_TTL}}
+            )
+    if not rotated:
+        # Lost the race against another use of the same token: that is reuse too
+        await revoke_session(session, db)
+        raise RefreshReuseError(session.id)
+    
+    # The previous access token dies with the rotation
+    session_cache.pop(session.tokenHash)
+    metrics.incr("auth.refresh_rotations")
+    return LoginResponse(token=token, refresh=new_refresh, expiry=expiry.isoformat())
+
+async def revoke_session(session, db: Prisma) -> None:
+    """Delete a device session (and its used refresh tokens) and forget its cached access token"""
+    await db.devicesession.delete_many(where={"id": session.id})
+    session_cache.pop(session.tokenHash)
+
 async def validate_token(token: str, db: Prisma) -> Optional[Dict]:
-    """Validate and return token data from database"""
-    # Find user with this token
-    users = await db.userlogin.find_many()
+    """
+    Validate token and return the authenticated user context
+    Costs one indexed lookup on a cache miss and none on a hit
+    """
+    token_hash = hash_token(token)
     
-    for user in users:
-        if user.description:
-            try:
-                token_data = json.loads(user.description)
-                if token_data.get("token") == token:
-                    # Check expiry
-                    expiry = datetime.fromisoformat(token_data["expiry"])
-                    if datetime.now() > expiry:
-                        print(f"⚠️  Token expired for user {user.id}")
-                        return None
-                    
-                    return {
-                        "user_id": user.id,
-                        "expiry": expiry
-                    }
-            except (json.JSONDecodeError, KeyError, ValueError) as e:
-                print(f"⚠️  Error parsing token data for user {user.id}: {e}")
-                continue
+    cached = session_cache.get(token_hash)
+    if cached is not None:
+        if datetime.now() < cached["expiry"]:
+            return cached
+        session_cache.pop(token_hash)
+        return None
     
-    return None
+    session = await db.devicesession.find_unique(
+        where={"tokenHash": token_hash},
+        include={"userLogin": {"include": {"patients": True}}}
+    )
+    if not session or not session.userLogin:
+        return None
+    
+    expiry = session.expiresAt.replace(tzinfo=None)
+    if datetime.now() > expiry:
+        log.info("auth.token_expired", user_id=session.userLoginId)
+        return None
+    
+    user_login = session.userLogin
+    token_data = {
+        "user_id": user_login.id,
+        "email": user_login.email,
+        "patient": user_login.patients[0] if user_login.patients else None,
+        "password_hash": user_login.password,
+        "token_hash": token_hash,
+        "expiry": expiry
+    }
+    session_cache.set(token_hash, token_data, ttl=(expiry - datetime.now()).total_seconds())
+    return token_data
 
 # =============================================================================
 # AUTH MIDDLEWARE
@@ -164,52 +304,33 @@ async def verify_bearer_token(
 ) -> Dict[str, Any]:
     """Verify Bearer token from HCGateway mobile app"""
     if not authorization:
-        print("❌ AUTH ERROR: No authorization header provided")
+        log.info("auth.missing_token")
         raise HTTPException(
             status_code=400,
             detail={"error": "no token provided"}
         )
     
     if not authorization.startswith("Bearer "):
-        print(f"❌ AUTH ERROR: Invalid authorization header format: {authorization[:20]}...")
+        log.info("auth.malformed_header")
         raise HTTPException(
             status_code=400,
             detail={"error": "invalid authorization header"}
         )
     
     token = authorization.split(" ")[1]
-    print(f"🔑 Validating token: {token[:10]}...")
     
-    # Validate token from database
+    # Validate token (session cache, then indexed session lookup)
     token_data = await validate_token(token, db)
     if not token_data:
-        print(f"❌ AUTH ERROR: Invalid or expired token: {token[:10]}...")
+        log.info("auth.invalid_token")
         raise HTTPException(
             status_code=403,
             detail={"error": "invalid or expired token. Please login again at /api/v2/login"}
         )
     
-    # Get user
-    user_login = await db.userlogin.find_unique(
-        where={"id": token_data["user_id"]},
-        include={"patients": True}
-    )
-    
-    if not user_login:
-        print(f"❌ AUTH ERROR: User {token_data['user_id']} not found in database")
-        raise HTTPException(
-            status_code=403,
-            detail={"error": "user not found"}
-        )
-    
-    print(f"✅ Token validated for user {user_login.email}")
+    log.debug("auth.token_valid", every=100, user_id=token_data["user_id"])
     
-    return {
-        "user_id": user_login.id,
-        "email": user_login.email,
-        "patient": user_login.patients[0] if user_login.patients else None,
-        "password_hash": user_login.password
-    }
+    return token_data
 
 # =============================================================================
 # ROOT ENDPOINTS
@@ -243,6 +364,15 @@ def health_check():
         "timestamp": datetime.now().isoformat()
     }
 
+@app.get("/metrics")
+def get_metrics():
+    """In-process metrics (crypto time, batch sizes, ...) for this worker"""
+    return {
+        "service": "wearables-gateway",
+        **metrics.snapshot(),
+        "timestamp": datetime.now().isoformat()
+    }
+
 # =============================================================================
 # AUTH ENDPOINTS (HCGateway v2 Compatible)
 # =============================================================================
@@ -274,7 +404,7 @@ async def login(
                 
                 if patient:
                     # Create new user for this patient
-                    hashed_password = ph.hash(request.password)
+                    hashed_password = await password_pool.hash(request.password)
                     user = await db.userlogin.create(
                         data={
                             "email": f"patient{patient_id}@cloudcare.local",
@@ -291,11 +421,11 @@ async def login(
                     # Generate tokens
                     token = secrets.token_urlsafe(32)
                     refresh = secrets.token_urlsafe(32)
-                    expiry = datetime.now() + timedelta(hours=12)
+                    expiry = datetime.now() + ACCESS_TOKEN_TTL
                     
                     await store_token(token, refresh, user.id, expiry, db)
                     
-                    print(f"✅ New user created and logged in: {user.email}")
+                    log.info("auth.user_created", user_id=user.id)
                     
                     return LoginResponse(
                         token=token,
@@ -310,41 +440,22 @@ async def login(
                 detail={"error": "user not found"}
             )
         
-        # Verify password
-        try:
-            ph.verify(user.password, request.password)
-        except Exception as e:
-            print(f"❌ Password verification failed for {user.email}: {e}")
+        # Verify password (argon2 runs on the password pool, not the event loop)
+        if not await password_pool.verify(user.password, request.password):
+            log.info("auth.login_failed", user_id=user.id)
             raise HTTPException(
                 status_code=403,
                 detail={"error": "invalid password"}
             )
         
-        # Check if user has valid token already
-        if user.description:
-            try:
-                token_data = json.loads(user.description)
-                existing_expiry = datetime.fromisoformat(token_data["expiry"])
-                
-                # If token still valid, return it
-                if datetime.now() < existing_expiry:
-                    print(f"✅ Returning existing valid token for user {user.email}")
-                    return LoginResponse(
-                        token=token_data["token"],
-                        refresh=token_data["refresh"],
-                        expiry=token_data["expiry"]
-                    )
-            except (json.JSONDecodeError, KeyError, ValueError) as e:
-                print(f"⚠️  Could not parse existing token data: {e}")
-        
         # Generate new tokens
         token = secrets.token_urlsafe(32)
         refresh = secrets.token_urlsafe(32)
-        expiry = datetime.now() + timedelta(hours=12)
+        expiry = datetime.now() + ACCESS_TOKEN_TTL
         
         await store_token(token, refresh, user.id, expiry, db)
         
-        print(f"✅ Login successful for user {user.email}, new token generated")
+        log.info("auth.login", user_id=user.id)
         
         return LoginResponse(
             token=token,
@@ -354,40 +465,148 @@ async def login(
     
     except HTTPException:
         raise
+    except PasswordPoolFull as e:
+        raise HTTPException(
+            status_code=503,
+            detail={"error": "too many logins in progress, retry shortly"},
+            headers={"Retry-After": str(e.retry_after)}
+        )
     except Exception as e:
-        print(f"❌ Login error: {e}")
+        log.exception("auth.login_error")
         raise HTTPException(
             status_code=500,
             detail={"error": str(e)}
         )
 
 @app.post("/api/v2/refresh", status_code=200)
-async def refresh_token(request: RefreshRequest) -> LoginResponse:
-    """Refresh access token"""
-    # Simplified: Generate new token (enhance for production)
-    token = secrets.token_urlsafe(32)
-    expiry = datetime.now() + timedelta(hours=12)
+async def refresh_token(
+    request: RefreshRequest,
+    db: Prisma = Depends(get_prisma)
+) -> LoginResponse:
+    """
+    Rotate a refresh token into a new access/refresh pair
+    The presented refresh token is spent; reusing it later revokes the device session.
+    """
+    try:
+        rotated = await rotate_refresh_token(request.refresh, db)
+    except RefreshReuseError as e:
+        metrics.incr("auth.refresh_reuse")
+        log.warning("auth.refresh_reuse", session_id=e.session_id)
+        raise HTTPException(
+            status_code=403,
+            detail={"error": "refresh token reuse detected. Please login again at /api/v2/login"}
+        )
     
-    return LoginResponse(
-        token=token,
-        refresh=request.refresh,
-        expiry=expiry.isoformat()
-    )
+    if rotated is None:
+        raise HTTPException(
+            status_code=403,
+            detail={"error": "invalid or expired refresh token. Please login again at /api/v2/login"}
+        )
+    
+    return rotated
 
 @app.delete("/api/v2/revoke", status_code=200)
-async def revoke_token(user: Dict = Depends(verify_bearer_token)):
+async def revoke_token(
+    user: Dict = Depends(verify_bearer_token),
+    db: Prisma = Depends(get_prisma)
+):
     """Revoke current access token"""
-    # Remove from token store (simplified)
+    await db.devicesession.delete_many(where={"tokenHash": user["token_hash"]})
+    session_cache.pop(user["token_hash"])
     return {"success": True}
 
 # =============================================================================
 # WEARABLE DATA SYNC (HCGateway v2 Compatible)
 # =============================================================================
 
-@app.post("/api/v2/sync/{method}", status_code=200)
+def check_vitals(db: Prisma, patient_id: int, series: Dict[str, Any]) -> None:
+    """Run anomaly detection on a stored batch and raise alerts in the background"""
+    if not ANOMALY_DETECTION or not series:
+        return
+    findings = detect_anomalies(patient_id, series)
+    if findings:
+        schedule_alerts(db, patient_id, findings)
+
+async def ingest_chunk(
+    db: Prisma,
+    patient_id: int,
+    method: str,
+    items: List[Dict[str, Any]],
+    offset: int,
+    encryption_key: bytes
+) -> Dict[str, Any]:
+    """
+    Run one fixed-size chunk of a sync upload through the ingest pipeline
+    Returns counts plus rejected indices relative to the whole upload
+    """
+    # Validate and transform the chunk before touching the database
+    prepared, rejected = prepare_batch(method, items)
+    rejected = [offset + idx for idx in rejected]
+    
+    # Drop in-chunk repeats (repeats across chunks are caught by the stored-row check)
+    prepared, repeated = dedupe_prepared(prepared)
+    
+    # Expand samples[] arrays (heart rate, speed, ...) for the whole chunk at once
+    expanded = expand_samples(method, prepared)
+    summarize_samples(method, prepared, expanded)
+    
+    if INGEST_MODE == "spool":
+        # Write-behind: durably spool the batch and acknowledge; the drainer classifies and writes
+        encrypted = await encrypt_batch([record["payload"] for record in prepared], encryption_key)
+        rows = build_rows(patient_id, prepared, encrypted)
+        samples = sample_rows(patient_id, method, prepared, expanded)
+        try:
+            await ingest_spool.append(patient_id, method, rows, samples)
+        except ValueError:
+            pass  # too large to ever spool; store it directly below
+        else:
+            await latest_cache.observe(patient_id, rows, samples)
+            check_vitals(db, patient_id, vital_series(method, prepared, expanded))
+            return {"queued": len(rows), "new": 0, "updated": 0, "duplicates": repeated, "rejected": rejected}
+    
+    # Compare against stored rows set-wise
+    new, changed, unchanged = await classify_existing(db, patient_id, method, prepared)
+    
+    # Encrypt only what will be written (cached cipher, worker pool for large batches)
+    to_write = new + changed
+    encrypted = await encrypt_batch([record["payload"] for record in to_write], encryption_key)
+    rows = build_rows(patient_id, to_write, encrypted)
+    samples = sample_rows(
+        patient_id, method, prepared, expanded,
+        keep={record["row"]["itemId"] for record in to_write}
+    )
+    
+    # Store in database (chunked bulk inserts + updates, one transaction)
+    inserted, updated = await write_batch(db, rows[:len(new)], rows[len(new):], samples)
+    
+    await latest_cache.observe(patient_id, rows, samples)
+    
+    # Evaluate only what was stored, so retried uploads never re-alert
+    written = {record["row"]["itemId"] for record in to_write}
+    check_vitals(db, patient_id, vital_series(method, prepared, expanded, keep=written))
+    
+    return {
+        "queued": 0,
+        "new": inserted,
+        "updated": updated,
+        "duplicates": repeated + unchanged + (len(new) - inserted),
+        "rejected": rejected
+    }
+
+@app.post(
+    "/api/v2/sync/{method}",
+    status_code=200,
+    openapi_extra={
+        "requestBody": {
+            "required": True,
+            "content": {"application/json": {"schema": WearableSyncRequest.model_json_schema()}}
+        }
+    }
+)
 async def sync_wearable_data(
     method: str,
-    request: WearableSyncRequest,
+    request: Request,
+    content_encoding: Optional[str] = Header(None),
     user: Dict = Depends(verify_bearer_token),
     db: Prisma = Depends(get_prisma)
 ):
@@ -397,6 +616,10 @@ async def sync_wearable_data(
     
     Method examples: heartRate, steps, sleepSession, bloodPressure, etc.
     
+    The body is parsed as a stream and ingested in chunks of
+    WEARABLES_INGEST_CHUNK_SIZE items, so memory stays bounded for large
+    backfills. Bodies may be sent with Content-Encoding gzip or zstd.
+    
     Data format (per HCGateway spec):
     {
         "data": [
@@ -418,15 +641,10 @@ async def sync_wearable_data(
         ]
     }
     """
+    method = normalize_method(method)
     try:
-        print(f"\n{'='*60}")
-        print(f"📱 SYNC REQUEST: {method}")
-        print(f"User: {user.get('email')}")
-        print(f"Records: {len(request.data)}")
-        print(f"{'='*60}")
-        
         if not user.get("patient"):
-            print(f"❌ SYNC ERROR: No patient linked to user {user.get('email')}")
+            log.info("sync.no_patient", method=method, user_id=user["user_id"])
             raise HTTPException(
                 status_code=404,
                 detail={"error": "no patient linked to this account"}
@@ -435,107 +653,134 @@ async def sync_wearable_data(
         patient = user["patient"]
         encryption_key = get_encryption_key_from_password(user["password_hash"])
         
-        synced_count = 0
-        error_count = 0
-        
-        print(f"📱 Syncing {len(request.data)} {method} records for patient {patient.id} ({patient.name})")
+        totals = {"received": 0, "queued": 0, "new": 0, "updated": 0, "duplicates": 0}
+        rejected: List[int] = []
         
-        for idx, item in enumerate(request.data):
+        items = iter_sync_items(decoded_text(request.stream(), content_encoding))
+        async for chunk in iter_chunks(items, INGEST_CHUNK_SIZE):
             try:
-                # Extract metadata
-                metadata = item.get("metadata", {})
-                item_id = metadata.get("id", f"wearable_{datetime.now().timestamp()}")
-                data_origin = metadata.get("dataOrigin", "Unknown")
-                
-                # Extract timing
-                if "time" in item:
-                    # Instant reading
-                    timestamp = datetime.fromisoformat(item["time"].replace('Z', '+00:00'))
-                    start_time = None
-                    end_time = None
-                elif "startTime" in item and "endTime" in item:
-                    # Time series
-                    start_time = datetime.fromisoformat(item["startTime"].replace('Z', '+00:00'))
-                    end_time = datetime.fromisoformat(item["endTime"].replace('Z', '+00:00'))
-                    timestamp = start_time
-                else:
-                    print(f"⚠️  Skipping item {item_id}: no timing info")
-                    continue
-                
-                # Extract data fields (exclude metadata and timing)
-                data_obj = {k: v for k, v in item.items() 
-                           if k not in ["metadata", "time", "startTime", "endTime"]}
-                
-                # Encrypt full data
-                encrypted_data = encrypt_data(data_obj, encryption_key)
-                
-                # Extract key vitals for quick access
-                heart_rate = data_obj.get("beatsPerMinute") or data_obj.get("heartRate")
-                steps = data_obj.get("count") or data_obj.get("steps")
-                sleep_hours = None
-                oxygen_level = data_obj.get("percentage") or data_obj.get("oxygenLevel")
-                
-                # Calculate sleep hours if sleep session
-                if method.lower() == "sleepsession" and start_time and end_time:
-                    sleep_hours = (end_time - start_time).total_seconds() / 3600
-                
-                # Store in database
-                await db.wearabledata.create(
-                    data={
-                        "patientId": patient.id,
-                        "timestamp": timestamp,
-                        "heartRate": int(heart_rate) if heart_rate else None,
-                        "steps": int(steps) if steps else None,
-                        "sleepHours": float(sleep_hours) if sleep_hours else None,
-                        "oxygenLevel": float(oxygen_level) if oxygen_level else None,
-                        "description": json.dumps({
-                            "method": method,
-                            "itemId": item_id,
-                            "source": data_origin,
-                            "encrypted": encrypted_data,
-                            "startTime": start_time.isoformat() if start_time else None,
-                            "endTime": end_time.isoformat() if end_time else None
-                        })
-                    }
+                counts = await ingest_chunk(
+                    db, patient.id, method, chunk, totals["received"], encryption_key
                 )
-                
-                synced_count += 1
-                if (idx + 1) % 10 == 0:
-                    print(f"  ✓ Synced {idx + 1}/{len(request.data)} records...")
-                
-            except Exception as e:
-                error_count += 1
-                print(f"❌ Error syncing item {idx + 1}: {e}")
-                continue
+            except SpoolFull as e:
+                log.warning("sync.spool_full", method=method, patient_id=patient.id)
+                raise HTTPException(
+                    status_code=429,
+                    detail={"error": "ingest queue full, retry later"},
+                    headers={"Retry-After": str(e.retry_after)}
+                )
+            totals["received"] += len(chunk)
+            rejected.extend(counts.pop("rejected"))
+            for key, value in counts.items():
+                totals[key] += value
         
-        print(f"{'='*60}")
-        print(f"✅ SYNC COMPLETE: {synced_count}/{len(request.data)} records synced successfully")
-        if error_count > 0:
-            print(f"⚠️  {error_count} errors occurred")
-        print(f"{'='*60}\n")
+        synced_count = totals["queued"] + totals["new"] + totals["updated"] + totals["duplicates"]
+        error_count = len(rejected)
         
-        return {"success": True, "synced": synced_count, "errors": error_count}
+        log.info(
+            "sync.complete",
+            method=method,
+            patient_id=patient.id,
+            synced=synced_count,
+            **totals,
+            rejected=error_count,
+            rejected_sample=rejected[:20] if error_count else None
+        )
+        
+        response = {
+            "success": True,
+            "synced": synced_count,
+            "errors": error_count,
+            "rejected": rejected,
+            "new": totals["new"],
+            "updated": totals["updated"],
+            "duplicates": totals["duplicates"]
+        }
+        if totals["queued"]:
+            response["queued"] = totals["queued"]
+        return response
     
+    except SyncBodyError as e:
+        raise HTTPException(
+            status_code=e.status_code,
+            detail={"error": str(e)}
+        )
     except HTTPException:
         raise
     except Exception as e:
-        print(f"❌ Sync error: {e}")
+        log.exception("sync.error", method=method)
         raise HTTPException(
             status_code=500,
             detail={"error": str(e)}
         )
 
+def format_fetch_record(data, decrypted: Dict[str, Any]) -> Dict[str, Any]:
+    """Format one stored record per HCGateway fetch spec"""
+    return {
+        "_id": data.itemId or str(data.id),
+        "id": data.itemId or str(data.id),
+        "data": decrypted,
+        "app": data.source or "Unknown",
+        "start": data.timestamp.isoformat() + "Z",
+        "end": data.endTime.isoformat() if data.endTime else None
+    }
+
+async def fetch_page(
+    db: Prisma,
+    query: Dict[str, Any],
+    limit: int,
+    encryption_key: bytes
+):
+    """Fetch and decrypt one keyset page; returns (raw rows, formatted records)"""
+    wearable_data = await db.wearabledata.find_many(**page_args(query, limit))
+    
+    # Decrypt data (cached cipher, worker pool for large batches)
+    decrypted_items = await decrypt_batch(
+        [encrypted_payload(data.description) for data in wearable_data],
+        encryption_key
+    )
+    
+    results = []
+    for data, decrypted in zip(wearable_data, decrypted_items):
+        if decrypted is None:
+            log.warning("fetch.decrypt_failed", record_id=data.id)
+            continue
+        results.append(format_fetch_record(data, decrypted))
+    return wearable_data, results
+
+async def stream_fetch(
+    db: Prisma,
+    query: Dict[str, Any],
+    encryption_key: bytes
+) -> AsyncGenerator[bytes, None]:
+    """Stream every matching record as NDJSON, one keyset page at a time"""
+    while True:
+        rows, results = await fetch_page(db, query, FETCH_MAX_LIMIT, encryption_key)
+        for record in results:
+            yield (json.dumps(record) + "\n").encode()
+        if len(rows) < FETCH_MAX_LIMIT:
+            break
+        query = advance_query(query, rows[-1].timestamp, rows[-1].id)
+
 @app.post("/api/v2/fetch/{method}", status_code=200)
 async def fetch_wearable_data(
     method: str,
     request: FetchRequest,
+    response: Response,
+    accept: Optional[str] = Header(None),
     user: Dict = Depends(verify_bearer_token),
     db: Prisma = Depends(get_prisma)
 ):
     """
     HCGateway v2 Compatible Fetch
     Returns decrypted wearable data for user's patient
+    
+    `queries` supports a time range, sort, limit and cursor (see queries.py).
+    When a page is full, the X-Next-Cursor response header holds the cursor
+    for the next page. Send `Accept: application/x-ndjson` (or
+    queries.stream = true) to stream the whole range as NDJSON instead.
     """
+    method = normalize_method(method)
     try:
         if not user.get("patient"):
             raise HTTPException(
@@ -546,50 +791,38 @@ async def fetch_wearable_data(
         patient = user["patient"]
         encryption_key = get_encryption_key_from_password(user["password_hash"])
         
-        # Fetch wearable data (limit to 100 recent records)
-        wearable_data = await db.wearabledata.find_many(
-            where={"patientId": patient.id},
-            order_by={"timestamp": "desc"},
-            take=100
-        )
+        # Translate HCGateway queries into indexed filters (patientId, method, timestamp)
+        queries = request.queries or {}
+        try:
+            query = build_fetch_query(patient.id, method, queries)
+        except QueryError as e:
+            raise HTTPException(
+                status_code=400,
+                detail={"error": str(e)}
+            )
         
-        # Format response per HCGateway spec
-        results = []
-        for data in wearable_data:
-            try:
-                desc = json.loads(data.description or "{}")
-                
-                # Only return data matching requested method
-                if desc.get("method", "").lower() != method.lower():
-                    continue
-                
-                # Decrypt data
-                encrypted = desc.get("encrypted", "")
-                if encrypted:
-                    decrypted = decrypt_data(encrypted, encryption_key)
-                else:
-                    decrypted = {}
-                
-                results.append({
-                    "_id": desc.get("itemId", str(data.id)),
-                    "id": desc.get("itemId", str(data.id)),
-                    "data": decrypted,
-                    "app": desc.get("source", "Unknown"),
-                    "start": data.timestamp.isoformat() + "Z",
-                    "end": desc.get("endTime")
-                })
-            except Exception as e:
-                print(f"⚠️  Error decrypting record {data.id}: {e}")
-                continue
+        if queries.get("stream") or (accept and "application/x-ndjson" in accept):
+            log.info("fetch.stream", method=method, patient_id=patient.id)
+            return StreamingResponse(
+                stream_fetch(db, query, encryption_key),
+                media_type="application/x-ndjson"
+            )
         
-        print(f"📤 Returning {len(results)} {method} records")
+        rows, results = await fetch_page(db, query, query["limit"], encryption_key)
+        
+        if len(rows) == query["limit"]:
+            response.headers["X-Next-Cursor"] = encode_cursor(
+                rows[-1].timestamp, rows[-1].id, query["order"]
+            )
+        
+        log.info("fetch.page", method=method, patient_id=patient.id, records=len(results))
         
         return results
     
     except HTTPException:
         raise
     except Exception as e:
-        print(f"❌ Fetch error: {e}")
+        log.exception("fetch.error", method=method)
         raise HTTPException(
             status_code=500,
             detail={"error": str(e)}
@@ -598,70 +831,249 @@ async def fetch_wearable_data(
 @app.delete("/api/v2/sync/{method}", status_code=200)
 async def delete_from_db(
     method: str,
-    uuid: List[str],
+    uuid: Union[str, List[str]] = Body(..., embed=True),
+    start: Optional[datetime] = Body(None, embed=True),
+    end: Optional[datetime] = Body(None, embed=True),
     user: Dict = Depends(verify_bearer_token),
     db: Prisma = Depends(get_prisma)
 ):
-    """Delete wearable data from database (HCGateway app cleanup)"""
-    # TODO: Implement if needed
-    return {"success": True}
+    """
+    Delete wearable data from database (HCGateway app cleanup)
+    Body: {"uuid": "<id>"} or {"uuid": ["<id>", ...]} (Health Connect record ids),
+    optionally with "start"/"end": the records' time range, which limits the
+    delete to the partitions it covers. Records past the archive cutoff are
+    read-only (see archive.py), so the range never reaches before it.
+    "notDeleted" lists the requested ids that were not deleted: unknown,
+    outside start/end, or older than "archiveCutoff".
+    """
+    method = normalize_method(method)
+    try:
+        if not user.get("patient"):
+            raise HTTPException(
+                status_code=404,
+                detail={"error": "no patient linked"}
+            )
+        
+        patient = user["patient"]
+        item_ids = [uuid] if isinstance(uuid, str) else uuid
+        
+        cutoff = archive_cutoff()
+        if cutoff is not None and (start is None or to_utc_naive(start) < cutoff):
+            start = cutoff
+        deleted = set(await delete_items(db, patient.id, method, item_ids, start=start, end=end))
+        if deleted:
+            await latest_cache.invalidate(patient.id)
+        metrics.incr("wearables.deleted", len(deleted))
+        not_deleted = [item_id for item_id in dict.fromkeys(map(str, item_ids)) if item_id not in deleted]
+        
+        log.info(
+            "delete.complete", method=method, patient_id=patient.id,
+            requested=len(item_ids), deleted=len(deleted), not_deleted=len(not_deleted)
+        )
+        
+        return {
+            "success": True,
+            "deleted": len(deleted),
+            "notDeleted": not_deleted,
+            "archiveCutoff": cutoff.isoformat() if cutoff else None
+        }
+    
+    except HTTPException:
+        raise
+    except Exception as e:
+        log.exception("delete.error", method=method)
+        raise HTTPException(
+            status_code=500,
+            detail={"error": str(e)}
+        )
 
 # =============================================================================
 # ADDITIONAL ENDPOINTS (CloudCare Specific)
 # =============================================================================
 
+async def read_samples(db: Prisma, patient_id: int, metric: str, limit: int) -> List[Dict[str, Any]]:
+    """Newest-first per-sample readings of a metric from the configured sample store"""
+    if SAMPLE_STORE == "segments":
+        # Segments are per day: walk back from the newest until limit samples are decoded
+        samples: List[Dict[str, Any]] = []
+        end = None
+        while len(samples) < limit:
+            segment = await db.wearablesegment.find_first(
+                where={"patientId": patient_id, "metric": metric, **({"bucketStart": {"lt": end}} if end else {})},
+                order={"bucketStart": "desc"}
+            )
+            if segment is None:
+                break
+            end = segment.bucketStart
+            decoded = decode_segment(segment.data.decode())
+            times = decoded["time"][::-1].astype("datetime64[ms]").astype(datetime).tolist()
+            for when, value, owner in zip(times, decoded["value"][::-1].tolist(), decoded["owner"][::-1].tolist()):
+                samples.append({"itemId": decoded["items"][owner], "timestamp": when.isoformat(), "value": value})
+        return samples[:limit]
+    
+    rows = await db.wearablesample.find_many(
+        where={"patientId": patient_id, "metric": metric},
+        order={"timestamp": "desc"},
+        take=limit
+    )
+    return [
+        {"itemId": r.itemId, "timestamp": to_utc_naive(r.timestamp).isoformat(), "value": r.value}
+        for r in rows
+    ]
+
 @app.get("/api/patients/{patient_id}/wearables/latest")
 async def get_latest_vitals(
     patient_id: int,
     db: Prisma = Depends(get_prisma)
 ):
-    """Get latest vital signs for a patient"""
-    latest = await db.wearabledata.find_first(
-        where={"patientId": patient_id},
-        order_by={"timestamp": "desc"}
-    )
+    """Get latest vital signs for a patient (served from the latest-vitals cache)"""
+    latest = (await latest_vitals(db, latest_cache, [patient_id])).get(patient_id)
     
     if not latest:
         raise HTTPException(status_code=404, detail="No wearable data found")
     
+    return latest
+
+@app.get("/api/wearables/latest")
+async def get_latest_vitals_batch(
+    patient_ids: str,
+    db: Prisma = Depends(get_prisma)
+):
+    """
+    Get latest vital signs for many patients in one call (dashboard tiles)
+    patient_ids: comma-separated patient ids; patients without data are omitted
+    """
+    try:
+        ids = [int(pid) for pid in patient_ids.split(",") if pid.strip()]
+    except ValueError:
+        raise HTTPException(status_code=400, detail="patient_ids must be comma-separated integers")
+    if len(ids) > LATEST_BATCH_MAX:
+        raise HTTPException(status_code=400, detail=f"At most {LATEST_BATCH_MAX} patient_ids per request")
+    
+    latest = await latest_vitals(db, latest_cache, ids)
+    
     return {
-        "patientId": patient_id,
-        "timestamp": latest.timestamp.isoformat(),
-        "heartRate": latest.heartRate,
-        "steps": latest.steps,
-        "sleepHours": latest.sleepHours,
-        "oxygenLevel": latest.oxygenLevel
+        "count": len(latest),
+        "data": list(latest.values())
     }
 
 @app.get("/api/patients/{patient_id}/wearables/history")
 async def get_wearables_history(
     patient_id: int,
     limit: int = 50,
+    method: Optional[str] = None,
+    metric: Optional[str] = None,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
     db: Prisma = Depends(get_prisma)
 ):
-    """Get wearable data history for a patient"""
+    """
+    Get wearable data history for a patient, optionally for one record type
+    metric: return individual samples (heartRate, speed, ...) instead of records
+    start/end: optional time range; records older than the archive cutoff are
+    read from the archive when the hot table runs out
+    """
+    if metric:
+        samples = await read_samples(db, patient_id, metric, limit)
+        return {
+            "patientId": patient_id,
+            "metric": metric,
+            "count": len(samples),
+            "data": samples
+        }
+    
+    if method:
+        method = normalize_method(method)
+    where = {"patientId": patient_id}
+    if method:
+        where["method"] = method
+    bounds = {}
+    if start:
+        bounds["gte"] = start
+    if end:
+        bounds["lt"] = end
+    if bounds:
+        where["timestamp"] = bounds
+    
     data = await db.wearabledata.find_many(
-        where={"patientId": patient_id},
-        order_by={"timestamp": "desc"},
+        where=where,
+        order={"timestamp": "desc"},
         take=limit
     )
+    records = [
+        {
+            "id": d.id,
+            "method": d.method,
+            "timestamp": to_utc_naive(d.timestamp),
+            "heartRate": d.heartRate,
+            "steps": d.steps,
+            "sleepHours": d.sleepHours,
+            "oxygenLevel": d.oxygenLevel,
+            "itemId": d.itemId
+        }
+        for d in data
+    ]
+    
+    cutoff = archive_cutoff()
+    if len(records) < limit and cutoff and (start is None or to_utc_naive(start) < cutoff):
+        # The hot table ran out inside the archived range: read through
+        archived = await read_archived(
+            db, patient_id, limit, method, start, end,
+            exclude={(r["method"], r["itemId"]) for r in records}
+        )
+        records = sorted(records + archived, key=lambda r: (r["timestamp"], r["id"]), reverse=True)[:limit]
     
     return {
         "patientId": patient_id,
-        "count": len(data),
+        "count": len(records),
         "data": [
             {
-                "id": d.id,
-                "timestamp": d.timestamp.isoformat(),
-                "heartRate": d.heartRate,
-                "steps": d.steps,
-                "sleepHours": d.sleepHours,
-                "oxygenLevel": d.oxygenLevel
+                "id": r["id"],
+                "method": r["method"],
+                "timestamp": r["timestamp"].replace(tzinfo=timezone.utc).isoformat(),
+                "heartRate": r["heartRate"],
+                "steps": r["steps"],
+                "sleepHours": r["sleepHours"],
+                "oxygenLevel": r["oxygenLevel"]
             }
-            for d in data
+            for r in records
         ]
     }
 
+@app.get("/api/patients/{patient_id}/wearables/rollups")
+async def get_wearables_rollups(
+    patient_id: int,
+    resolution: str = "hour",
+    metric: Optional[str] = None,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    db: Prisma = Depends(get_prisma)
+):
+    """
+    Get pre-aggregated vitals (min/max/avg/sum/count per bucket) for charts
+    resolution: minute, hour or day
+    metric: heartRate, steps, sleepHours or oxygenLevel (all when omitted)
+    """
+    if resolution not in RESOLUTIONS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"resolution must be one of: {', '.join(RESOLUTIONS)}"
+        )
+    
+    points = await read_rollups(db, patient_id, resolution, metric, start, end)
+    if SAMPLE_STORE == "segments":
+        # Per-sample metrics are aggregated straight from the decoded segments
+        sampled = await segment_rollups(db, patient_id, resolution, metric, start, end)
+        sampled_metrics = {p["metric"] for p in sampled}
+        points = [p for p in points if p["metric"] not in sampled_metrics] + sampled
+    
+    return {
+        "patientId": patient_id,
+        "resolution": resolution,
+        "count": len(points),
+        "data": points
+    }
+
 # =============================================================================
 # MAIN
 # =============================================================================
@@ -0,0 +1,207 @@
+"""
+WearableData Partition Management
+Once prisma/partition_wearable_data.py has converted it, WearableData is
+range-partitioned by "timestamp" into monthly (or weekly) tables:
+
+    wearable_partitions."WearableData_2024_01"      [2024-01-01, 2024-02-01)
+    wearable_partitions."WearableData_2024w05"      [2024-01-29, 2024-02-05)
+    wearable_partitions."WearableData_default"      anything else (bad device clocks)
+
+Partitions live outside the Prisma schema so `prisma db push` never sees
+(or drops) them. The partitioned parent keeps the table, key and index
+names Prisma expects, and shared/entrypoint.sh skips the startup push
+whenever its diff would touch WearableData, so schema changes to that
+model have to be applied to the partitioned table by hand. The wearables API creates the current and
+PARTITIONS_AHEAD upcoming partitions at startup and once a day, so new
+readings never land in the default partition. With archiving on, old
+partitions emptied by the archive job are dropped.
+
+Queries prune partitions whenever they bound "timestamp": sync lookups
+and updates are bounded by their batch's timestamps (itemIds not found
+there get one unbounded index probe), deletes by the request's range and
+the archive cutoff.
+"""
+
+from typing import List, Optional, Tuple
+from datetime import datetime, timedelta
+import asyncio
+import os
+
+from prisma import Prisma
+
+from shared.log import get_logger
+from shared.metrics import metrics
+
+from archive import archive_cutoff
+from rollups import to_utc_naive, truncate
+
+log = get_logger("wearables.partitions")
+
+PARTITION_INTERVAL = os.getenv("WEARABLES_PARTITION_INTERVAL", "month")  # month | week
+PARTITIONS_AHEAD = int(os.getenv("WEARABLES_PARTITIONS_AHEAD", "3"))
+PARTITION_CHECK_SECONDS = int(os.getenv("WEARABLES_PARTITION_CHECK_SECONDS", str(24 * 3600)))
+
+PARTITION_SCHEMA = "wearable_partitions"
+PARENT = '"WearableData"'
+
+# Advisory lock serialising partition DDL across workers
+PARTITION_LOCK = 0x5750
+
+PARTITIONED_SQL = 'SELECT EXISTS (SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass($1)) AS "partitioned"'
+
+# Partitions of a parent with their bounds (the default partition has none)
+PARTITIONS_SQL = """
+SELECT c.relname AS "name", pg_get_expr(c.relpartbound, c.oid) AS "bound"
+FROM pg_inherits AS i
+JOIN pg_class AS c ON c.oid = i.inhrelid
+WHERE i.inhparent = to_regclass($1)
+"""
+
+
+def period_start(value: datetime, interval: str = PARTITION_INTERVAL) -> datetime:
+    """Start of the month / ISO week containing value (naive UTC)"""
+    day = truncate(value, "day")
+    if interval == "week":
+        return day - timedelta(days=day.weekday())
+    return day.replace(day=1)
+
+
+def next_period(start: datetime, interval: str = PARTITION_INTERVAL) -> datetime:
+    if interval == "week":
+        return start + timedelta(days=7)
+    return start.replace(year=start.year + 1, month=1) if start.month == 12 else start.replace(month=start.month + 1)
+
+
+def partition_name(start: datetime, interval: str = PARTITION_INTERVAL) -> str:
+    if interval == "week":
+        year, week, _ = start.isocalendar()
+        return f"WearableData_{year}w{week:02d}"
+    return f"WearableData_{start.year}_{start.month:02d}"
+
+
+def periods(first: datetime, last: datetime, interval: str = PARTITION_INTERVAL) -> List[Tuple[datetime, datetime]]:
+    """[start, end) of every period from the one containing first through the one containing last"""
+    result = []
+    start = period_start(first, interval)
+    while start <= to_utc_naive(last):
+        end = next_period(start, interval)
+        result.append((start, end))
+        start = end
+    return result
+
+
+async def is_partitioned(db: Prisma, parent: str = PARENT) -> bool:
+    rows = await db.query_raw(PARTITIONED_SQL, parent)
+    return bool(rows and rows[0]["partitioned"])
+
+
+async def create_partitions(
+    db: Prisma,
+    first: datetime,
+    last: datetime,
+    parent: str = PARENT,
+    interval: str = PARTITION_INTERVAL
+) -> List[str]:
+    """
+    Create the missing partitions (and the default partition) of parent covering [first, last]
+    Returns the names created. A period whose rows already sit in the default
+    partition is skipped with a warning (Postgres refuses to attach it).
+    """
+    created = []
+    async with db.tx() as transaction:
+        await transaction.execute_raw(f"CREATE SCHEMA IF NOT EXISTS {PARTITION_SCHEMA}")
+        await transaction.execute_raw("SELECT pg_advisory_xact_lock($1::int)", PARTITION_LOCK)
+        existing = {r["name"] for r in await transaction.query_raw(PARTITIONS_SQL, parent)}
+        if "WearableData_default" not in existing:
+            await transaction.execute_raw(
+                f'CREATE TABLE {PARTITION_SCHEMA}."WearableData_default" PARTITION OF {parent} DEFAULT'
+            )
+            created.append("WearableData_default")
+
+    for start, end in periods(first, last, interval):
+        name = partition_name(start, interval)
+        if name in existing:
+            continue
+        try:
+            async with db.tx() as transaction:
+                await transaction.execute_raw("SELECT pg_advisory_xact_lock($1::int)", PARTITION_LOCK)
+                await transaction.execute_raw(
+                    f'CREATE TABLE IF NOT EXISTS {PARTITION_SCHEMA}."{name}" PARTITION OF {parent} '
+                    f"FOR VALUES FROM ('{start.isoformat()}') TO ('{end.isoformat()}')"
+                )
+            created.append(name)
+        except Exception as e:
+            metrics.incr("partitions.errors")
+            log.warning("partitions.create_failed", partition=name, error=str(e))
+    return created
+
+
+async def drop_archived_partitions(db: Prisma, cutoff: datetime, parent: str = PARENT) -> List[str]:
+    """Drop range partitions that end before cutoff and that the archive job has emptied"""
+    dropped = []
+    for r in await db.query_raw(PARTITIONS_SQL, parent):
+        bound = r["bound"] or ""
+        if "TO ('" not in bound:
+            continue  # default partition
+        end = datetime.fromisoformat(bound.split("TO ('", 1)[1].split("'", 1)[0])
+        if end > cutoff:
+            continue
+        table = f'{PARTITION_SCHEMA}."{r["name"]}"'
+        rows = await db.query_raw(f'SELECT EXISTS (SELECT 1 FROM {table}) AS "used"')
+        if rows[0]["used"]:
+            continue
+        await db.execute_raw(f"DROP TABLE IF EXISTS {table}")
+        dropped.append(r["name"])
+    return dropped
+
+
+async def maintain_partitions(db: Prisma, now: Optional[datetime] = None) -> None:
+    """Create the current and upcoming partitions; drop archived ones"""
+    if not await is_partitioned(db):
+        return
+    now = to_utc_naive(now or datetime.utcnow())
+    last = now
+    for _ in range(PARTITIONS_AHEAD):
+        last = next_period(period_start(last))
+    created = await create_partitions(db, now, last)
+    if created:
+        metrics.incr("partitions.created", len(created))
+        log.info("partitions.created", partitions=created)
+
+    cutoff = archive_cutoff(now)
+    if cutoff is not None:
+        dropped = await drop_archived_partitions(db, cutoff)
+        if dropped:
+            metrics.incr("partitions.dropped", len(dropped))
+            log.info("partitions.dropped", partitions=dropped)
+
+
+async def partition_loop(db: Prisma) -> None:
+    """Background task: keep PARTITIONS_AHEAD partitions ready"""
+    while True:
+        try:
+            await maintain_partitions(db)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            metrics.incr("partitions.errors")
+            log.exception("partitions.error")
+        await asyncio.sleep(PARTITION_CHECK_SECONDS)
+
+
+# Background partition maintenance (a no-op until WearableData is partitioned)
+partition_task: Optional[asyncio.Task] = None
+
+
+def start_partition_manager(db: Prisma) -> None:
+    global partition_task
+    if partition_task is None:
+        partition_task = asyncio.create_task(partition_loop(db))
+
+
+async def stop_partition_manager() -> None:
+    global partition_task
+    if partition_task is not None:
+        partition_task.cancel()
+        await asyncio.gather(partition_task, return_exceptions=True)
+        partition_task = None
@@ -0,0 +1,130 @@
+"""
+Password Hashing Pool
+argon2 hashing and verification are deliberately slow (tens of ms of CPU
+each), so they run on a dedicated thread pool instead of the event loop.
+argon2-cffi releases the GIL while hashing, so syncs keep flowing during a
+wave of logins.
+
+At most PASSWORD_MAX_PENDING operations may be running or queued; callers
+beyond that wait up to PASSWORD_QUEUE_TIMEOUT for a slot and are then
+rejected with PasswordPoolFull (mapped to HTTP 503 + Retry-After).
+
+argon2 parameters apply to newly created hashes only. Stored hashes are
+never upgraded on login: the hash also seeds the user's payload
+encryption key, so rehashing would orphan their encrypted wearable data.
+"""
+
+from typing import Any, Callable
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
+import math
+import os
+import time
+
+from argon2 import PasswordHasher
+from argon2.exceptions import InvalidHashError, VerificationError
+
+from shared.metrics import metrics
+
+PASSWORD_WORKERS = int(os.getenv("WEARABLES_PASSWORD_WORKERS", str(min(2, os.cpu_count() or 1))))
+PASSWORD_MAX_PENDING = int(os.getenv("WEARABLES_PASSWORD_MAX_PENDING", str(PASSWORD_WORKERS * 8)))
+PASSWORD_QUEUE_TIMEOUT = float(os.getenv("WEARABLES_PASSWORD_QUEUE_TIMEOUT_MS", "2000")) / 1000
+
+# argon2id parameters (argon2-cffi defaults); lower them for tests/dev, raise them on big hosts
+ARGON2_TIME_COST = int(os.getenv("WEARABLES_ARGON2_TIME_COST", "3"))
+ARGON2_MEMORY_COST = int(os.getenv("WEARABLES_ARGON2_MEMORY_COST_KIB", "65536"))
+ARGON2_PARALLELISM = int(os.getenv("WEARABLES_ARGON2_PARALLELISM", "4"))
+ARGON2_HASH_LEN = int(os.getenv("WEARABLES_ARGON2_HASH_LEN", "32"))
+ARGON2_SALT_LEN = int(os.getenv("WEARABLES_ARGON2_SALT_LEN", "16"))
+
+
+class PasswordPoolFull(Exception):
+    """Raised when no hashing slot frees up within PASSWORD_QUEUE_TIMEOUT"""
+
+    def __init__(self, retry_after: int):
+        super().__init__(f"password hashing busy, retry after {retry_after}s")
+        self.retry_after = retry_after
+
+
+class PasswordHashingPool:
+    """
+    Bounded argon2 executor
+    Usage:
+        hashed = await password_pool.hash("secret")
+        ok = await password_pool.verify(hashed, "secret")
+    """
+
+    def __init__(
+        self,
+        hasher: PasswordHasher,
+        workers: int = PASSWORD_WORKERS,
+        max_pending: int = PASSWORD_MAX_PENDING,
+        queue_timeout: float = PASSWORD_QUEUE_TIMEOUT
+    ):
+        self.hasher = hasher
+        self.workers = workers
+        self.max_pending = max(max_pending, workers)
+        self.queue_timeout = queue_timeout
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="wearables-argon2")
+        self._slots = asyncio.Semaphore(self.max_pending)
+        self._pending = 0
+
+    def _retry_after(self) -> int:
+        # Rough time to work through the queue, using the observed average execution time
+        timing = metrics.snapshot()["timings"].get("passwords.execute", {})
+        average = timing.get("avg_seconds") or 0.05
+        return max(1, math.ceil(self.max_pending * average / self.workers))
+
+    async def _run(self, operation: str, func: Callable[..., Any], *args: Any) -> Any:
+        queued_at = time.perf_counter()
+        try:
+            await asyncio.wait_for(self._slots.acquire(), timeout=self.queue_timeout)
+        except asyncio.TimeoutError:
+            metrics.incr("passwords.rejected")
+            raise PasswordPoolFull(self._retry_after())
+
+        self._pending += 1
+        metrics.set_gauge("passwords.pending", self._pending)
+        started = {}
+
+        def job():
+            started["at"] = time.perf_counter()
+            return func(*args)
+
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self.executor, job)
+        finally:
+            finished_at = time.perf_counter()
+            self._pending -= 1
+            self._slots.release()
+            metrics.set_gauge("passwords.pending", self._pending)
+            if "at" in started:
+                metrics.observe("passwords.wait", started["at"] - queued_at)
+                metrics.observe("passwords.execute", finished_at - started["at"])
+                metrics.observe(f"passwords.{operation}", finished_at - started["at"])
+
+    async def hash(self, password: str) -> str:
+        return await self._run("hash", self.hasher.hash, password)
+
+    async def verify(self, password_hash: str, password: str) -> bool:
+        """True if password matches; mismatches and malformed hashes are False"""
+        def check() -> bool:
+            try:
+                return self.hasher.verify(password_hash, password)
+            except (VerificationError, InvalidHashError):
+                return False
+        return await self._run("verify", check)
+
+    def shutdown(self) -> None:
+        self.executor.shutdown(wait=False)
+
+
+password_pool = PasswordHashingPool(
+    PasswordHasher(
+        time_cost=ARGON2_TIME_COST,
+        memory_cost=ARGON2_MEMORY_COST,
+        parallelism=ARGON2_PARALLELISM,
+        hash_len=ARGON2_HASH_LEN,
+        salt_len=ARGON2_SALT_LEN
+    )
+)
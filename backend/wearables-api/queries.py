@@ -0,0 +1,178 @@
+"""
+HCGateway Fetch Query Translation
+Turns the HCGateway-style `queries` object into indexed Prisma filters
+with opaque keyset cursors for paging.
+
+Supported keys (all optional):
+    start:  ISO time or {"$gte"|"$gt"|"$lte"|"$lt": ISO time}  -> timestamp
+    end:    same operators                                      -> endTime (timestamp for instant readings)
+    app:    data origin package name                            -> source
+    id:     Health Connect id or {"$in": [...]}                 -> itemId
+    sort:   "asc" | "desc" | {"start": 1 | -1}                  (default desc)
+    limit:  page size, capped at FETCH_MAX_LIMIT
+    cursor: value of a previous page's X-Next-Cursor header
+"""
+
+from typing import Any, Dict, List, Optional
+from datetime import datetime
+import base64
+import json
+import os
+
+from ingest import parse_timestamp
+
+FETCH_DEFAULT_LIMIT = int(os.getenv("WEARABLES_FETCH_DEFAULT_LIMIT", "100"))
+FETCH_MAX_LIMIT = int(os.getenv("WEARABLES_FETCH_MAX_LIMIT", "1000"))
+
+RANGE_OPERATORS = {"$gte": "gte", "$gt": "gt", "$lte": "lte", "$lt": "lt"}
+
+
+class QueryError(ValueError):
+    """Raised for malformed fetch queries (mapped to HTTP 400)"""
+
+
+def _range_filter(value: Any, field: str) -> Dict[str, datetime]:
+    if isinstance(value, str):
+        return {"gte": parse_timestamp(value)}
+    if not isinstance(value, dict) or not value:
+        raise QueryError(f"'{field}' must be an ISO time or a range object")
+    condition = {}
+    for operator, bound in value.items():
+        if operator not in RANGE_OPERATORS:
+            raise QueryError(f"unsupported operator '{operator}' on '{field}'")
+        try:
+            condition[RANGE_OPERATORS[operator]] = parse_timestamp(bound)
+        except (TypeError, ValueError, AttributeError):
+            raise QueryError(f"invalid time '{bound}' on '{field}'")
+    return condition
+
+
+def parse_sort(value: Any) -> str:
+    if value is None:
+        return "desc"
+    if isinstance(value, dict):
+        value = value.get("start", value.get("time", -1))
+    if value in ("asc", 1, "1"):
+        return "asc"
+    if value in ("desc", -1, "-1"):
+        return "desc"
+    raise QueryError(f"invalid sort '{value}'")
+
+
+def parse_limit(value: Any) -> int:
+    if value is None:
+        return FETCH_DEFAULT_LIMIT
+    try:
+        limit = int(value)
+    except (TypeError, ValueError):
+        raise QueryError(f"invalid limit '{value}'")
+    if limit < 1:
+        raise QueryError("limit must be positive")
+    return min(limit, FETCH_MAX_LIMIT)
+
+
+def encode_cursor(timestamp: datetime, row_id: int, order: str) -> str:
+    """Opaque keyset cursor pointing just past (timestamp, id)"""
+    raw = json.dumps({"t": timestamp.isoformat(), "id": row_id, "o": order})
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Dict[str, Any]:
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        data = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        return {"t": parse_timestamp(data["t"]), "id": int(data["id"]), "o": data["o"]}
+    except (ValueError, KeyError, TypeError):
+        raise QueryError("invalid cursor")
+
+
+def build_fetch_query(patient_id: int, method: str, queries: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    Translate an HCGateway query object into Prisma find_many arguments
+    Returns {"where", "filters", "order", "limit"}; filters are the
+    conditions without any cursor. order_by always ends on id so cursors
+    stay stable across rows sharing a timestamp.
+    """
+    queries = queries or {}
+    if not isinstance(queries, dict):
+        raise QueryError("queries must be an object")
+
+    # method is already normalised (ingest.normalize_method), so it matches exactly
+    conditions: List[Dict[str, Any]] = [{"patientId": patient_id, "method": method}]
+
+    if "start" in queries:
+        conditions.append({"timestamp": _range_filter(queries["start"], "start")})
+
+    if "end" in queries:
+        end_filter = _range_filter(queries["end"], "end")
+        conditions.append({"OR": [
+            {"endTime": end_filter},
+            {"endTime": None, "timestamp": end_filter}
+        ]})
+        # A record starts before it ends: an upper bound on the end bounds timestamp too,
+        # which lets Postgres prune WearableData partitions
+        upper = {op: bound for op, bound in end_filter.items() if op in ("lt", "lte")}
+        if upper:
+            conditions.append({"timestamp": upper})
+
+    if "app" in queries:
+        conditions.append({"source": str(queries["app"])})
+
+    item_ids = queries.get("id", queries.get("_id"))
+    if item_ids is not None:
+        if isinstance(item_ids, dict) and "$in" in item_ids:
+            conditions.append({"itemId": {"in": [str(i) for i in item_ids["$in"]]}})
+        else:
+            conditions.append({"itemId": str(item_ids)})
+
+    order = parse_sort(queries.get("sort"))
+    where = {"AND": conditions}
+
+    if queries.get("cursor"):
+        cursor = decode_cursor(str(queries["cursor"]))
+        if cursor["o"] != order:
+            raise QueryError("cursor was issued for a different sort order")
+        where = {"AND": conditions + [keyset_condition(order, cursor["t"], cursor["id"])]}
+
+    return {
+        "where": where,
+        "filters": conditions,
+        "order": order,
+        "limit": parse_limit(queries.get("limit"))
+    }
+
+
+def keyset_condition(order: str, last_timestamp: datetime, last_id: int) -> Dict[str, Any]:
+    """
+    Rows after (last_timestamp, last_id) in the given order
+    The plain range bound on timestamp is what the (patientId, method,
+    timestamp) index seeks on; the OR only breaks ties within it.
+    """
+    past = "lt" if order == "desc" else "gt"
+    bound = "lte" if order == "desc" else "gte"
+    return {"AND": [
+        {"timestamp": {bound: last_timestamp}},
+        {"OR": [
+            {"timestamp": {past: last_timestamp}},
+            {"timestamp": last_timestamp, "id": {past: last_id}}
+        ]}
+    ]}
+
+
+def page_args(query: Dict[str, Any], limit: int) -> Dict[str, Any]:
+    """find_many keyword arguments for one page of a translated query"""
+    return {
+        "where": query["where"],
+        "order": [{"timestamp": query["order"]}, {"id": query["order"]}],
+        "take": limit
+    }
+
+
+def advance_query(query: Dict[str, Any], last_timestamp: datetime, last_id: int) -> Dict[str, Any]:
+    """
+    Return a copy of query continuing after the given row (used for streaming)
+    Built from the original filters plus only this cursor, so the WHERE
+    clause stays the same size however many pages are streamed.
+    """
+    conditions = query["filters"] + [keyset_condition(query["order"], last_timestamp, last_id)]
+    return {**query, "where": {"AND": conditions}}
@@ -0,0 +1,276 @@
+"""
+Wearable Vitals Rollups
+Per-minute, hourly and daily min/max/sum/count per metric per patient,
+maintained incrementally at ingest so charts read pre-aggregated points.
+"""
+
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+from datetime import datetime, timedelta, timezone
+import json
+import os
+
+from prisma import Prisma
+
+# Defined here rather than in archive.py so rollup rebuilds can honour it
+ARCHIVE_AFTER_DAYS = int(os.getenv("WEARABLES_ARCHIVE_AFTER_DAYS", "0"))  # 0 = keep everything hot
+
+# WearableData columns rolled up (per-sample metrics such as speed are rolled up too)
+ROLLUP_METRICS = ("heartRate", "steps", "sleepHours", "oxygenLevel")
+
+# Resolution -> bucket width (also the Postgres date_trunc unit)
+RESOLUTIONS = {
+    "minute": timedelta(minutes=1),
+    "hour": timedelta(hours=1),
+    "day": timedelta(days=1)
+}
+
+# Default look-back per resolution when a request gives no start time
+DEFAULT_WINDOWS = {
+    "minute": timedelta(days=1),
+    "hour": timedelta(days=7),
+    "day": timedelta(days=90)
+}
+
+# 8 bind parameters per row keeps each statement well under Postgres' 65535 limit
+UPSERT_CHUNK_SIZE = 1000
+
+UPSERT_COLUMNS = '"patientId", "metric", "resolution", "bucketStart", "min", "max", "sum", "count"'
+UPSERT_ROW = "(${}::int, ${}, ${}, ${}::timestamp, ${}::float8, ${}::float8, ${}::float8, ${}::int)"
+
+UPSERT_CONFLICT = """
+ON CONFLICT ("patientId", "metric", "resolution", "bucketStart") DO UPDATE SET
+    "min"   = LEAST("WearableRollup"."min", EXCLUDED."min"),
+    "max"   = GREATEST("WearableRollup"."max", EXCLUDED."max"),
+    "sum"   = "WearableRollup"."sum" + EXCLUDED."sum",
+    "count" = "WearableRollup"."count" + EXCLUDED."count"
+"""
+
+# Only these metrics ($n: JSON array, or null for every metric)
+METRIC_FILTER = "(${n}::jsonb IS NULL OR {column} IN (SELECT jsonb_array_elements_text(${n}::jsonb)))"
+
+# Row vitals count unless the same record stored per-sample readings for that
+# metric: WearableSample rows, or the (itemId, metric) pairs in $6 (JSON) that
+# the segment store holds, exactly as points_from_rows skips them at ingest
+REBUILD_SQL = f"""
+WITH sampled AS (
+    SELECT x."itemId", x."metric" FROM jsonb_to_recordset($6::jsonb) AS x("itemId" text, "metric" text)
+), points AS (
+    SELECT m.metric, w."timestamp" AS t, m.v
+    FROM "WearableData" AS w,
+         LATERAL (VALUES ('heartRate', w."heartRate"::float8),
+                         ('steps', w."steps"::float8),
+                         ('sleepHours', w."sleepHours"),
+                         ('oxygenLevel', w."oxygenLevel")) AS m(metric, v)
+    WHERE w."patientId" = $1 AND w."timestamp" >= $3::timestamp AND w."timestamp" < $4::timestamp
+      AND m.v IS NOT NULL AND {METRIC_FILTER.format(n=5, column="m.metric")}
+      AND NOT EXISTS (
+          SELECT 1 FROM "WearableSample" AS s
+          WHERE s."patientId" = w."patientId" AND s."itemId" = w."itemId" AND s."metric" = m.metric
+      )
+      AND NOT EXISTS (SELECT 1 FROM sampled AS x WHERE x."itemId" = w."itemId" AND x."metric" = m.metric)
+    UNION ALL
+    SELECT s."metric", s."timestamp", s."value"
+    FROM "WearableSample" AS s
+    WHERE s."patientId" = $1 AND s."timestamp" >= $3::timestamp AND s."timestamp" < $4::timestamp
+      AND {METRIC_FILTER.format(n=5, column='s."metric"')}
+)
+INSERT INTO "WearableRollup" ({UPSERT_COLUMNS})
+SELECT $1, metric, $2::text, date_trunc($2::text, t), MIN(v), MAX(v), SUM(v), COUNT(v)::int
+FROM points
+GROUP BY 2, 4
+"""
+
+DELETE_SQL = f"""
+DELETE FROM "WearableRollup"
+WHERE "patientId" = $1 AND "bucketStart" >= $2::timestamp AND "bucketStart" < $3::timestamp
+  AND {METRIC_FILTER.format(n=4, column='"metric"')}
+"""
+
+
+def to_utc_naive(value: datetime) -> datetime:
+    """Normalise to naive UTC (how Prisma stores DateTime columns)"""
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+
+def truncate(value: datetime, resolution: str) -> datetime:
+    value = to_utc_naive(value)
+    if resolution == "minute":
+        return value.replace(second=0, microsecond=0)
+    if resolution == "hour":
+        return value.replace(minute=0, second=0, microsecond=0)
+    return value.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def row_metrics(rows: Iterable[Dict[str, Any]]) -> Set[str]:
+    """Rollup metrics WearableData rows have a value for"""
+    return {metric for row in rows for metric in ROLLUP_METRICS if row.get(metric) is not None}
+
+
+def points_from_rows(
+    rows: Iterable[Dict[str, Any]],
+    sampled: Optional[Set[Tuple[str, str]]] = None
+) -> Iterable[Tuple[str, datetime, float]]:
+    """
+    (metric, timestamp, value) for every non-null vital of WearableData rows
+    sampled: (itemId, metric) pairs whose per-sample readings are counted instead
+    """
+    sampled = sampled or set()
+    for row in rows:
+        for metric in ROLLUP_METRICS:
+            value = row.get(metric)
+            if value is not None and (row.get("itemId"), metric) not in sampled:
+                yield metric, row["timestamp"], float(value)
+
+
+def points_from_samples(samples: Iterable[Dict[str, Any]]) -> Iterable[Tuple[str, datetime, float]]:
+    """(metric, timestamp, value) for WearableSample rows"""
+    for sample in samples:
+        yield sample["metric"], sample["timestamp"], sample["value"]
+
+
+def aggregate_points(
+    points: Iterable[Tuple[str, datetime, float]]
+) -> Dict[Tuple[str, str, datetime], List[float]]:
+    """Fold points into {(metric, resolution, bucketStart): [min, max, sum, count]}"""
+    buckets: Dict[Tuple[str, str, datetime], List[float]] = {}
+    for metric, timestamp, value in points:
+        for resolution in RESOLUTIONS:
+            key = (metric, resolution, truncate(timestamp, resolution))
+            bucket = buckets.get(key)
+            if bucket is None:
+                buckets[key] = [value, value, value, 1]
+            else:
+                if value < bucket[0]:
+                    bucket[0] = value
+                if value > bucket[1]:
+                    bucket[1] = value
+                bucket[2] += value
+                bucket[3] += 1
+    return buckets
+
+
+async def upsert_rollups(
+    db: Prisma,
+    patient_id: int,
+    buckets: Dict[Tuple[str, str, datetime], List[float]]
+) -> int:
+    """Merge aggregated buckets into WearableRollup (LEAST/GREATEST/+ on conflict)"""
+    items = list(buckets.items())
+    for start in range(0, len(items), UPSERT_CHUNK_SIZE):
+        chunk = items[start:start + UPSERT_CHUNK_SIZE]
+        values = []
+        params: List[Any] = []
+        for (metric, resolution, bucket_start), (low, high, total, count) in chunk:
+            base = len(params)
+            values.append(UPSERT_ROW.format(*range(base + 1, base + 9)))
+            params.extend([patient_id, metric, resolution, bucket_start.isoformat(), low, high, total, int(count)])
+        await db.execute_raw(
+            f'INSERT INTO "WearableRollup" ({UPSERT_COLUMNS}) VALUES {", ".join(values)} {UPSERT_CONFLICT}',
+            *params
+        )
+    return len(items)
+
+
+def archive_cutoff(now: Optional[datetime] = None) -> Optional[datetime]:
+    """Records with a timestamp before this are archived (None when archiving is off)"""
+    if ARCHIVE_AFTER_DAYS <= 0:
+        return None
+    return truncate(now or datetime.utcnow(), "day") - timedelta(days=ARCHIVE_AFTER_DAYS)
+
+
+def day_runs(days: Iterable[datetime]) -> List[Tuple[datetime, datetime]]:
+    """Collapse UTC days into (first, last) runs of consecutive days"""
+    runs: List[Tuple[datetime, datetime]] = []
+    for day in sorted(days):
+        if runs and day - runs[-1][1] <= RESOLUTIONS["day"]:
+            runs[-1] = (runs[-1][0], day)
+        else:
+            runs.append((day, day))
+    return runs
+
+
+async def rebuild_rollups(
+    db: Prisma,
+    patient_id: int,
+    start: datetime,
+    end: datetime,
+    metrics: Optional[Iterable[str]] = None,
+    sampled: Optional[Iterable[Tuple[str, str]]] = None
+) -> None:
+    """
+    Recompute the rollup buckets of the days from start through end from raw rows
+    Used when stored rows change or disappear, where incremental merges cannot apply.
+    metrics limits the rebuild to those metrics (all when None); sampled are
+    the (itemId, metric) pairs whose readings live in the segment store.
+    Days before the archive cutoff are left alone: their rows have moved to
+    WearableArchive, so recomputing them from WearableData would wipe them.
+    """
+    start = truncate(start, "day")
+    end = truncate(end, "day") + RESOLUTIONS["day"]
+    cutoff = archive_cutoff()
+    if cutoff is not None:
+        start = max(start, cutoff)
+        if start >= end:
+            return
+    metric_list = json.dumps(sorted(metrics)) if metrics is not None else None
+    pairs = json.dumps([{"itemId": item_id, "metric": metric} for item_id, metric in sorted(sampled or ())])
+    await db.execute_raw(DELETE_SQL, patient_id, start.isoformat(), end.isoformat(), metric_list)
+    for resolution in RESOLUTIONS:
+        await db.execute_raw(
+            REBUILD_SQL, patient_id, resolution, start.isoformat(), end.isoformat(), metric_list, pairs
+        )
+
+
+async def rebuild_rollup_days(
+    db: Prisma,
+    patient_id: int,
+    days: Iterable[datetime],
+    metrics: Optional[Iterable[str]] = None,
+    sampled: Optional[Iterable[Tuple[str, str]]] = None
+) -> None:
+    """rebuild_rollups for only the given UTC days, one statement set per run of consecutive days"""
+    metrics = set(metrics) if metrics is not None else None
+    if metrics is not None and not metrics:
+        return
+    for first, last in day_runs(days):
+        await rebuild_rollups(db, patient_id, first, last, metrics, sampled)
+
+
+async def read_rollups(
+    db: Prisma,
+    patient_id: int,
+    resolution: str,
+    metric: Optional[str] = None,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None
+) -> List[Dict[str, Any]]:
+    """Read pre-aggregated points in time order"""
+    end = to_utc_naive(end) if end else datetime.utcnow()
+    start = to_utc_naive(start) if start else end - DEFAULT_WINDOWS[resolution]
+
+    where: Dict[str, Any] = {
+        "patientId": patient_id,
+        "resolution": resolution,
+        "bucketStart": {"gte": truncate(start, resolution), "lt": end}
+    }
+    if metric:
+        where["metric"] = metric
+
+    rollups = await db.wearablerollup.find_many(
+        where=where,
+        order=[{"metric": "asc"}, {"bucketStart": "asc"}]
+    )
+    return [
+        {
+            "metric": r.metric,
+            "bucketStart": r.bucketStart.isoformat(),
+            "min": r.min,
+            "max": r.max,
+            "avg": r.sum / r.count if r.count else None,
+            "sum": r.sum,
+            "count": r.count
+        }
+        for r in rollups
+    ]
@@ -0,0 +1,153 @@
+"""
+Health Connect Sample Expansion
+Heart-rate, speed, cadence and power records carry a `samples` array
+instead of a single top-level value. Every sample of a whole ingest chunk
+is flattened into NumPy arrays in one pass, so per-record summaries and
+per-sample readings are computed vectorised rather than item by item.
+"""
+
+from typing import Any, Callable, Dict, List, Optional, Set
+from datetime import datetime, timezone
+
+import numpy as np
+
+from ingest import parse_timestamp
+
+
+def _nested(outer: str, inner: str) -> Callable[[Dict[str, Any]], Any]:
+    return lambda sample: (sample.get(outer) or {}).get(inner)
+
+
+# HCGateway method -> (sample metric name, value extractor, WearableData summary column)
+SAMPLE_FIELDS = {
+    "heartrate": ("heartRate", lambda sample: sample.get("beatsPerMinute"), "heartRate"),
+    "speed": ("speed", _nested("speed", "inMetersPerSecond"), None),
+    "stepscadence": ("stepsCadence", lambda sample: sample.get("rate"), None),
+    "power": ("power", _nested("power", "inWatts"), None),
+    "cyclingpedalingcadence": ("cyclingCadence", lambda sample: sample.get("revolutionsPerMinute"), None),
+}
+
+
+def sample_metric(method: str) -> Optional[str]:
+    """Metric name stored for a method's samples (None if the method has no samples)"""
+    fields = SAMPLE_FIELDS.get(method.lower())
+    return fields[0] if fields else None
+
+
+def _to_float(value: Any) -> float:
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return np.nan
+
+
+def _parse_time(value: Any) -> np.datetime64:
+    try:
+        parsed = parse_timestamp(value)
+    except (TypeError, ValueError, AttributeError):
+        return np.datetime64("NaT", "ms")
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    return np.datetime64(parsed, "ms")
+
+
+def _parse_times(raw: List[Any]) -> np.ndarray:
+    """ISO instants -> datetime64[ms] (UTC, NaT when unparseable); vectorised for the common 'Z' form"""
+    try:
+        stripped = np.char.rstrip(np.asarray(raw, dtype=str), "Z")
+        # Explicit offsets (+05:30, -04:00) need converting to UTC on the slow path
+        has_offset = (np.char.find(stripped, "+", 10) >= 0) | (np.char.find(stripped, "-", 10) >= 0)
+        if not has_offset.any():
+            return stripped.astype("datetime64[ms]")
+    except ValueError:
+        pass
+    return np.array([_parse_time(t) for t in raw], dtype="datetime64[ms]")
+
+
+def expand_samples(method: str, prepared: List[Dict[str, Any]]) -> Optional[Dict[str, np.ndarray]]:
+    """
+    Flatten the samples of every prepared record into parallel arrays
+    Returns {"owner": record index, "time": datetime64[ms], "value": float64}
+    sorted by (owner, time), or None when the method carries no samples.
+    Records whose samples yield no valid readings are simply absent.
+    """
+    fields = SAMPLE_FIELDS.get(method.lower())
+    if not fields:
+        return None
+    _, extract, _ = fields
+
+    owners: List[int] = []
+    times: List[Any] = []
+    values: List[Any] = []
+    for idx, record in enumerate(prepared):
+        samples = record["payload"].get("samples")
+        if not isinstance(samples, list):
+            continue
+        for sample in samples:
+            if isinstance(sample, dict) and "time" in sample:
+                owners.append(idx)
+                times.append(sample["time"])
+                values.append(extract(sample))
+
+    if not owners:
+        return None
+
+    owner = np.asarray(owners, dtype=np.int64)
+    try:
+        value = np.array([np.nan if v is None else v for v in values], dtype=np.float64)
+    except (TypeError, ValueError):
+        value = np.array([_to_float(v) for v in values], dtype=np.float64)
+    time = _parse_times(times)
+
+    valid = np.isfinite(value) & ~np.isnat(time)
+    owner, time, value = owner[valid], time[valid], value[valid]
+    order = np.lexsort((time, owner))
+    return {"owner": owner[order], "time": time[order], "value": value[order]}
+
+
+def summarize_samples(method: str, prepared: List[Dict[str, Any]], expanded: Optional[Dict[str, np.ndarray]]) -> None:
+    """Fill each record's summary column (e.g. heartRate) with the mean of its samples"""
+    fields = SAMPLE_FIELDS.get(method.lower())
+    if expanded is None or not fields or fields[2] is None or not len(expanded["owner"]):
+        return
+    column = fields[2]
+    counts = np.bincount(expanded["owner"], minlength=len(prepared))
+    sums = np.bincount(expanded["owner"], weights=expanded["value"], minlength=len(prepared))
+    with np.errstate(invalid="ignore", divide="ignore"):
+        means = np.rint(sums / counts)
+    for idx in np.flatnonzero(counts):
+        prepared[idx]["row"][column] = int(means[idx])
+
+
+def sample_rows(
+    patient_id: int,
+    method: str,
+    prepared: List[Dict[str, Any]],
+    expanded: Optional[Dict[str, np.ndarray]],
+    keep: Optional[Set[str]] = None
+) -> List[Dict[str, Any]]:
+    """
+    WearableSample rows for the expanded readings
+    keep: optional set of itemIds to emit (e.g. only new/changed records)
+    """
+    if expanded is None or not len(expanded["owner"]):
+        return []
+    metric = sample_metric(method)
+    owner, time, value = expanded["owner"], expanded["time"], expanded["value"]
+    if keep is not None:
+        kept = np.array([record["row"]["itemId"] in keep for record in prepared], dtype=bool)
+        mask = kept[owner]
+        owner, time, value = owner[mask], time[mask], value[mask]
+
+    item_ids = [prepared[idx]["row"]["itemId"] for idx in owner.tolist()]
+    times = time.astype(datetime).tolist()
+    return [
+        {
+            "patientId": patient_id,
+            "metric": metric,
+            "itemId": item_id,
+            "timestamp": t.replace(tzinfo=timezone.utc),
+            "value": v
+        }
+        for item_id, t, v in zip(item_ids, times, value.tolist())
+    ]
@@ -0,0 +1,388 @@
+"""
+Compressed Columnar Segment Store
+Optional storage engine for per-sample readings (WEARABLES_SAMPLE_STORE=segments).
+Instead of one WearableSample row per reading, each patient's samples are
+packed into one WearableSegment per (metric, UTC day):
+
+    header      magic, value encoding, count, first time, first delta
+    times       delta-of-delta milliseconds, narrowest int dtype, zlib
+    values      integer deltas (whole-number metrics such as heart rate) or
+                byte-shuffled float64, zlib
+    owners      index into the segment's itemId list, narrowest uint dtype, zlib
+    item ids    JSON list of the owning WearableData itemIds, zlib
+
+Regularly spaced samples make almost every delta-of-delta zero, so a day
+of heart rate costs a few bytes per reading. Reads decode whole segments
+into NumPy arrays; writes merge into the touched segments inside the
+ingest transaction, holding an advisory lock per (patient, day) so
+concurrent syncs of the same day merge one after the other instead of
+overwriting each other. Only segments whose contents change are rewritten.
+"""
+
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+from datetime import datetime, timezone
+import json
+import os
+import struct
+import zlib
+
+import numpy as np
+from prisma import Prisma
+from prisma.fields import Base64
+
+from rollups import DEFAULT_WINDOWS, RESOLUTIONS, to_utc_naive, truncate
+
+SAMPLE_STORE = os.getenv("WEARABLES_SAMPLE_STORE", "rows")  # rows | segments
+SEGMENT_COMPRESSION_LEVEL = int(os.getenv("WEARABLES_SEGMENT_COMPRESSION_LEVEL", "6"))
+
+MAGIC = b"WS1"
+HEADER = struct.Struct("<3sBIqq")
+SECTION = struct.Struct("<BI")
+
+VALUES_INT = 0
+VALUES_FLOAT = 1
+
+# Section dtype codes (index into this tuple)
+DTYPES = ("|i1", "<i2", "<i4", "<i8", "|u1", "<u2", "<u4")
+
+# Resolution -> datetime64 unit used to bucket decoded samples
+BUCKET_UNITS = {"minute": "m", "hour": "h", "day": "D"}
+
+# pg_advisory_xact_lock(namespace, hash of patient and day), taken in day order so writers never deadlock
+SEGMENT_LOCK_SQL = """
+SELECT pg_advisory_xact_lock(7202, hashtext($1::int || ':' || d))
+FROM jsonb_array_elements_text($2::jsonb) AS d
+ORDER BY d
+"""
+
+
+def _narrowest(values: np.ndarray, signed: bool) -> np.ndarray:
+    candidates = DTYPES[:4] if signed else DTYPES[4:]
+    if not len(values):
+        return values.astype(candidates[0])
+    low, high = int(values.min()), int(values.max())
+    for dtype in candidates:
+        info = np.iinfo(dtype)
+        if info.min <= low and high <= info.max:
+            return values.astype(dtype)
+    return values.astype(candidates[-1])
+
+
+def _pack(values: np.ndarray) -> bytes:
+    raw = zlib.compress(values.tobytes(), SEGMENT_COMPRESSION_LEVEL)
+    return SECTION.pack(DTYPES.index(values.dtype.str), len(raw)) + raw
+
+
+def _unpack(blob: bytes, pos: int) -> Tuple[np.ndarray, int]:
+    code, length = SECTION.unpack_from(blob, pos)
+    pos += SECTION.size
+    values = np.frombuffer(zlib.decompress(blob[pos:pos + length]), dtype=DTYPES[code])
+    return values, pos + length
+
+
+def encode_segment(times: np.ndarray, values: np.ndarray, owners: np.ndarray, item_ids: List[str]) -> bytes:
+    """
+    Pack time-sorted samples into one segment blob
+    times: int64 epoch milliseconds; values: float64; owners: index into item_ids
+    """
+    times = np.asarray(times, dtype=np.int64)
+    values = np.asarray(values, dtype=np.float64)
+    deltas = np.diff(times)
+    first_time = int(times[0]) if len(times) else 0
+    first_delta = int(deltas[0]) if len(deltas) else 0
+
+    whole = np.rint(values)
+    if np.array_equal(values, whole) and (not len(values) or np.abs(whole).max() < 2 ** 31):
+        encoding = VALUES_INT
+        value_section = _pack(_narrowest(np.diff(whole.astype(np.int64), prepend=0), signed=True))
+    else:
+        # Byte-shuffle so the slowly varying exponent bytes sit next to each other
+        encoding = VALUES_FLOAT
+        shuffled = values.astype("<f8").view(np.uint8).reshape(-1, 8).T.copy()
+        value_section = _pack(shuffled.reshape(-1))
+
+    item_blob = zlib.compress(json.dumps(item_ids).encode(), SEGMENT_COMPRESSION_LEVEL)
+    return b"".join([
+        HEADER.pack(MAGIC, encoding, len(times), first_time, first_delta),
+        _pack(_narrowest(np.diff(deltas), signed=True)),
+        value_section,
+        _pack(_narrowest(np.asarray(owners, dtype=np.int64), signed=False)),
+        SECTION.pack(0, len(item_blob)) + item_blob
+    ])
+
+
+def decode_segment(blob: bytes) -> Dict[str, Any]:
+    """Unpack a segment blob into {"time": int64 ms, "value": float64, "owner": int64, "items": [itemId]}"""
+    magic, encoding, count, first_time, first_delta = HEADER.unpack_from(blob, 0)
+    if magic != MAGIC:
+        raise ValueError("not a wearable segment")
+    pos = HEADER.size
+
+    dod, pos = _unpack(blob, pos)
+    deltas = np.empty(max(count - 1, 0), dtype=np.int64)
+    if len(deltas):
+        deltas[0] = first_delta
+        deltas[1:] = first_delta + np.cumsum(dod, dtype=np.int64)
+    times = np.empty(count, dtype=np.int64)
+    if count:
+        times[0] = first_time
+        times[1:] = first_time + np.cumsum(deltas)
+
+    packed, pos = _unpack(blob, pos)
+    if encoding == VALUES_INT:
+        values = np.cumsum(packed, dtype=np.int64).astype(np.float64)
+    else:
+        values = packed.reshape(8, -1).T.copy().view("<f8").reshape(-1)
+
+    owners, pos = _unpack(blob, pos)
+    _, length = SECTION.unpack_from(blob, pos)
+    pos += SECTION.size
+    items = json.loads(zlib.decompress(blob[pos:pos + length]))
+    return {"time": times, "value": values, "owner": owners.astype(np.int64), "items": items}
+
+
+def _to_ms(values: Iterable[datetime]) -> np.ndarray:
+    return np.array(
+        [np.datetime64(to_utc_naive(value), "ms") for value in values],
+        dtype="datetime64[ms]"
+    ).astype(np.int64)
+
+
+def covered_days(rows: Iterable[Dict[str, Any]]) -> Set[datetime]:
+    """UTC days spanned by WearableData rows (timestamp through endTime)"""
+    days: Set[datetime] = set()
+    for row in rows:
+        day = truncate(row["timestamp"], "day")
+        last = truncate(row.get("endTime") or row["timestamp"], "day")
+        while day <= last:
+            days.add(day)
+            day += RESOLUTIONS["day"]
+    return days
+
+
+def merge_segment(
+    existing: Optional[Dict[str, Any]],
+    times: np.ndarray,
+    values: np.ndarray,
+    items: np.ndarray,
+    replaced: Set[str]
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray, List[str]]:
+    """
+    Merge new samples into a decoded segment
+    Samples of replaced itemIds are dropped from the existing segment, and a
+    new sample wins over a stored one with the same (itemId, time).
+    Returns (times, values, owners, item_ids) sorted by time.
+    """
+    if existing is not None and len(existing["time"]):
+        old_items = np.asarray(existing["items"], dtype=object)[existing["owner"]]
+        keep = ~np.isin(old_items, list(replaced)) if replaced else np.ones(len(old_items), dtype=bool)
+        times = np.concatenate([existing["time"][keep], times])
+        values = np.concatenate([existing["value"][keep], values])
+        items = np.concatenate([old_items[keep], items])
+
+    item_ids, owners = np.unique(items.astype(str), return_inverse=True)
+    sequence = np.arange(len(times))
+    # Newest occurrence of each (owner, time) first, then keep the first of each run
+    order = np.lexsort((-sequence, times, owners))
+    first = np.ones(len(order), dtype=bool)
+    first[1:] = (owners[order][1:] != owners[order][:-1]) | (times[order][1:] != times[order][:-1])
+    chosen = order[first]
+    chosen = chosen[np.lexsort((owners[chosen], times[chosen]))]
+    return times[chosen], values[chosen], owners[chosen], item_ids.tolist()
+
+
+async def write_segments(
+    db: Prisma,
+    patient_id: int,
+    samples: List[Dict[str, Any]],
+    replaced: Optional[Set[str]] = None,
+    replaced_days: Optional[Set[datetime]] = None
+) -> int:
+    """
+    Merge WearableSample-shaped dicts into the patient's segments
+    replaced: itemIds whose previously stored samples must be discarded
+    replaced_days: UTC days those records covered (their old samples live there)
+    Must run inside a transaction: the touched days stay locked until it
+    commits. A segment is only rewritten when the merge changes it (a
+    replayed batch or a day without replaced samples costs no write).
+    Returns the number of segments rewritten.
+    """
+    replaced = replaced or set()
+    groups: Dict[Tuple[str, datetime], List[Dict[str, Any]]] = {}
+    for sample in samples:
+        key = (sample["metric"], truncate(sample["timestamp"], "day"))
+        groups.setdefault(key, []).append(sample)
+
+    days = {day for _, day in groups}
+    if replaced:
+        days |= replaced_days or set()
+    if not days:
+        return 0
+
+    await db.execute_raw(SEGMENT_LOCK_SQL, patient_id, json.dumps([day.date().isoformat() for day in sorted(days)]))
+    stored = await db.wearablesegment.find_many(
+        where={"patientId": patient_id, "bucketStart": {"in": sorted(days)}}
+    )
+    existing = {(s.metric, to_utc_naive(s.bucketStart)): s for s in stored}
+
+    written = 0
+    for key in set(groups) | {k for k in existing if replaced}:
+        metric, day = key
+        group = groups.get(key, [])
+        current = decode_segment(existing[key].data.decode()) if key in existing else None
+        if not group and not replaced.intersection(current["items"]):
+            continue  # a replaced day this metric's samples do not come from
+        times, values, owners, item_ids = merge_segment(
+            current,
+            _to_ms(sample["timestamp"] for sample in group),
+            np.array([sample["value"] for sample in group], dtype=np.float64),
+            np.array([sample["itemId"] for sample in group], dtype=object),
+            replaced
+        )
+        if not len(times):
+            if key in existing:
+                await db.wearablesegment.delete(where={"id": existing[key].id})
+                written += 1
+            continue
+        if current is not None and item_ids == list(current["items"]) and all(
+            np.array_equal(new, old) for new, old in (
+                (times, current["time"]), (values, current["value"]), (owners, current["owner"])
+            )
+        ):
+            continue  # nothing new, e.g. a replayed batch
+
+        data = {
+            "data": Base64.encode(encode_segment(times, values, owners, item_ids)),
+            "count": len(times),
+            "firstTime": datetime.fromtimestamp(times[0] / 1000, tz=timezone.utc),
+            "lastTime": datetime.fromtimestamp(times[-1] / 1000, tz=timezone.utc),
+            "min": float(values.min()),
+            "max": float(values.max()),
+            "sum": float(values.sum())
+        }
+        await db.wearablesegment.upsert(
+            where={"patientId_metric_bucketStart": {"patientId": patient_id, "metric": metric, "bucketStart": day}},
+            data={
+                "create": {"patientId": patient_id, "metric": metric, "bucketStart": day, **data},
+                "update": data
+            }
+        )
+        written += 1
+    return written
+
+
+async def read_segments(
+    db: Prisma,
+    patient_id: int,
+    metric: Optional[str] = None,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None
+) -> Dict[str, Dict[str, np.ndarray]]:
+    """
+    Decode every segment overlapping [start, end) into per-metric arrays
+    Returns {metric: {"time": datetime64[ms], "value": float64, "itemId": object}} in time order
+    """
+    where: Dict[str, Any] = {"patientId": patient_id}
+    if metric:
+        where["metric"] = metric
+    bounds: Dict[str, datetime] = {}
+    if start:
+        bounds["gte"] = truncate(start, "day")
+    if end:
+        bounds["lt"] = to_utc_naive(end)
+    if bounds:
+        where["bucketStart"] = bounds
+
+    stored = await db.wearablesegment.find_many(
+        where=where,
+        order=[{"metric": "asc"}, {"bucketStart": "asc"}]
+    )
+
+    parts: Dict[str, List[Dict[str, Any]]] = {}
+    for segment in stored:
+        parts.setdefault(segment.metric, []).append(decode_segment(segment.data.decode()))
+
+    low = np.datetime64(to_utc_naive(start), "ms").astype(np.int64) if start else None
+    high = np.datetime64(to_utc_naive(end), "ms").astype(np.int64) if end else None
+    result = {}
+    for name, decoded in parts.items():
+        times = np.concatenate([d["time"] for d in decoded])
+        values = np.concatenate([d["value"] for d in decoded])
+        item_ids = np.concatenate([np.asarray(d["items"], dtype=object)[d["owner"]] for d in decoded])
+        mask = np.ones(len(times), dtype=bool)
+        if low is not None:
+            mask &= times >= low
+        if high is not None:
+            mask &= times < high
+        result[name] = {
+            "time": times[mask].astype("datetime64[ms]"),
+            "value": values[mask],
+            "itemId": item_ids[mask]
+        }
+    return result
+
+
+async def segment_rollups(
+    db: Prisma,
+    patient_id: int,
+    resolution: str,
+    metric: Optional[str] = None,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None
+) -> List[Dict[str, Any]]:
+    """Aggregate decoded segments into the same points read_rollups returns"""
+    end = to_utc_naive(end) if end else datetime.utcnow()
+    start = to_utc_naive(start) if start else end - DEFAULT_WINDOWS[resolution]
+    series = await read_segments(db, patient_id, metric, truncate(start, resolution), end)
+
+    points = []
+    for name in sorted(series):
+        times, values = series[name]["time"], series[name]["value"]
+        if not len(times):
+            continue
+        buckets = times.astype(f"datetime64[{BUCKET_UNITS[resolution]}]")
+        starts, index, counts = np.unique(buckets, return_index=True, return_counts=True)
+        lows = np.minimum.reduceat(values, index)
+        highs = np.maximum.reduceat(values, index)
+        sums = np.add.reduceat(values, index)
+        for bucket, low, high, total, count in zip(
+            starts.astype("datetime64[s]").astype(datetime), lows.tolist(), highs.tolist(),
+            sums.tolist(), counts.tolist()
+        ):
+            points.append({
+                "metric": name,
+                "bucketStart": bucket.isoformat(),
+                "min": low,
+                "max": high,
+                "avg": total / count,
+                "sum": total,
+                "count": count
+            })
+    return points
+
+
+# Newest segment of one metric per patient; data as base64 text (raw queries return no Bytes type)
+LATEST_SEGMENTS_SQL = """
+SELECT DISTINCT ON ("patientId") "patientId", encode("data", 'base64') AS "data"
+FROM "WearableSegment"
+WHERE "metric" = $1 AND "patientId" IN ({ids})
+ORDER BY "patientId", "bucketStart" DESC
+"""
+
+
+async def latest_segment_samples(
+    db: Prisma,
+    patient_ids: List[int],
+    metric: str
+) -> Dict[int, Tuple[datetime, float]]:
+    """Newest stored sample of a metric per patient as (UTC-naive time, value), in one query"""
+    if not patient_ids:
+        return {}
+    ids = ", ".join(f"${i}::int" for i in range(2, len(patient_ids) + 2))
+    latest = {}
+    for r in await db.query_raw(LATEST_SEGMENTS_SQL.format(ids=ids), metric, *patient_ids):
+        decoded = decode_segment(Base64.fromb64(r["data"]).decode())
+        if len(decoded["time"]):
+            when = np.datetime64(int(decoded["time"][-1]), "ms").astype(datetime)
+            latest[r["patientId"]] = (when, float(decoded["value"][-1]))
+    return latest
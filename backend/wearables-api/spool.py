@@ -0,0 +1,527 @@
+"""
+Durable Write-Behind Ingest Spool
+Sync requests append their validated, encrypted rows to a local segmented
+append-only log and are acknowledged immediately. A background drainer
+replays the log into Postgres in large batches and checkpoints its
+position, so a crash or restart resumes where it left off.
+
+On-disk layout: WEARABLES_SPOOL_DIR holds one slot directory per process.
+At startup a process takes an exclusive lock on the lowest free slot, so
+uvicorn workers sharing the directory never write to the same segments or
+checkpoint, and a restarted worker picks up (and drains) what a previous
+process left behind in its slot:
+    slot-00/.lock                         flock held while the process runs
+    slot-00/segment-000000000001.log      records: [u32 length][u32 crc32][JSON]
+    slot-00/checkpoint.json               {"segment": n, "offset": bytes}
+    slot-00/dead-letter.log               records that could not be applied
+
+Slots can outlive their process: after a scale-down no worker reclaims
+the higher slot numbers. At startup and every WEARABLES_SPOOL_ADOPT_SECONDS
+each process therefore locks any other slot that has segments but no
+owner, drains it alongside its own, and unlocks it once it is empty.
+
+Replays are safe: the drainer writes through the idempotent
+(patientId, method, itemId) ingest path, so a record applied twice
+after a crash is counted as a duplicate rather than stored again.
+
+A batch that fails WEARABLES_SPOOL_MAX_ATTEMPTS times in a row is applied
+one record at a time; records that still fail while the database answers
+are appended to dead-letter.log (same framing as the segments, metric
+spool.dead_lettered) and skipped, so one bad record cannot stall the spool.
+"""
+
+from typing import Any, Dict, List, Optional, Tuple
+from datetime import datetime
+import asyncio
+import fcntl
+import json
+import os
+import struct
+import time
+import zlib
+
+from prisma import Prisma
+
+from shared.log import get_logger
+from shared.metrics import metrics
+
+from ingest import parse_timestamp, store_rows
+
+log = get_logger("wearables.spool")
+
+INGEST_MODE = os.getenv("WEARABLES_INGEST_MODE", "direct")  # direct | spool
+SPOOL_DIR = os.getenv("WEARABLES_SPOOL_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "spool"))
+SPOOL_SEGMENT_BYTES = int(os.getenv("WEARABLES_SPOOL_SEGMENT_BYTES", str(16 * 1024 * 1024)))
+SPOOL_MAX_BYTES = int(os.getenv("WEARABLES_SPOOL_MAX_BYTES", str(512 * 1024 * 1024)))
+SPOOL_FSYNC = os.getenv("WEARABLES_SPOOL_FSYNC", "interval")  # always | interval | never
+SPOOL_FSYNC_INTERVAL = float(os.getenv("WEARABLES_SPOOL_FSYNC_INTERVAL_MS", "200")) / 1000
+SPOOL_DRAIN_BATCH = int(os.getenv("WEARABLES_SPOOL_DRAIN_BATCH", "200"))
+SPOOL_DRAIN_IDLE = float(os.getenv("WEARABLES_SPOOL_DRAIN_IDLE_MS", "250")) / 1000
+SPOOL_SLOTS = int(os.getenv("WEARABLES_SPOOL_SLOTS", "64"))
+SPOOL_MAX_ATTEMPTS = int(os.getenv("WEARABLES_SPOOL_MAX_ATTEMPTS", "5"))
+SPOOL_ADOPT_SECONDS = float(os.getenv("WEARABLES_SPOOL_ADOPT_SECONDS", "60"))
+
+HEADER = struct.Struct("<II")
+DATETIME_FIELDS = ("timestamp", "startTime", "endTime")
+
+
+class SpoolFull(Exception):
+    """Raised when accepting a batch would exceed SPOOL_MAX_BYTES"""
+
+    def __init__(self, retry_after: int):
+        super().__init__(f"ingest spool full, retry after {retry_after}s")
+        self.retry_after = retry_after
+
+
+def _encode_row(row: Dict[str, Any]) -> Dict[str, Any]:
+    return {k: (v.isoformat() if isinstance(v, datetime) else v) for k, v in row.items()}
+
+
+def _decode_row(row: Dict[str, Any]) -> Dict[str, Any]:
+    for field in DATETIME_FIELDS:
+        if isinstance(row.get(field), str):
+            row[field] = parse_timestamp(row[field])
+    return row
+
+
+def _lock_slot(directory: str):
+    """Exclusive non-blocking flock on a slot directory; None if another process holds it"""
+    handle = open(os.path.join(directory, ".lock"), "a")
+    try:
+        fcntl.flock(handle.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        handle.close()
+        return None
+    return handle
+
+
+class IngestSpool:
+    """Segmented append-only log with a single background drainer"""
+
+    def __init__(
+        self,
+        directory: str = SPOOL_DIR,
+        segment_bytes: int = SPOOL_SEGMENT_BYTES,
+        max_bytes: int = SPOOL_MAX_BYTES,
+        fsync: str = SPOOL_FSYNC
+    ):
+        self.root = directory
+        self.directory = directory  # this process's slot once claimed
+        self.segment_bytes = segment_bytes
+        self.max_bytes = max_bytes
+        self.fsync = fsync
+
+        self._lock = asyncio.Lock()
+        self._writer = None
+        self._write_segment = 0
+        self._dirty = False
+        self._read_segment = 1
+        self._read_offset = 0
+        self._pending_bytes = 0
+        self._pending_records = 0
+        self._drain_lag = 0.0
+        self._drain_rate = 0.0  # bytes/second, smoothed
+        self._tasks: List[asyncio.Task] = []
+        self._wakeup = asyncio.Event()
+        self._slot_lock = None
+        self._failures = 0  # consecutive failed attempts at the current batch
+        self._adopted: Dict[str, "IngestSpool"] = {}  # orphaned slot directory -> its drainer
+        self._report = True  # adopted slots are reported through their adopter's gauges
+
+    # ------------------------------------------------------------------
+    # Paths and recovery
+    # ------------------------------------------------------------------
+
+    def _claim_slot(self) -> None:
+        """Lock the lowest free slot directory; raises RuntimeError when all are taken"""
+        for slot in range(SPOOL_SLOTS):
+            directory = os.path.join(self.root, f"slot-{slot:02d}")
+            os.makedirs(directory, exist_ok=True)
+            handle = _lock_slot(directory)
+            if handle is None:
+                continue
+            self._slot_lock = handle
+            self.directory = directory
+            return
+        raise RuntimeError(f"all {SPOOL_SLOTS} spool slots in {self.root} are locked by other processes")
+
+    def _segment_path(self, segment: int) -> str:
+        return os.path.join(self.directory, f"segment-{segment:012d}.log")
+
+    def _segments(self) -> List[int]:
+        return sorted(
+            int(name[8:20]) for name in os.listdir(self.directory)
+            if name.startswith("segment-") and name.endswith(".log")
+        )
+
+    def _load_checkpoint(self) -> Tuple[int, int]:
+        try:
+            with open(os.path.join(self.directory, "checkpoint.json")) as f:
+                data = json.load(f)
+            return int(data["segment"]), int(data["offset"])
+        except (OSError, ValueError, KeyError):
+            return 0, 0
+
+    def _save_checkpoint(self) -> None:
+        path = os.path.join(self.directory, "checkpoint.json")
+        tmp = path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump({"segment": self._read_segment, "offset": self._read_offset}, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+
+    def _scan(self, segment: int, offset: int, limit: Optional[int] = None, decode: bool = True):
+        """
+        Read valid records from segment starting at offset
+        Returns ([(record or None, size)], end offset); decode=False only measures
+        """
+        records = []
+        path = self._segment_path(segment)
+        if not os.path.exists(path):
+            return records, offset
+        with open(path, "rb") as f:
+            f.seek(offset)
+            while limit is None or len(records) < limit:
+                header = f.read(HEADER.size)
+                if len(header) < HEADER.size:
+                    break
+                length, crc = HEADER.unpack(header)
+                body = f.read(length)
+                if len(body) < length or zlib.crc32(body) != crc:
+                    break  # torn tail from a crash mid-append
+                records.append((json.loads(body) if decode else None, HEADER.size + length))
+                offset += HEADER.size + length
+        return records, offset
+
+    def recover(self) -> None:
+        """Claim a slot, rebuild pending counters from disk and drop any torn tail record"""
+        if self._slot_lock is None:
+            self._claim_slot()
+        segments = self._segments()
+        checkpoint_segment, checkpoint_offset = self._load_checkpoint()
+
+        self._read_segment, self._read_offset = checkpoint_segment, checkpoint_offset
+        if not segments:
+            self._read_segment, self._read_offset = max(checkpoint_segment, 1), 0
+        elif checkpoint_segment < segments[0]:
+            self._read_segment, self._read_offset = segments[0], 0
+
+        for segment in segments:
+            if segment < self._read_segment:
+                os.remove(self._segment_path(segment))
+                continue
+            start = self._read_offset if segment == self._read_segment else 0
+            records, end = self._scan(segment, start, decode=False)
+            if end < os.path.getsize(self._segment_path(segment)):
+                with open(self._segment_path(segment), "r+b") as f:
+                    f.truncate(end)
+                log.warning("spool.torn_record", segment=segment, offset=end)
+            self._pending_records += len(records)
+            self._pending_bytes += sum(size for _, size in records)
+
+        self._write_segment = max(segments[-1] if segments else 0, self._read_segment)
+        self._writer = open(self._segment_path(self._write_segment), "ab")
+        self._update_gauges()
+        if self._pending_records:
+            log.info("spool.recovered", batches=self._pending_records, bytes=self._pending_bytes)
+
+    def _adopt_slots(self) -> None:
+        """Lock every other slot that has segments but no running owner"""
+        for name in sorted(os.listdir(self.root)):
+            directory = os.path.join(self.root, name)
+            if not name.startswith("slot-") or directory == self.directory or directory in self._adopted:
+                continue
+            if not os.path.isdir(directory) or not any(f.startswith("segment-") for f in os.listdir(directory)):
+                continue
+            handle = _lock_slot(directory)
+            if handle is None:
+                continue  # a live process owns it
+            orphan = IngestSpool(self.root, self.segment_bytes, self.max_bytes, fsync="never")
+            orphan.directory, orphan._slot_lock, orphan._report = directory, handle, False
+            orphan.recover()
+            self._adopted[directory] = orphan
+            log.info("spool.slot_adopted", directory=directory, batches=orphan._pending_records)
+
+    def _release(self) -> None:
+        """Close an adopted slot, removing its segments once drained, and unlock it"""
+        if self._writer:
+            self._writer.close()
+            self._writer = None
+        if not self._pending_records:
+            for segment in self._segments():
+                os.remove(self._segment_path(segment))
+        if self._slot_lock:
+            self._slot_lock.close()
+            self._slot_lock = None
+
+    async def drain_adopted(self, db: Prisma) -> int:
+        """
+        Adopt orphaned slots and drain each until empty, then unlock it
+        Returns how many records were applied. A slot whose drain fails
+        stays adopted (and keeps its retry count) for the next pass.
+        """
+        await asyncio.to_thread(self._adopt_slots)
+        applied = 0
+        for directory, orphan in list(self._adopted.items()):
+            while True:
+                count = await orphan.drain_once(db)
+                if not count:
+                    break
+                applied += count
+            await asyncio.to_thread(orphan._release)
+            del self._adopted[directory]
+            metrics.incr("spool.slots_drained")
+            log.info("spool.slot_drained", directory=directory)
+        self._update_gauges()
+        return applied
+
+    # ------------------------------------------------------------------
+    # Producer side
+    # ------------------------------------------------------------------
+
+    def retry_after(self) -> int:
+        """Seconds until roughly a tenth of the spool has drained"""
+        if self._drain_rate <= 0:
+            return 5
+        return max(1, min(60, int(self.max_bytes * 0.1 / self._drain_rate) + 1))
+
+    async def append(
+        self,
+        patient_id: int,
+        method: str,
+        rows: List[Dict[str, Any]],
+        samples: Optional[List[Dict[str, Any]]] = None
+    ) -> None:
+        """
+        Durably enqueue one validated batch
+        Raises SpoolFull when bounded capacity is reached, ValueError if it can never fit
+        """
+        body = json.dumps({
+            "ts": time.time(),
+            "patient_id": patient_id,
+            "method": method,
+            "rows": [_encode_row(row) for row in rows],
+            "samples": [_encode_row(sample) for sample in samples or []]
+        }).encode()
+        record = HEADER.pack(len(body), zlib.crc32(body)) + body
+
+        if len(record) > self.max_bytes:
+            raise ValueError("batch is larger than the whole spool")
+
+        async with self._lock:
+            if self._pending_bytes + len(record) > self.max_bytes:
+                metrics.incr("spool.rejected_full")
+                raise SpoolFull(self.retry_after())
+
+            if self._writer.tell() + len(record) > self.segment_bytes and self._writer.tell() > 0:
+                self._rotate()
+            self._writer.write(record)
+            self._writer.flush()
+            if self.fsync == "always":
+                await asyncio.get_running_loop().run_in_executor(None, os.fsync, self._writer.fileno())
+            else:
+                self._dirty = True
+
+            self._pending_bytes += len(record)
+            self._pending_records += 1
+
+        metrics.incr("spool.appended_batches")
+        metrics.incr("spool.appended_rows", len(rows))
+        self._update_gauges()
+        self._wakeup.set()
+
+    def _rotate(self) -> None:
+        os.fsync(self._writer.fileno())
+        self._writer.close()
+        self._write_segment += 1
+        self._writer = open(self._segment_path(self._write_segment), "ab")
+        self._dirty = False
+
+    # ------------------------------------------------------------------
+    # Drainer side
+    # ------------------------------------------------------------------
+
+    def _read_batch(self) -> Tuple[List[Dict[str, Any]], int, int, int]:
+        """Collect up to SPOOL_DRAIN_BATCH records; returns (records, bytes, end segment, end offset)"""
+        collected: List[Dict[str, Any]] = []
+        consumed = 0
+        segment, offset = self._read_segment, self._read_offset
+        while len(collected) < SPOOL_DRAIN_BATCH:
+            records, end = self._scan(segment, offset, SPOOL_DRAIN_BATCH - len(collected))
+            collected.extend(record for record, _ in records)
+            consumed += end - offset
+            offset = end
+            if records and len(collected) >= SPOOL_DRAIN_BATCH:
+                break
+            if segment >= self._write_segment:
+                break
+            segment, offset = segment + 1, 0  # finished an older segment
+        return collected, consumed, segment, offset
+
+    async def _apply(self, db: Prisma, records: List[Dict[str, Any]]) -> None:
+        """Merge spooled batches per (patient, method) and write each group once"""
+        groups: Dict[Tuple[int, str], Dict[str, Dict[str, Any]]] = {}
+        group_samples: Dict[Tuple[int, str], Dict[str, List[Dict[str, Any]]]] = {}
+        for record in records:
+            key = (record["patient_id"], record["method"])
+            group = groups.setdefault(key, {})
+            samples = group_samples.setdefault(key, {})
+            for row in record["rows"]:
+                group[row["itemId"]] = _decode_row(row)
+                samples[row["itemId"]] = []
+            for sample in record.get("samples", []):
+                samples[sample["itemId"]].append(_decode_row(sample))
+        for key, rows in groups.items():
+            patient_id, method = key
+            samples = [sample for item in group_samples[key].values() for sample in item]
+            counts = await store_rows(db, patient_id, method, list(rows.values()), samples)
+            metrics.incr("spool.drained_rows", len(rows))
+            metrics.incr("spool.drained_new", counts["new"])
+
+    async def drain_once(self, db: Prisma) -> int:
+        """Drain one batch of records; returns how many were applied"""
+        records, consumed, segment, offset = await asyncio.to_thread(self._read_batch)
+        if not records:
+            if segment != self._read_segment:
+                self._advance(segment, offset, 0, 0)
+            return 0
+
+        started = time.perf_counter()
+        if self._failures < SPOOL_MAX_ATTEMPTS:
+            try:
+                await self._apply(db, records)
+            except Exception:
+                self._failures += 1
+                raise
+        else:
+            await self._apply_isolated(db, records)
+        self._failures = 0
+        elapsed = time.perf_counter() - started
+
+        self._advance(segment, offset, len(records), consumed)
+        self._drain_lag = time.time() - records[-1].get("ts", time.time()) if self._pending_records else 0.0
+        rate = consumed / elapsed if elapsed > 0 else 0.0
+        self._drain_rate = rate if not self._drain_rate else 0.8 * self._drain_rate + 0.2 * rate
+        metrics.observe("spool.drain_batch", elapsed)
+        self._update_gauges()
+        return len(records)
+
+    async def _apply_isolated(self, db: Prisma, records: List[Dict[str, Any]]) -> None:
+        """Apply records one at a time and dead-letter those that still fail"""
+        failed = []
+        for record in records:
+            try:
+                await self._apply(db, [record])
+            except Exception:
+                # During an outage every record fails; raise (and retry later) instead of dead-lettering
+                await db.query_raw("SELECT 1")
+                log.exception("spool.record_failed", patient_id=record.get("patient_id"), method=record.get("method"))
+                failed.append(record)
+        if failed:
+            await asyncio.to_thread(self._dead_letter, failed)
+
+    def _dead_letter(self, records: List[Dict[str, Any]]) -> None:
+        with open(os.path.join(self.directory, "dead-letter.log"), "ab") as f:
+            for record in records:
+                body = json.dumps({
+                    **record,
+                    "rows": [_encode_row(row) for row in record["rows"]],
+                    "samples": [_encode_row(sample) for sample in record.get("samples", [])]
+                }).encode()
+                f.write(HEADER.pack(len(body), zlib.crc32(body)) + body)
+            f.flush()
+            os.fsync(f.fileno())
+        metrics.incr("spool.dead_lettered", len(records))
+        log.error("spool.dead_lettered", records=len(records), directory=self.directory)
+
+    def _advance(self, segment: int, offset: int, records: int, consumed: int) -> None:
+        previous = self._read_segment
+        self._read_segment, self._read_offset = segment, offset
+        self._pending_records -= records
+        self._pending_bytes -= consumed
+        self._save_checkpoint()
+        for old in range(previous, segment):
+            path = self._segment_path(old)
+            if os.path.exists(path):
+                os.remove(path)
+
+    async def _drain_loop(self, db: Prisma) -> None:
+        backoff = 1.0
+        while True:
+            try:
+                if await self.drain_once(db):
+                    backoff = 1.0
+                    continue
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=SPOOL_DRAIN_IDLE * 20)
+                except asyncio.TimeoutError:
+                    pass
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                metrics.incr("spool.drain_errors")
+                log.exception("spool.drain_error", retry_in=backoff, attempts=self._failures)
+                await asyncio.sleep(backoff)
+                backoff = min(backoff * 2, 30.0)
+
+    async def _adopt_loop(self, db: Prisma) -> None:
+        while True:
+            try:
+                await self.drain_adopted(db)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                metrics.incr("spool.drain_errors")
+                log.exception("spool.adopt_error", slots=list(self._adopted))
+            await asyncio.sleep(SPOOL_ADOPT_SECONDS)
+
+    async def _fsync_loop(self) -> None:
+        while True:
+            await asyncio.sleep(SPOOL_FSYNC_INTERVAL)
+            if self._dirty:
+                self._dirty = False
+                await asyncio.to_thread(os.fsync, self._writer.fileno())
+
+    def _update_gauges(self) -> None:
+        if not self._report:
+            return
+        adopted = list(self._adopted.values())
+        metrics.set_gauge("spool.depth_batches", self._pending_records + sum(o._pending_records for o in adopted))
+        metrics.set_gauge("spool.depth_bytes", self._pending_bytes + sum(o._pending_bytes for o in adopted))
+        # Enqueue-to-apply delay of the most recently drained batch
+        metrics.set_gauge("spool.drain_lag_seconds", self._drain_lag)
+
+    # ------------------------------------------------------------------
+    # Lifecycle
+    # ------------------------------------------------------------------
+
+    async def start(self, db: Prisma) -> None:
+        await asyncio.to_thread(self.recover)
+        self._tasks.append(asyncio.create_task(self._drain_loop(db)))
+        self._tasks.append(asyncio.create_task(self._adopt_loop(db)))
+        if self.fsync == "interval":
+            self._tasks.append(asyncio.create_task(self._fsync_loop()))
+        log.info("spool.started", directory=self.directory, fsync=self.fsync)
+
+    async def stop(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks.clear()
+        if self._writer:
+            self._writer.flush()
+            os.fsync(self._writer.fileno())
+            self._writer.close()
+            self._writer = None
+        if self._slot_lock:
+            self._slot_lock.close()  # releases the flock
+            self._slot_lock = None
+        for orphan in self._adopted.values():
+            orphan._release()
+        self._adopted.clear()
+
+
+# Process-wide spool, only started when WEARABLES_INGEST_MODE=spool
+ingest_spool = IngestSpool()
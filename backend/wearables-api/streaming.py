@@ -0,0 +1,201 @@
+"""
+Streaming Sync Body Parser
+Reads a `{"data": [...]}` HCGateway sync body incrementally, yielding one
+item at a time, so peak memory depends on the chunk size rather than the
+upload size. Accepts `Content-Encoding: gzip` and `zstd` bodies.
+
+Decompression is bounded too: each step inflates at most OUTPUT_CHUNK
+bytes (zstd, which has no output cap, is fed small input slices instead),
+and a body whose decompressed size passes WEARABLES_MAX_BODY_BYTES is
+refused with 413, so a small compression bomb cannot exhaust memory.
+"""
+
+from typing import Any, AsyncIterator, Dict, Iterator, List, Optional
+import codecs
+import json
+import os
+import zlib
+
+try:
+    import zstandard
+except ImportError:  # optional: zstd uploads are refused without it
+    zstandard = None
+
+MAX_BODY_BYTES = int(os.getenv("WEARABLES_MAX_BODY_BYTES", str(64 * 1024 * 1024)))
+OUTPUT_CHUNK = 256 * 1024
+# An RLE block inflates ~4 input bytes to 128 KiB, so this bounds one zstd step to ~8 MiB
+ZSTD_INPUT_SLICE = 256
+
+WHITESPACE = " \t\n\r"
+DELIMITERS = WHITESPACE + ",]}"
+
+
+class SyncBodyError(ValueError):
+    """Malformed, oversized or unsupported sync body (mapped to HTTP 400/413/415)"""
+
+    def __init__(self, message: str, status_code: int = 400):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+def make_decompressor(content_encoding: Optional[str]):
+    """Return a streaming decompressor for the request's Content-Encoding (None for identity)"""
+    encoding = (content_encoding or "identity").strip().lower()
+    if encoding == "identity":
+        return None
+    if encoding in ("gzip", "x-gzip"):
+        return zlib.decompressobj(16 + zlib.MAX_WBITS)
+    if encoding == "deflate":
+        return zlib.decompressobj()
+    if encoding == "zstd":
+        if zstandard is None:
+            raise SyncBodyError("zstd uploads are not supported on this server", 415)
+        return zstandard.ZstdDecompressor().decompressobj()
+    raise SyncBodyError(f"unsupported Content-Encoding '{encoding}'", 415)
+
+
+def inflate(decompressor, chunk: bytes) -> Iterator[bytes]:
+    """Decompress one input chunk in bounded pieces"""
+    if hasattr(decompressor, "unconsumed_tail"):  # zlib: cap the output instead
+        while chunk:
+            yield decompressor.decompress(chunk, OUTPUT_CHUNK)
+            chunk = decompressor.unconsumed_tail
+    else:
+        for start in range(0, len(chunk), ZSTD_INPUT_SLICE):
+            yield decompressor.decompress(chunk[start:start + ZSTD_INPUT_SLICE])
+
+
+async def decoded_text(
+    chunks: AsyncIterator[bytes],
+    content_encoding: Optional[str],
+    max_bytes: int = MAX_BODY_BYTES
+) -> AsyncIterator[str]:
+    """Decompress and UTF-8 decode a byte stream incrementally, refusing bodies over max_bytes"""
+    decompressor = make_decompressor(content_encoding)
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    total = 0
+    try:
+        async for chunk in chunks:
+            pieces = [chunk] if decompressor is None else inflate(decompressor, chunk)
+            for piece in pieces:
+                total += len(piece)
+                if total > max_bytes:
+                    raise SyncBodyError(f"request body exceeds {max_bytes} bytes", 413)
+                if piece:
+                    yield decoder.decode(piece)
+        if hasattr(decompressor, "unconsumed_tail"):
+            tail = decompressor.flush()
+            if total + len(tail) > max_bytes:
+                raise SyncBodyError(f"request body exceeds {max_bytes} bytes", 413)
+            if tail:
+                yield decoder.decode(tail)
+        yield decoder.decode(b"", final=True)
+    except (zlib.error, UnicodeDecodeError) as e:
+        raise SyncBodyError(f"could not decode body: {e}")
+    except Exception as e:
+        if zstandard is not None and isinstance(e, zstandard.ZstdError):
+            raise SyncBodyError(f"could not decode body: {e}")
+        raise
+
+
+class _Reader:
+    """Text buffer over an async text stream with raw_decode support"""
+
+    def __init__(self, texts: AsyncIterator[str]):
+        self._texts = texts.__aiter__()
+        self.buf = ""
+        self.pos = 0
+        self.eof = False
+
+    async def _fill(self) -> bool:
+        if self.eof:
+            return False
+        try:
+            text = await self._texts.__anext__()
+        except StopAsyncIteration:
+            self.eof = True
+            return False
+        # Drop consumed text so the buffer only holds the item being parsed
+        self.buf = self.buf[self.pos:] + text
+        self.pos = 0
+        return True
+
+    async def peek(self) -> str:
+        """Next non-whitespace character ('' at end of input)"""
+        while True:
+            while self.pos < len(self.buf) and self.buf[self.pos] in WHITESPACE:
+                self.pos += 1
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if not await self._fill():
+                return ""
+
+    async def expect(self, char: str) -> None:
+        if await self.peek() != char:
+            raise SyncBodyError(f"invalid JSON body: expected '{char}'")
+        self.pos += 1
+
+    async def value(self) -> Any:
+        """Decode the next complete JSON value, reading more input as needed"""
+        await self.peek()
+        decoder = json.JSONDecoder()
+        while True:
+            try:
+                value, end = decoder.raw_decode(self.buf, self.pos)
+            except json.JSONDecodeError as e:
+                if await self._fill():
+                    continue
+                raise SyncBodyError(f"invalid JSON body: {e.msg}")
+            # A bare number/literal is only complete once a delimiter follows it
+            if self.buf[self.pos] not in "{[\"" and (end == len(self.buf) or self.buf[end] not in DELIMITERS):
+                if await self._fill():
+                    continue
+            self.pos = end
+            return value
+
+
+async def iter_sync_items(texts: AsyncIterator[str]) -> AsyncIterator[Dict[str, Any]]:
+    """Yield the elements of the top-level "data" array one at a time"""
+    reader = _Reader(texts)
+    await reader.expect("{")
+    found = False
+    while await reader.peek() != "}":
+        key = await reader.value()
+        if not isinstance(key, str):
+            raise SyncBodyError("invalid JSON body: expected an object key")
+        await reader.expect(":")
+        if key == "data" and not found:
+            found = True
+            await reader.expect("[")
+            if await reader.peek() == "]":
+                reader.pos += 1
+            else:
+                while True:
+                    yield await reader.value()
+                    separator = await reader.peek()
+                    reader.pos += 1
+                    if separator == "]":
+                        break
+                    if separator != ",":
+                        raise SyncBodyError("invalid JSON body: expected ',' or ']' in data")
+        else:
+            await reader.value()  # other keys are ignored
+        if await reader.peek() == ",":
+            reader.pos += 1
+    reader.pos += 1  # the closing '}'
+    if await reader.peek() != "":
+        raise SyncBodyError("invalid JSON body: unexpected data after the top-level object")
+    if not found:
+        raise SyncBodyError("request body has no 'data' array")
+
+
+async def iter_chunks(items: AsyncIterator[Dict[str, Any]], size: int) -> AsyncIterator[List[Dict[str, Any]]]:
+    """Group an item stream into lists of at most size items"""
+    chunk: List[Dict[str, Any]] = []
+    async for item in items:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
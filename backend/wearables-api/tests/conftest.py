@@ -0,0 +1,124 @@
+"""
+Test setup for the Wearables API
+Run from wearables-api/:  pytest
+Modules are imported the way main.py imports them (service directory and
+backend/ on sys.path). Nothing here needs Postgres: database calls go to
+the small fakes below.
+"""
+
+import os
+import sys
+from types import SimpleNamespace
+
+import pytest
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, ".."))
+sys.path.insert(0, os.path.join(HERE, "..", ".."))
+
+os.environ.setdefault("EMERGENCY_EVENT_BUS", "local")
+
+
+class FakeTable:
+    """In-memory stand-in for a Prisma model: records find_many filters, answers from rows"""
+
+    def __init__(self, rows=None):
+        self.rows = rows or []
+        self.calls = []
+
+    async def find_many(self, where=None, **kwargs):
+        self.calls.append(where)
+        return [row for row in self.rows if matches(row, where or {})]
+
+    async def create_many(self, data, skip_duplicates=False):
+        self.rows.extend(SimpleNamespace(**row) for row in data)
+        return len(data)
+
+    async def delete_many(self, where=None):
+        kept = [row for row in self.rows if not matches(row, where or {})]
+        deleted, self.rows = len(self.rows) - len(kept), kept
+        return deleted
+
+
+class RecordingDb:
+    """
+    Transaction-capable fake database
+    Raw statements are recorded in .statements as (sql, args); answers
+    registers (SQL fragment, callable(args) or value) pairs for results.
+    """
+
+    def __init__(self):
+        self.statements = []
+        self.answers = []
+        self.wearabledata = FakeTable()
+        self.wearablesample = FakeTable()
+
+    def _answer(self, sql, args, default):
+        self.statements.append((sql, args))
+        for fragment, result in self.answers:
+            if fragment in sql:
+                return result(args) if callable(result) else result
+        return default
+
+    async def execute_raw(self, sql, *args):
+        return self._answer(sql, args, 0)
+
+    async def query_raw(self, sql, *args):
+        return self._answer(sql, args, [])
+
+    def tx(self):
+        db = self
+
+        class Transaction:
+            async def __aenter__(self):
+                return db
+
+            async def __aexit__(self, *exc):
+                return False
+        return Transaction()
+
+    def ran(self, fragment):
+        """Recorded statements containing fragment"""
+        return [(sql, args) for sql, args in self.statements if fragment in sql]
+
+
+def matches(row, where):
+    """The subset of Prisma where-filters the tests use"""
+    for key, condition in where.items():
+        if key == "AND":
+            if not all(matches(row, part) for part in condition):
+                return False
+            continue
+        if key == "OR":
+            if not any(matches(row, part) for part in condition):
+                return False
+            continue
+        value = getattr(row, key)
+        if isinstance(condition, dict):
+            for op, bound in condition.items():
+                if op == "in" and value not in bound:
+                    return False
+                if op == "equals" and value != bound:
+                    return False
+                if op == "gte" and not value >= bound:
+                    return False
+                if op == "gt" and not value > bound:
+                    return False
+                if op == "lte" and not value <= bound:
+                    return False
+                if op == "lt" and not value < bound:
+                    return False
+        elif value != condition:
+            return False
+    return True
+
+
+@pytest.fixture
+def fake_db():
+    """db.wearabledata backed by a list of SimpleNamespace rows"""
+    return SimpleNamespace(wearabledata=FakeTable())
+
+
+@pytest.fixture
+def recording_db():
+    return RecordingDb()
@@ -0,0 +1,111 @@
+"""Anomaly detection cooldowns and escalation through shared/emergency.py"""
+
+import asyncio
+import json
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+import anomaly
+from conftest import FakeTable
+from shared.emergency import COOLDOWN_ERROR, create_emergency_alerts, new_alert_id
+from shared.models import EmergencyAlertCreate
+
+NOW = datetime(2024, 1, 1, 12, 0)
+
+
+class AlertTable(FakeTable):
+    async def create_many(self, data):
+        for row in data:
+            self.rows.append(SimpleNamespace(**row, createdAt=datetime.now(timezone.utc)))
+        return len(data)
+
+
+class PatientTable(FakeTable):
+    async def update_many(self, where, data):
+        return len(await self.find_many(where=where))
+
+
+class EmergencyDb:
+    def __init__(self, fail=False):
+        self.patient = PatientTable([SimpleNamespace(id=1, name="Pat", emergency=False)])
+        self.hospital = FakeTable()
+        self.emergencyalert = AlertTable()
+        self.fail = fail
+
+    async def execute_raw(self, query, *args):
+        return 0
+
+    def tx(self):
+        db = self
+
+        class Transaction:
+            async def __aenter__(self):
+                if db.fail:
+                    raise ConnectionError("database unavailable")
+                return db
+
+            async def __aexit__(self, *exc):
+                return False
+        return Transaction()
+
+
+@pytest.fixture(autouse=True)
+def fresh_state(monkeypatch):
+    monkeypatch.setattr(anomaly, "cooldowns", anomaly.TTLCache(maxsize=100, ttl=600))
+    monkeypatch.setattr(anomaly, "windows", anomaly.TTLCache(maxsize=100, ttl=600))
+
+
+@pytest.fixture
+def db():
+    return EmergencyDb()
+
+
+def vitals_alert(severity, metric="heartRate"):
+    return EmergencyAlertCreate(
+        alert_id=new_alert_id(), patient_id=1, alert_type="critical_vitals", severity=severity,
+        description="test", triggered_by="wearable", trigger_data=json.dumps({"metric": metric})
+    )
+
+
+def heart_rate(*values):
+    times = np.array([np.datetime64(NOW - timedelta(seconds=len(values) - i), "ms") for i in range(len(values))])
+    return {"heartRate": (times, np.array(values, dtype=np.float64))}
+
+
+def test_escalation_bypasses_cooldown(db):
+    created, _ = asyncio.run(create_emergency_alerts(db, [vitals_alert("high")], cooldown_seconds=600))
+    assert len(created) == 1
+
+    created, rejected = asyncio.run(create_emergency_alerts(
+        db, [vitals_alert("high"), vitals_alert("critical")], cooldown_seconds=600
+    ))
+    assert [row.severity for row in created] == ["critical"]
+    assert [r["error"] for r in rejected] == [COOLDOWN_ERROR]
+
+    # Once critical is open, neither critical nor high fires again
+    created, rejected = asyncio.run(create_emergency_alerts(
+        db, [vitals_alert("critical"), vitals_alert("high", metric="oxygenLevel")], cooldown_seconds=600
+    ))
+    assert [json.loads(row.triggerData)["metric"] for row in created] == ["oxygenLevel"]
+    assert len(rejected) == 1
+
+
+def test_local_cooldown_lets_escalation_through(db):
+    findings = anomaly.detect_anomalies(1, heart_rate(155), now=NOW)
+    assert [f["severity"] for f in findings] == ["high"]
+    asyncio.run(anomaly.raise_alerts(db, 1, findings))
+
+    assert anomaly.detect_anomalies(1, heart_rate(160), now=NOW) == []
+    findings = anomaly.detect_anomalies(1, heart_rate(190), now=NOW)
+    assert [f["severity"] for f in findings] == ["critical"]
+
+
+def test_failed_insert_does_not_start_cooldown():
+    findings = anomaly.detect_anomalies(1, heart_rate(190), now=NOW)
+    asyncio.run(anomaly.raise_alerts(EmergencyDb(fail=True), 1, findings))
+    assert anomaly.cooldowns.get((1, "heartRate")) is None
+    # The next batch retries the alert
+    assert [f["severity"] for f in anomaly.detect_anomalies(1, heart_rate(190), now=NOW)] == ["critical"]
@@ -0,0 +1,178 @@
+"""Ingest classification against stored rows"""
+
+import asyncio
+import json
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+from ingest import (
+    classify_existing,
+    content_digest,
+    dedupe_prepared,
+    delete_items,
+    normalize_method,
+    transform_item,
+    write_batch
+)
+
+T0 = datetime(2024, 1, 1)
+
+
+def item(item_id, minute, bpm=60):
+    time = (T0 + timedelta(minutes=minute)).isoformat() + "Z"
+    return {"metadata": {"id": item_id, "dataOrigin": "app"}, "time": time, "beatsPerMinute": bpm}
+
+
+def stored(record, digest=None, **values):
+    row = record["row"]
+    columns = {"endTime": None, "heartRate": row.get("heartRate"), "steps": None, "sleepHours": None, "oxygenLevel": None}
+    return SimpleNamespace(
+        patientId=1, method=row["method"], itemId=row["itemId"],
+        timestamp=row["timestamp"].replace(tzinfo=None), digest=digest or row["digest"], **{**columns, **values}
+    )
+
+
+def test_classification(fake_db):
+    unchanged = transform_item("heartRate", item("same", 0))
+    changed = transform_item("heartRate", item("changed", 1, bpm=70))
+    new = transform_item("heartRate", item("new", 2))
+    fake_db.wearabledata.rows = [stored(unchanged), stored(changed, digest="old")]
+
+    result = asyncio.run(classify_existing(fake_db, 1, "heartRate", [unchanged, changed, new]))
+    new_records, changed_records, unchanged_count = result
+    assert [r["row"]["itemId"] for r in new_records] == ["new"]
+    assert [r["row"]["itemId"] for r in changed_records] == ["changed"]
+    assert changed_records[0]["row"]["storedTimestamp"] == T0 + timedelta(minutes=1)
+    assert unchanged_count == 1
+
+
+def test_lookups_are_chunked_and_time_bounded(fake_db):
+    records = [transform_item("heartRate", item(f"i{n}", n)) for n in range(5)]
+    asyncio.run(classify_existing(fake_db, 1, "heartRate", records, chunk_size=2))
+    bounded = [call for call in fake_db.wearabledata.calls if "timestamp" in call]
+    assert len(bounded) == 3
+    assert bounded[0]["timestamp"] == {"gte": T0, "lte": T0 + timedelta(minutes=1)}
+
+
+def test_digest_ignores_timezone_spelling():
+    utc = content_digest({"a": 1}, "app", datetime.fromisoformat("2024-01-01T01:00:00+00:00"), None, None)
+    offset = content_digest({"a": 1}, "app", datetime.fromisoformat("2024-01-01T02:00:00+01:00"), None, None)
+    assert utc == offset
+
+
+def test_last_repeat_in_payload_wins():
+    first = transform_item("heartRate", item("x", 0, bpm=60))
+    second = transform_item("heartRate", item("x", 0, bpm=61))
+    records, repeats = dedupe_prepared([first, second])
+    assert repeats == 1
+    assert records == [second]
+
+
+def test_method_case_variants_are_one_record(fake_db):
+    # A client that switches "heartRate" -> "HeartRate" resyncs the same records, not new ones
+    first = transform_item(normalize_method("heartRate"), item("x", 0))
+    fake_db.wearabledata.rows = [stored(first)]
+    again = transform_item(normalize_method(" HeartRate"), item("x", 0))
+    new, changed, unchanged = asyncio.run(classify_existing(fake_db, 1, normalize_method("HeartRate"), [again]))
+    assert (new, changed, unchanged) == ([], [], 1)
+    assert fake_db.wearabledata.calls[0]["method"] == "heartrate"
+
+
+def test_record_moved_outside_the_batch_window_is_changed(fake_db):
+    # Stored at minute 0, resynced with a corrected time a day later
+    original = transform_item("heartRate", item("moved", 0))
+    fake_db.wearabledata.rows = [stored(original)]
+    moved = transform_item("heartRate", item("moved", 24 * 60))
+    other = transform_item("heartRate", item("fresh", 24 * 60 + 1))
+
+    new, changed, unchanged = asyncio.run(classify_existing(fake_db, 1, "heartRate", [moved, other]))
+    assert [r["row"]["itemId"] for r in new] == ["fresh"]
+    assert [r["row"]["itemId"] for r in changed] == ["moved"]
+    assert changed[0]["row"]["storedTimestamp"] == T0
+    # Only the unmatched ids are looked up without the time bound
+    unbounded = [call for call in fake_db.wearabledata.calls if "timestamp" not in call]
+    assert unbounded == [{"patientId": 1, "method": "heartRate", "itemId": {"in": ["moved", "fresh"]}}]
+
+
+def test_delete_reports_which_ids_were_deleted(recording_db):
+    stored_rows = {"recent": "2024-03-01T00:00:00", "old": "2023-01-01T00:00:00"}
+
+    def delete(args):
+        # args: patientId, method, start bound, *itemIds
+        start = args[2]
+        return [
+            {"itemId": item_id, "timestamp": stored_rows[item_id], "endTime": None, "heartRate": 60}
+            for item_id in args[3:] if item_id in stored_rows and stored_rows[item_id] >= start
+        ]
+    recording_db.answers.append(('DELETE FROM "WearableData"', delete))
+
+    deleted = asyncio.run(delete_items(
+        recording_db, 1, "heartrate", ["recent", "old", "unknown"], start=datetime(2024, 1, 1)
+    ))
+    # The caller reports "old" and "unknown" back instead of claiming they were removed
+    assert deleted == ["recent"]
+
+
+def built_rows(*records):
+    return [{**record["row"], "patientId": 1, "description": "{}"} for record in records]
+
+
+def test_new_rows_are_merged_into_rollups(recording_db):
+    rows = built_rows(transform_item("heartRate", item("a", 0)), transform_item("heartRate", item("b", 1)))
+    assert asyncio.run(write_batch(recording_db, rows, [])) == (2, 0)
+    assert recording_db.ran('INSERT INTO "WearableRollup"')
+    assert not recording_db.ran('DELETE FROM "WearableRollup"')
+
+
+def test_rows_a_concurrent_retry_inserted_are_not_counted_twice(recording_db):
+    rows = built_rows(transform_item("heartRate", item("a", 0)), transform_item("heartRate", item("b", 90)))
+
+    async def create_many(data, skip_duplicates=False):
+        return len(data) - 1  # "b" was committed by another request first
+    recording_db.wearabledata.create_many = create_many
+
+    assert asyncio.run(write_batch(recording_db, rows, [])) == (1, 0)
+    # No incremental merge; the covered days are recomputed from the stored rows instead
+    assert not recording_db.ran("ON CONFLICT")
+    (_, args), = recording_db.ran('DELETE FROM "WearableRollup"')
+    assert args == (1, "2024-01-01T00:00:00", "2024-01-02T00:00:00", '["heartRate"]')
+
+
+def test_changed_record_rebuilds_only_its_days_and_metrics(recording_db):
+    # Stored on Jan 1 with a heart rate, resynced to Jun 1 with a step count
+    moved = transform_item("heartRate", {**item("moved", 0), "time": "2024-06-01T12:00:00Z"})
+    moved["row"].update(heartRate=None, steps=100)
+    row, = built_rows(moved)
+    row.update(storedTimestamp=T0, storedEndTime=None, storedMetrics=["heartRate"])
+
+    assert asyncio.run(write_batch(recording_db, [], [row])) == (0, 1)
+    deletes = [args for _, args in recording_db.ran('DELETE FROM "WearableRollup"')]
+    assert deletes == [
+        (1, "2024-01-01T00:00:00", "2024-01-02T00:00:00", '["heartRate", "steps"]'),
+        (1, "2024-06-01T00:00:00", "2024-06-02T00:00:00", '["heartRate", "steps"]')
+    ]
+
+
+def test_segment_store_rebuild_skips_the_readings_it_holds(recording_db, monkeypatch):
+    import numpy as np
+    import ingest
+
+    async def write_segments(*args, **kwargs):
+        pass
+
+    async def read_segments(db, patient_id, metric=None, start=None, end=None):
+        return {"heartRate": {"itemId": np.array(["a", "other"], dtype=object)}}
+    monkeypatch.setattr(ingest, "SAMPLE_STORE", "segments")
+    monkeypatch.setattr(ingest, "write_segments", write_segments)
+    monkeypatch.setattr(ingest, "read_segments", read_segments)
+
+    changed, = built_rows(transform_item("heartRate", item("a", 0, bpm=70)))
+    changed.update(storedTimestamp=T0, storedEndTime=None, storedMetrics=["heartRate"])
+    asyncio.run(write_batch(recording_db, [], [changed]))
+
+    # WearableSample is empty in segments mode; the rebuild is told which rows the segments cover
+    rebuilds = recording_db.ran('INSERT INTO "WearableRollup"')
+    assert len(rebuilds) == 3
+    assert all(json.loads(args[5]) == [
+        {"itemId": "a", "metric": "heartRate"}, {"itemId": "other", "metric": "heartRate"}
+    ] for _, args in rebuilds)
@@ -0,0 +1,41 @@
+"""WearableData partition periods, names and bounds"""
+
+from datetime import datetime
+
+from partitions import next_period, partition_name, period_start, periods
+
+
+def test_monthly_periods_cover_range():
+    result = periods(datetime(2023, 11, 15), datetime(2024, 2, 1), "month")
+    assert result == [
+        (datetime(2023, 11, 1), datetime(2023, 12, 1)),
+        (datetime(2023, 12, 1), datetime(2024, 1, 1)),
+        (datetime(2024, 1, 1), datetime(2024, 2, 1)),
+        (datetime(2024, 2, 1), datetime(2024, 3, 1))
+    ]
+
+
+def test_periods_are_contiguous():
+    for interval in ("month", "week"):
+        result = periods(datetime(2023, 12, 20), datetime(2024, 3, 5), interval)
+        for (_, end), (start, _) in zip(result, result[1:]):
+            assert end == start
+
+
+def test_weekly_periods_start_on_monday():
+    start = period_start(datetime(2024, 1, 31, 13, 30), "week")
+    assert start == datetime(2024, 1, 29)
+    assert next_period(start, "week") == datetime(2024, 2, 5)
+
+
+def test_partition_names():
+    assert partition_name(datetime(2024, 1, 1), "month") == "WearableData_2024_01"
+    assert partition_name(datetime(2024, 1, 29), "week") == "WearableData_2024w05"
+    # ISO week 1 of 2025 starts in December 2024
+    assert partition_name(period_start(datetime(2024, 12, 31), "week"), "week") == "WearableData_2025w01"
+
+
+def test_aware_timestamps_are_normalised():
+    from datetime import timezone, timedelta
+    aware = datetime(2024, 3, 1, 1, 0, tzinfo=timezone(timedelta(hours=3)))
+    assert period_start(aware, "month") == datetime(2024, 2, 1)
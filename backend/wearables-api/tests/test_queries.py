@@ -0,0 +1,111 @@
+"""HCGateway fetch query translation and keyset paging"""
+
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+import pytest
+
+from conftest import matches
+from queries import (
+    QueryError,
+    advance_query,
+    build_fetch_query,
+    decode_cursor,
+    encode_cursor,
+    page_args
+)
+
+T0 = datetime(2024, 1, 1)
+
+
+def make_rows():
+    # Several rows share each timestamp so paging has to break ties on id
+    return [
+        SimpleNamespace(id=n, patientId=1, method="heartRate", timestamp=T0 + timedelta(minutes=n // 3),
+                        endTime=None, source="app", itemId=f"item-{n}")
+        for n in range(1, 31)
+    ]
+
+
+def fetch_page(rows, query, limit):
+    args = page_args(query, limit)
+    reverse = query["order"] == "desc"
+    found = sorted((r for r in rows if matches(r, args["where"])), key=lambda r: (r.timestamp, r.id), reverse=reverse)
+    return found[:limit]
+
+
+@pytest.mark.parametrize("order", ["asc", "desc"])
+def test_streamed_pages_visit_every_row_once(order):
+    rows = make_rows()
+    query = build_fetch_query(1, "heartRate", {"sort": order})
+    seen = []
+    page = fetch_page(rows, query, 4)
+    while page:
+        seen.extend(row.id for row in page)
+        query = advance_query(query, page[-1].timestamp, page[-1].id)
+        page = fetch_page(rows, query, 4)
+    expected = sorted((r.id for r in rows), reverse=order == "desc")
+    assert seen == expected
+
+
+@pytest.mark.parametrize("order", ["asc", "desc"])
+def test_cursor_pages_visit_every_row_once(order):
+    rows = make_rows()
+    seen, cursor = [], None
+    while True:
+        queries = {"sort": order, "limit": 7}
+        if cursor:
+            queries["cursor"] = cursor
+        query = build_fetch_query(1, "heartRate", queries)
+        page = fetch_page(rows, query, query["limit"])
+        if not page:
+            break
+        seen.extend(row.id for row in page)
+        cursor = encode_cursor(page[-1].timestamp, page[-1].id, order)
+    assert sorted(seen) == sorted(r.id for r in rows)
+    assert len(seen) == len(set(seen))
+
+
+def test_advance_query_does_not_grow():
+    query = build_fetch_query(1, "heartRate", {})
+    first = advance_query(query, T0, 5)
+    second = advance_query(first, T0, 3)
+    assert len(second["where"]["AND"]) == len(first["where"]["AND"])
+
+
+def test_cursor_round_trip_and_order_check():
+    cursor = encode_cursor(T0, 42, "asc")
+    assert decode_cursor(cursor) == {"t": T0, "id": 42, "o": "asc"}
+    with pytest.raises(QueryError):
+        build_fetch_query(1, "heartRate", {"sort": "desc", "cursor": cursor})
+
+
+@pytest.mark.parametrize("queries", [
+    {"start": {"$between": "2024-01-01"}},
+    {"start": "not a date"},
+    {"sort": "sideways"},
+    {"limit": 0},
+    {"cursor": "!!!"}
+])
+def test_malformed_queries(queries):
+    with pytest.raises((QueryError, ValueError)):
+        build_fetch_query(1, "heartRate", queries)
+
+
+def test_end_bound_also_bounds_timestamp():
+    query = build_fetch_query(1, "heartRate", {"end": {"$lt": "2024-02-01T00:00:00Z"}})
+    assert {"timestamp": {"lt": datetime.fromisoformat("2024-02-01T00:00:00+00:00")}} in query["filters"]
+
+
+@pytest.mark.parametrize("order,bound", [("asc", "gte"), ("desc", "lte")])
+def test_keyset_condition_keeps_an_index_range_bound(order, bound):
+    query = advance_query(build_fetch_query(1, "heartRate", {"sort": order}), T0, 5)
+    keyset = query["where"]["AND"][-1]
+    # A top-level range on timestamp, not only inside the OR, so each page seeks instead of rescanning
+    assert {"timestamp": {bound: T0}} in keyset["AND"]
+
+
+def test_method_matches_exactly():
+    # Case-insensitive matching cannot use the (patientId, method, timestamp) index
+    query = build_fetch_query(1, "heartrate", {})
+    assert query["filters"][0] == {"patientId": 1, "method": "heartrate"}
@@ -0,0 +1,102 @@
+"""Segment store: encoding, locking and minimal rewrites"""
+
+import asyncio
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+import numpy as np
+
+from conftest import FakeTable
+from segments import SEGMENT_LOCK_SQL, decode_segment, encode_segment, write_segments
+
+DAY = datetime(2024, 1, 1)
+
+
+class SegmentTable(FakeTable):
+    def __init__(self, log):
+        super().__init__()
+        self.log = log
+        self.next_id = 1
+
+    async def find_many(self, where=None, **kwargs):
+        self.log.append("read")
+        return [row for row in self.rows if row.bucketStart in where["bucketStart"]["in"]]
+
+    async def upsert(self, where, data):
+        key = where["patientId_metric_bucketStart"]
+        self.log.append(("write", key["metric"], key["bucketStart"]))
+        self.rows = [r for r in self.rows if (r.metric, r.bucketStart) != (key["metric"], key["bucketStart"])]
+        self.rows.append(SimpleNamespace(id=self.next_id, **data["create"]))
+        self.next_id += 1
+
+    async def delete(self, where):
+        self.log.append(("delete", where["id"]))
+        self.rows = [r for r in self.rows if r.id != where["id"]]
+
+
+class SegmentDb:
+    def __init__(self):
+        self.log = []
+        self.wearablesegment = SegmentTable(self.log)
+
+    async def execute_raw(self, query, *args):
+        self.log.append(("lock", args))
+        return 0
+
+
+def samples(item_id, metric, minutes, value=60.0, day=DAY):
+    return [
+        {"patientId": 1, "itemId": item_id, "metric": metric, "timestamp": day + timedelta(minutes=m), "value": value + m}
+        for m in minutes
+    ]
+
+
+def writes(db):
+    return [entry for entry in db.log if entry[0] in ("write", "delete")]
+
+
+def test_encode_round_trip():
+    times = np.array([0, 1000, 2000, 3500], dtype=np.int64) + 1_700_000_000_000
+    values = np.array([60.0, 61.0, 59.0, 70.0])
+    decoded = decode_segment(encode_segment(times, values, np.array([0, 0, 1, 1]), ["a", "b"]))
+    assert decoded["time"].tolist() == times.tolist()
+    assert decoded["value"].tolist() == values.tolist()
+    assert [decoded["items"][o] for o in decoded["owner"]] == ["a", "a", "b", "b"]
+
+
+def test_days_are_locked_before_they_are_read():
+    db = SegmentDb()
+    next_day = DAY + timedelta(days=1)
+    batch = samples("a", "heartRate", [5], day=next_day) + samples("b", "heartRate", [5])
+    asyncio.run(write_segments(db, 1, batch))
+    lock, read = db.log[0], db.log[1]
+    assert lock == ("lock", (1, '["2024-01-01", "2024-01-02"]'))
+    assert read == "read"
+    assert "ORDER BY d" in SEGMENT_LOCK_SQL
+
+
+def test_replayed_batch_rewrites_nothing():
+    db = SegmentDb()
+    batch = samples("a", "heartRate", [0, 1, 2])
+    assert asyncio.run(write_segments(db, 1, batch)) == 1
+    db.log.clear()
+    assert asyncio.run(write_segments(db, 1, batch)) == 0
+    assert writes(db) == []
+
+
+def test_replacing_records_only_rewrites_their_segments():
+    db = SegmentDb()
+    asyncio.run(write_segments(db, 1, samples("hr", "heartRate", [0, 1]) + samples("sp", "speed", [0, 1])))
+    db.log.clear()
+
+    # The heart-rate record changed; the speed segment on the same day is left alone
+    changed = samples("hr", "heartRate", [0, 1], value=80.0)
+    assert asyncio.run(write_segments(db, 1, changed, replaced={"hr"}, replaced_days={DAY})) == 1
+    assert writes(db) == [("write", "heartRate", DAY)]
+
+
+def test_deleting_last_record_removes_segment():
+    db = SegmentDb()
+    asyncio.run(write_segments(db, 1, samples("hr", "heartRate", [0])))
+    asyncio.run(write_segments(db, 1, [], replaced={"hr"}, replaced_days={DAY}))
+    assert db.wearablesegment.rows == []
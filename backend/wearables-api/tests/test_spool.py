@@ -0,0 +1,187 @@
+"""Write-behind ingest spool: replay, torn tails, dead letters"""
+
+import asyncio
+import os
+from datetime import datetime
+
+import pytest
+
+import spool
+from spool import IngestSpool, SpoolFull
+
+
+def row(item_id, minute=0):
+    return {"patientId": 1, "method": "heartRate", "itemId": item_id, "timestamp": datetime(2024, 1, 1, 0, minute)}
+
+
+class Recorder:
+    """Replaces ingest.store_rows: records what the drainer applies"""
+
+    def __init__(self, fail=()):
+        self.applied = []
+        self.fail = set(fail)
+
+    async def __call__(self, db, patient_id, method, rows, samples=None):
+        if any(r["itemId"] in self.fail for r in rows):
+            raise RuntimeError("bad record")
+        self.applied.extend(r["itemId"] for r in rows)
+        return {"new": len(rows), "updated": 0, "duplicates": 0}
+
+
+class Db:
+    async def query_raw(self, query, *args):
+        return [{"?column?": 1}]
+
+
+@pytest.fixture
+def recorder(monkeypatch):
+    recorder = Recorder()
+    monkeypatch.setattr(spool, "store_rows", recorder)
+    return recorder
+
+
+def drain(store):
+    async def run():
+        total = 0
+        while True:
+            applied = await store.drain_once(Db())
+            if not applied:
+                return total
+            total += applied
+    return asyncio.run(run())
+
+
+def close(store):
+    asyncio.run(store.stop())
+
+
+def test_restart_replays_unacknowledged_records(tmp_path, recorder):
+    store = IngestSpool(str(tmp_path), fsync="always")
+    store.recover()
+    asyncio.run(store.append(1, "heartRate", [row("a"), row("b")]))
+    close(store)
+
+    restarted = IngestSpool(str(tmp_path))
+    restarted.recover()
+    assert restarted._pending_records == 1
+    assert drain(restarted) == 1
+    assert recorder.applied == ["a", "b"]
+    close(restarted)
+
+    # The checkpoint moved past the record, so a second restart replays nothing
+    again = IngestSpool(str(tmp_path))
+    again.recover()
+    assert drain(again) == 0
+    close(again)
+
+
+def test_replayed_rows_keep_their_datetimes(tmp_path, monkeypatch):
+    seen = []
+
+    async def store_rows(db, patient_id, method, rows, samples=None):
+        seen.extend(r["timestamp"] for r in rows)
+        return {"new": len(rows)}
+    monkeypatch.setattr(spool, "store_rows", store_rows)
+    store = IngestSpool(str(tmp_path))
+    store.recover()
+    asyncio.run(store.append(1, "heartRate", [row("a", 5)]))
+    drain(store)
+    assert seen == [datetime(2024, 1, 1, 0, 5)]
+    close(store)
+
+
+def test_torn_tail_is_truncated(tmp_path, recorder):
+    store = IngestSpool(str(tmp_path))
+    store.recover()
+    asyncio.run(store.append(1, "heartRate", [row("a")]))
+    path = store._segment_path(store._write_segment)
+    close(store)
+    with open(path, "ab") as f:
+        f.write(b"\x40\x00\x00\x00partial")
+
+    restarted = IngestSpool(str(tmp_path))
+    restarted.recover()
+    assert restarted._pending_records == 1
+    assert drain(restarted) == 1
+    assert recorder.applied == ["a"]
+    close(restarted)
+
+
+def test_full_spool_rejects(tmp_path, recorder):
+    store = IngestSpool(str(tmp_path), max_bytes=400)
+    store.recover()
+    asyncio.run(store.append(1, "heartRate", [row("a")]))
+    with pytest.raises(SpoolFull):
+        asyncio.run(store.append(1, "heartRate", [row("b"), row("c")]))
+    close(store)
+
+
+def test_poison_record_is_dead_lettered(tmp_path, monkeypatch):
+    recorder = Recorder(fail={"bad"})
+    monkeypatch.setattr(spool, "store_rows", recorder)
+    monkeypatch.setattr(spool, "SPOOL_MAX_ATTEMPTS", 2)
+    store = IngestSpool(str(tmp_path))
+    store.recover()
+    asyncio.run(store.append(1, "heartRate", [row("good")]))
+    asyncio.run(store.append(1, "heartRate", [row("bad")]))
+
+    for _ in range(2):
+        with pytest.raises(RuntimeError):
+            asyncio.run(store.drain_once(Db()))
+    assert asyncio.run(store.drain_once(Db())) == 2
+    assert recorder.applied == ["good"]
+    assert os.path.getsize(os.path.join(store.directory, "dead-letter.log")) > 0
+    close(store)
+
+
+def test_workers_claim_separate_slots(tmp_path):
+    first, second = IngestSpool(str(tmp_path)), IngestSpool(str(tmp_path))
+    first.recover()
+    second.recover()
+    assert first.directory != second.directory
+    close(first)
+    close(second)
+
+
+def test_orphaned_slot_is_adopted_and_drained(tmp_path, recorder):
+    # Two workers, then a scale-down to one: nobody reclaims slot-01
+    survivor, stopped = IngestSpool(str(tmp_path)), IngestSpool(str(tmp_path))
+    survivor.recover()
+    stopped.recover()
+    asyncio.run(stopped.append(1, "heartRate", [row("orphaned")]))
+    close(stopped)
+
+    assert asyncio.run(survivor.drain_adopted(Db())) == 1
+    assert recorder.applied == ["orphaned"]
+    assert not survivor._adopted
+    # Drained and unlocked: nothing left to adopt, and a new worker can claim it
+    assert not [f for f in os.listdir(stopped.directory) if f.startswith("segment-")]
+    assert asyncio.run(survivor.drain_adopted(Db())) == 0
+    close(survivor)
+
+
+def test_live_slot_is_not_adopted(tmp_path, recorder):
+    first, second = IngestSpool(str(tmp_path)), IngestSpool(str(tmp_path))
+    first.recover()
+    second.recover()
+    asyncio.run(second.append(1, "heartRate", [row("owned")]))
+    assert asyncio.run(first.drain_adopted(Db())) == 0
+    assert recorder.applied == []
+    close(first)
+    close(second)
+
+
+def test_failed_adopted_drain_keeps_the_slot(tmp_path, monkeypatch):
+    recorder = Recorder(fail={"bad"})
+    monkeypatch.setattr(spool, "store_rows", recorder)
+    survivor, stopped = IngestSpool(str(tmp_path)), IngestSpool(str(tmp_path))
+    survivor.recover()
+    stopped.recover()
+    asyncio.run(stopped.append(1, "heartRate", [row("bad")]))
+    close(stopped)
+
+    with pytest.raises(RuntimeError):
+        asyncio.run(survivor.drain_adopted(Db()))
+    assert stopped.directory in survivor._adopted
+    assert survivor._adopted[stopped.directory]._failures == 1
+    close(survivor)
@@ -0,0 +1,82 @@
+"""Streaming sync body parser: item decoding and decompression limits"""
+
+import asyncio
+import gzip
+import json
+
+import pytest
+
+from streaming import SyncBodyError, decoded_text, iter_chunks, iter_sync_items
+
+
+async def _chunks(data: bytes, size: int = 7):
+    for start in range(0, len(data), size):
+        yield data[start:start + size]
+
+
+def parse(data: bytes, encoding=None, max_bytes=1024 * 1024, size=7):
+    async def run():
+        return [item async for item in iter_sync_items(decoded_text(_chunks(data, size), encoding, max_bytes))]
+    return asyncio.run(run())
+
+
+def test_items_split_across_chunks():
+    items = [{"time": "2024-01-01T00:00:00Z", "beatsPerMinute": n} for n in range(20)]
+    body = json.dumps({"meta": {"x": [1, 2]}, "data": items, "n": 12345}).encode()
+    assert parse(body, size=3) == items
+
+
+def test_bare_number_split_at_chunk_edge():
+    assert parse(b'{"data": [12345, 6]}', size=3) == [12345, 6]
+
+
+def test_empty_data():
+    assert parse(b'{"data": []}') == []
+
+
+def test_missing_data_rejected():
+    with pytest.raises(SyncBodyError) as e:
+        parse(b'{"other": 1}')
+    assert e.value.status_code == 400
+
+
+def test_trailing_garbage_rejected():
+    with pytest.raises(SyncBodyError) as e:
+        parse(b'{"data": [1]} {"data": [2]}')
+    assert e.value.status_code == 400
+
+
+def test_gzip_body():
+    items = [{"n": n} for n in range(50)]
+    body = gzip.compress(json.dumps({"data": items}).encode())
+    assert parse(body, "gzip") == items
+
+
+def test_oversized_body_rejected():
+    with pytest.raises(SyncBodyError) as e:
+        parse(json.dumps({"data": ["x" * 2000]}).encode(), max_bytes=1000)
+    assert e.value.status_code == 413
+
+
+def test_gzip_bomb_rejected_before_inflating():
+    bomb = gzip.compress(b'{"data": ["' + b"0" * (8 * 1024 * 1024) + b'"]}')
+    assert len(bomb) < 64 * 1024
+    with pytest.raises(SyncBodyError) as e:
+        parse(bomb, "gzip", max_bytes=1024 * 1024, size=len(bomb))
+    assert e.value.status_code == 413
+
+
+def test_unsupported_encoding():
+    with pytest.raises(SyncBodyError) as e:
+        parse(b"{}", "br")
+    assert e.value.status_code == 415
+
+
+def test_iter_chunks():
+    async def items():
+        for n in range(5):
+            yield n
+
+    async def run():
+        return [chunk async for chunk in iter_chunks(items(), 2)]
+    assert asyncio.run(run()) == [[0, 1], [2, 3], [4]]
@@ -140,8 +140,15 @@ export function subscribeToEmergencyAlerts(
   onError?: (error: Error) => void
 ): () => void {
   const eventSource = new EventSource(`${API_ENDPOINTS.EMERGENCY}/api/emergency/stream`);
+  // Replay after a reconnect repeats a window of recent ids; handle each id once
+  const seen = new Set<string>();
 
   eventSource.addEventListener('emergency_alert', (event) => {
+    if (event.lastEventId) {
+      if (seen.has(event.lastEventId)) return;
+      seen.add(event.lastEventId);
+      if (seen.size > 1000) seen.delete(seen.values().next().value as string);
+    }
     try {
       const alert = JSON.parse(event.data);
       onAlert(alert);